@@ -1,20 +1,42 @@
+import time
+# Start of the cold-start clock; see startup_profile below and benchmarks/cold_start.py
+MODULE_LOAD_STARTED = time.perf_counter()
+
 import os
 import sys
+import json
+import argparse
+import sqlalchemy
 import uvicorn
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional, Any
+from typing import Dict, List, Optional, Any
 import nest_asyncio
 import asyncio
 
 # Add parent directory to path to import digital_declutter
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from digital_declutter.agent import create_agent
+# Never open a browser for OAuth from inside the API process; log in from the CLI instead
+os.environ.setdefault("DECLUTTER_INTERACTIVE_AUTH", "0")
+
+from digital_declutter.agent import (create_agent, get_gmail, get_gmail_pool, get_instruction_cache, get_job_queue,
+                                    get_router)
+from digital_declutter.cancellation import CancelToken, bind_token, reset_token
+from digital_declutter import metrics, tracing
+from digital_declutter.shared_state import connect, state_db_path
+from digital_declutter.tools.gmail_pool import bind_account, reset_account, validate_account
+from digital_declutter.usage import (SessionUsageStore, Usage, bind_usage, format_breakdown, reset_usage,
+                                     session_token_budget)
+from google.adk.errors.already_exists_error import AlreadyExistsError
 from google.adk.runners import Runner
-from google.adk.sessions import InMemorySessionService
+from google.adk.sessions import DatabaseSessionService, InMemorySessionService
 from google.genai import types
 
+# Seconds since this module started loading at which each startup phase finished
+startup_profile = {"imports": round(time.perf_counter() - MODULE_LOAD_STARTED, 3)}
+
 # Apply nest_asyncio to allow nested event loops if needed
 nest_asyncio.apply()
 
@@ -25,34 +47,92 @@ agent = None
 runner = None
 session_service = None
 agent_init_lock = asyncio.Lock()
+session_lock = asyncio.Lock()
 APP_NAME = "declutter_app"
 SESSION_ID = "session_1"
 USER_ID = "user"
+# How often to check whether the client is still connected (seconds)
+DISCONNECT_POLL_INTERVAL = 0.5
+# Non-standard "client closed request" status, as used by nginx
+CLIENT_CLOSED_REQUEST = 499
+cancelled_requests = 0
+# Accumulated model usage per (user id, session id); shared by all workers when DECLUTTER_STATE_DB is set
+session_usage = SessionUsageStore(state_db_path())
+# Default number of worker processes in production mode (1: the dev server with auto-reload)
+DEFAULT_WORKERS = int(os.getenv("DECLUTTER_WORKERS", "1"))
+# How long a stopping worker waits for in-flight requests to finish (seconds)
+DRAIN_SECONDS = int(os.getenv("DECLUTTER_DRAIN_SECONDS", "30"))
 
 class ChatRequest(BaseModel):
     message: str
+    # Each conversation gets its own ADK session; omitted means the shared default session
+    session_id: Optional[str] = None
+    # Whose mailbox to work on; omitted means the default account (digital_declutter/token.json)
+    user_id: Optional[str] = None
+
+class JobRequest(BaseModel):
+    # Steps like {"action": "archive" | "trash" | "create_task", "email_id": "...", "task": {...}}
+    actions: List[Dict[str, Any]]
+    user_id: Optional[str] = None
 
 class ChatResponse(BaseModel):
     response: str
+    # Token counts and estimated cost of this request and of the whole session
+    usage: Optional[Dict[str, Any]] = None
+
+def create_session_service():
+    """
+    Conversations in DECLUTTER_SESSION_DB (SQLite) when set, so any worker can
+    continue any session; otherwise in this process's memory.
+    """
+    db_path = os.getenv("DECLUTTER_SESSION_DB")
+    if db_path:
+        # Wait for another worker's write instead of failing with "database is locked"
+        service = DatabaseSessionService(db_url=f"sqlite+aiosqlite:///{os.path.abspath(db_path)}",
+                                         connect_args={"timeout": 30})
+
+        @sqlalchemy.event.listens_for(service.db_engine.sync_engine, "connect")
+        def tune(dbapi_connection, _):
+            # The file is in WAL mode (see prepare_session_db); NORMAL skips an fsync per event
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.close()
+        return service
+    return InMemorySessionService()
+
+def prepare_session_db():
+    """
+    Creates the session tables before the workers start, which would otherwise
+    race to create them, and switches the file to WAL (a persistent setting).
+    """
+    service = create_session_service()
+    if isinstance(service, DatabaseSessionService):
+        async def prepare():
+            await service.prepare_tables()
+            await service.close()
+        asyncio.run(prepare())
+        connect(os.getenv("DECLUTTER_SESSION_DB")).close()
 
 async def ensure_agent_initialized():
-    """Initialize agent lazily on first request to avoid MCP startup issues"""
+    """Initializes the agent once, from the startup warm-up or whichever request needs it first"""
     global agent, runner, session_service
     
     async with agent_init_lock:
         if agent is not None:
             return  # Already initialized
         
-        print("Initializing Agent (lazy)...")
-        mcp_config_path = os.path.join(os.path.dirname(__file__), '..', 'mcp_config.json')
+        print("Initializing Agent...")
+        mcp_config_path = os.getenv("DECLUTTER_MCP_CONFIG", os.path.join(os.path.dirname(__file__), '..', 'mcp_config.json'))
         
         try:
-            agent = await create_agent(model_name="gemini-2.5-flash-lite", mcp_config_path=mcp_config_path)
-            session_service = InMemorySessionService()
+            agent = await create_agent(mcp_config_path=mcp_config_path)
+            session_service = create_session_service()
             runner = Runner(agent=agent, app_name=APP_NAME, session_service=session_service)
             
             # Create session
-            await session_service.create_session(app_name=APP_NAME, user_id=USER_ID, session_id=SESSION_ID)
+            await ensure_session(USER_ID, SESSION_ID)
+            # Job steps need the Notion MCP tool, so jobs (including ones resumed from a restart) start now
+            await get_job_queue().start()
             print("Agent initialized successfully!")
         except Exception as e:
             print(f"Error initializing agent: {e}")
@@ -60,6 +140,16 @@ async def ensure_agent_initialized():
             traceback.print_exc()
             raise HTTPException(status_code=503, detail=f"Failed to initialize agent: {str(e)}")
 
+async def ensure_session(user_id: str, session_id: str):
+    """Creates the ADK session for this conversation on first use."""
+    async with session_lock:
+        session = await session_service.get_session(app_name=APP_NAME, user_id=user_id, session_id=session_id)
+        if session is None:
+            try:
+                await session_service.create_session(app_name=APP_NAME, user_id=user_id, session_id=session_id)
+            except AlreadyExistsError:
+                pass  # Another worker created it first
+
 def debug_log(message: str):
     """Log message to debug.log with timestamp"""
     import datetime
@@ -69,31 +159,47 @@ def debug_log(message: str):
     with open("debug.log", "a", encoding="utf-8") as f:
         f.write(log_entry)
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
-    debug_log(f"Received chat request: {request.message}")
-    
-    # Initialize agent on first request
-    try:
-        await ensure_agent_initialized()
-    except Exception as e:
-        debug_log(f"Agent initialization failed: {e}")
-        raise HTTPException(status_code=503, detail=f"Agent initialization failed: {e}")
-    
-    global runner
-    if not runner:
-        debug_log("Error: Agent not initialized after ensure_agent_initialized")
-        raise HTTPException(status_code=503, detail="Agent not initialized")
-    
+def event_kind(event) -> str:
+    if getattr(event, 'partial', False):
+        return "partial"
+    if event.get_function_calls():
+        return "tool_call"
+    if event.get_function_responses():
+        return "tool_response"
+    return "message"
+
+def remaining_budget(user_id: str, session_id: str) -> Optional[int]:
+    """Tokens this session may still use, or None without a budget."""
+    budget = session_token_budget()
+    if budget is None:
+        return None
+    return budget - session_usage.get(user_id, session_id).total_tokens
+
+async def run_agent(message, user_id: str, session_id: str, token: CancelToken, request_usage: Usage) -> str:
+    """Runs one agent turn and returns the concatenated response text."""
+    # Bound inside the task so tools (and their worker threads) see this request's token, usage and mailbox
+    handle = bind_token(token)
+    usage_handle = bind_usage(request_usage)
+    account_handle = bind_account(None if user_id == USER_ID else user_id)
+    model_calls = 0
     try:
-        message = types.Content(parts=[types.Part(text=request.message)])
         full_response = ""
         
         debug_log("Starting agent run loop...")
-        async for event in runner.run_async(user_id=USER_ID, session_id=SESSION_ID, new_message=message):
+        waiting_since = time.time_ns()
+        async for event in runner.run_async(user_id=user_id, session_id=session_id, new_message=message):
             # Log event type
             event_type = type(event).__name__
             debug_log(f"Event received: {event_type}")
+
+            kind = event_kind(event)
+            metrics.AGENT_EVENTS.labels(kind).inc()
+            now = time.time_ns()
+            # Time spent waiting for this event: model thinking, or tools running
+            tracing.record_span(f"event {kind}", "runner", waiting_since, now, author=event.author)
+            waiting_since = now
+            if kind != "partial" and getattr(event, 'usage_metadata', None) is not None:
+                model_calls += 1
             
             if hasattr(event, 'content') and event.content:
                 debug_log(f"Event content: {event.content}")
@@ -111,18 +217,287 @@ async def chat(request: ChatRequest):
             if hasattr(event, 'tool_response') and event.tool_response:
                 debug_log(f"Tool Response: {event.tool_response}")
 
+        return full_response
+    finally:
+        metrics.AGENT_MODEL_CALLS_PER_REQUEST.observe(model_calls)
+        metrics.REQUEST_TOKENS.labels("input").observe(request_usage.input_tokens)
+        metrics.REQUEST_TOKENS.labels("cached").observe(request_usage.cached_tokens)
+        metrics.REQUEST_TOKENS.labels("output").observe(request_usage.output_tokens)
+        metrics.REQUEST_COST.observe(request_usage.cost_usd)
+        session_usage.add(user_id, session_id, request_usage)
+        reset_account(account_handle)
+        reset_usage(usage_handle)
+        reset_token(handle)
+
+async def cancel_on_disconnect(http_request: Request, task: asyncio.Task, token: CancelToken):
+    """Cancels `task` as soon as the client that started it goes away."""
+    while not task.done():
+        if await http_request.is_disconnected():
+            token.cancel("client disconnected")
+            task.cancel()
+            return
+        await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    metrics.HTTP_IN_FLIGHT.inc()
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        metrics.HTTP_IN_FLIGHT.dec()
+        # Label by route template, not raw path, to keep label cardinality bounded
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        metrics.HTTP_REQUEST_SECONDS.labels(request.method, path, status).observe(time.perf_counter() - started)
+
+@app.post("/chat", response_model=ChatResponse)
+async def chat(request: ChatRequest, http_request: Request, http_response: Response):
+    global cancelled_requests
+    debug_log(f"Received chat request: {request.message}")
+    
+    # Initialize agent on first request
+    try:
+        await ensure_agent_initialized()
+    except Exception as e:
+        debug_log(f"Agent initialization failed: {e}")
+        raise HTTPException(status_code=503, detail=f"Agent initialization failed: {e}")
+    
+    if not runner:
+        debug_log("Error: Agent not initialized after ensure_agent_initialized")
+        raise HTTPException(status_code=503, detail="Agent not initialized")
+    
+    session_id = request.session_id or SESSION_ID
+    user_id = request.user_id or USER_ID
+    try:
+        validate_account(user_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    remaining = remaining_budget(user_id, session_id)
+    if remaining is not None and remaining <= 0:
+        metrics.SESSION_BUDGET_EXCEEDED.inc()
+        raise HTTPException(status_code=429, detail=f"Session {session_id} has used up its token budget "
+                                                    f"({session_token_budget()} tokens)")
+    await ensure_session(user_id, session_id)
+    
+    message = types.Content(parts=[types.Part(text=request.message)])
+    token = CancelToken()
+    # The agent stops calling the model once the request uses up what's left of the budget
+    request_usage = Usage(token_limit=remaining)
+    # Root span of this request's trace (None unless tracing is enabled); the run task inherits it
+    trace_span = tracing.start_span("POST /chat", "request", root=True, session_id=session_id, user_id=user_id,
+                                    message_chars=len(request.message))
+    if trace_span:
+        http_response.headers["X-Trace-Id"] = trace_span.trace.trace_id
+    run_task = asyncio.create_task(run_agent(message, user_id, session_id, token, request_usage))
+    watcher = asyncio.create_task(cancel_on_disconnect(http_request, run_task, token))
+    
+    try:
+        full_response = await run_task
         debug_log(f"Agent run completed. Final response length: {len(full_response)}")
-        return ChatResponse(response=full_response)
+        debug_log(f"Usage: {request_usage.total_tokens} tokens (${request_usage.cost_usd:.4f}) in "
+                  f"{request_usage.model_calls} model calls; largest prompt: "
+                  f"{format_breakdown(request_usage.prompt_breakdown) or 'n/a'}")
+        if trace_span:
+            trace_span.set(response_chars=len(full_response), **{
+                "tokens." + k: v for k, v in request_usage.to_dict().items() if k != "prompt_breakdown"})
+        return ChatResponse(response=full_response, usage={
+            "request": request_usage.to_dict(),
+            "session": session_usage.get(user_id, session_id).to_dict(),
+        })
+    
+    except asyncio.CancelledError:
+        if not token.cancelled:
+            # The server itself is cancelling us (e.g. shutdown); stop the agent too
+            token.cancel("server cancelled request")
+            raise
+        cancelled_requests += 1
+        if trace_span:
+            trace_span.set(error="cancelled")
+        debug_log(f"Agent run cancelled: {token.reason}")
+        return Response(status_code=CLIENT_CLOSED_REQUEST)
         
     except Exception as e:
         import traceback
         error_msg = f"Error during chat: {e}\n{traceback.format_exc()}"
         debug_log(f"EXCEPTION: {error_msg}")
+        if trace_span:
+            trace_span.set(error=type(e).__name__)
         raise HTTPException(status_code=500, detail=str(e))
+    
+    finally:
+        watcher.cancel()
+        tracing.end_span(trace_span)
+
+def account_for(user_id: Optional[str]) -> Optional[str]:
+    """The pooled Gmail account for a request's user id; None is the default account."""
+    if not user_id or user_id == USER_ID:
+        return None
+    try:
+        return validate_account(user_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# --- Background jobs ---
+
+@app.post("/jobs", status_code=202)
+async def submit_job(request: JobRequest):
+    await ensure_agent_initialized()
+    try:
+        job_id = await get_job_queue().submit(request.actions, account=account_for(request.user_id))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return get_job_queue().get(job_id, steps=False)
+
+@app.get("/jobs")
+async def list_jobs(user_id: Optional[str] = None, limit: int = 20):
+    return {"jobs": get_job_queue().store.recent(limit=min(limit, 100), account=account_for(user_id))}
+
+def owned_job(job_id: str, user_id: Optional[str], steps: bool = True) -> dict:
+    """The job if it belongs to the user's account; another account's job is reported as missing."""
+    job = get_job_queue().get(job_id, steps=steps)
+    if job is None or job["account"] != account_for(user_id):
+        raise HTTPException(status_code=404, detail=f"No job {job_id}")
+    return job
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str, user_id: Optional[str] = None):
+    return owned_job(job_id, user_id)
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, user_id: Optional[str] = None):
+    """Server-sent events with the job's progress on every change, ending when the job finishes."""
+    owned_job(job_id, user_id, steps=False)
+
+    async def stream():
+        async for job in get_job_queue().watch(job_id):
+            yield f"event: progress\ndata: {json.dumps(job)}\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str, user_id: Optional[str] = None):
+    owned_job(job_id, user_id, steps=False)
+    job = await get_job_queue().cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No job {job_id}")
+    return job
+
+async def warm_up():
+    """Initializes the agent (MCP servers) and Gmail credentials ahead of the first request."""
+    async def agent_ready():
+        await ensure_agent_initialized()
+        startup_profile["agent"] = round(time.perf_counter() - MODULE_LOAD_STARTED, 3)
+
+    async def gmail_ready():
+        # Loads token.json, refreshes it if needed and builds the API client, off the event loop
+        gmail = await asyncio.to_thread(get_gmail)
+        if gmail.credential_manager:
+            # From now on the token is refreshed ahead of expiry, never on a request
+            gmail.credential_manager.start_background_refresh()
+        startup_profile["gmail"] = round(time.perf_counter() - MODULE_LOAD_STARTED, 3)
+
+    try:
+        # Independent, so the OAuth refresh overlaps with the MCP servers booting
+        await asyncio.gather(agent_ready(), gmail_ready())
+    except Exception as e:
+        # The first /chat request retries whatever failed here
+        print(f"Warm-up failed: {e}")
+        return
+    startup_profile["ready"] = round(time.perf_counter() - MODULE_LOAD_STARTED, 3)
+    print(f"Ready for requests {startup_profile['ready']:.2f}s after import started ({startup_profile})")
+
+@app.on_event("startup")
+async def startup():
+    startup_profile["serving"] = round(time.perf_counter() - MODULE_LOAD_STARTED, 3)
+    # Idle accounts release their clients, caches and token refresh threads (stopped in shutdown)
+    get_gmail_pool().start_idle_eviction()
+    if metrics.get_shared_metrics() is not None:
+        app.state.metrics_publisher = asyncio.create_task(publish_metrics())
+    # In the background, so the server starts accepting connections (and /health) right away;
+    # requests that arrive meanwhile wait for the same initialization
+    if os.getenv("DECLUTTER_LAZY_INIT") != "1":
+        app.state.warm_up = asyncio.create_task(warm_up())
+
+async def publish_metrics():
+    """Keeps this worker's metrics in the shared snapshot store that /metrics merges."""
+    while True:
+        try:
+            # On the loop: it takes well under a millisecond, and worker threads may all be busy with tools
+            metrics.get_shared_metrics().publish(str(os.getpid()), metrics.REGISTRY.snapshot())
+        except Exception as e:
+            print(f"Publishing metrics failed: {e}")
+        await asyncio.sleep(metrics.PUBLISH_INTERVAL_SECONDS)
+
+@app.on_event("shutdown")
+async def shutdown():
+    publisher = getattr(app.state, "metrics_publisher", None)
+    if publisher is not None:
+        publisher.cancel()
+        # Counters and histograms of this worker keep counting towards the totals; gauges end with it
+        metrics.get_shared_metrics().publish(str(os.getpid()), metrics.REGISTRY.snapshot(gauges=False))
+    # Context cache entries are billed per hour of storage; don't leave them behind
+    await get_instruction_cache().close()
+    # Unfinished job steps stay pending in the database and resume on the next start
+    await get_job_queue().stop()
+    get_gmail_pool().close()
+    from digital_declutter.tools.credentials import stop_all
+    stop_all()
 
 @app.get("/health")
 async def health():
-    return {"status": "ok", "agent_initialized": agent is not None}
+    return {
+        "status": "ok",
+        "agent_initialized": agent is not None,
+        "worker_pid": os.getpid(),
+        "startup": startup_profile,
+        "cancelled_requests": cancelled_requests,
+        "sessions": len(session_usage),
+        "gmail_accounts": get_gmail_pool().stats(),
+        "session_token_budget": session_token_budget(),
+        "model_routes": get_router().snapshot(),
+    }
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    shared = metrics.get_shared_metrics()
+    if shared is None:
+        content = metrics.render()
+    else:
+        # Any worker may answer the scrape, so it reports all of them
+        shared.publish(str(os.getpid()), metrics.REGISTRY.snapshot())
+        content = metrics.REGISTRY.render_merged(shared.load())
+    return Response(content=content, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the Digital Declutter Assistant API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="Worker processes; more than 1 serves in production mode with shared state "
+                             "(default: DECLUTTER_WORKERS or 1, the auto-reloading dev server)")
+    args = parser.parse_args(argv)
+
+    if args.workers <= 1:
+        uvicorn.run("server:app", host=args.host, port=args.port, reload=True)
+        return
+
+    # Workers inherit the environment, so they all find the same databases
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    package_dir = os.path.join(backend_dir, '..', 'digital_declutter')
+    os.environ.setdefault("DECLUTTER_STATE_DB", os.path.join(package_dir, "state.db"))
+    os.environ.setdefault("DECLUTTER_SESSION_DB", os.path.join(package_dir, "sessions.db"))
+    prepare_session_db()
+    # Metrics of a previous run's workers would otherwise keep counting towards the totals
+    metrics.SharedMetrics(os.environ["DECLUTTER_STATE_DB"]).clear()
+    print(f"Production mode: {args.workers} workers, state in {os.environ['DECLUTTER_STATE_DB']}, "
+          f"sessions in {os.environ['DECLUTTER_SESSION_DB']}")
+    # On SIGTERM each worker stops accepting connections and gives in-flight requests DRAIN_SECONDS to finish
+    uvicorn.run("server:app", app_dir=backend_dir, host=args.host, port=args.port, workers=args.workers,
+                timeout_graceful_shutdown=DRAIN_SECONDS)
 
 if __name__ == "__main__":
-    uvicorn.run("server:app", host="127.0.0.1", port=8000, reload=True)
+    main()
@@ -0,0 +1,181 @@
+"""
+Offline micro-benchmarks for the email hot paths.
+
+Runs against synthetic mailboxes (no network, no credentials) and measures:
+  * fetch_parse  - GmailService.fetch_recent_emails: listing, hydration, header parsing
+  * body_decode  - EmailRecord.body extraction over the MIME tree
+  * rule_match   - PreferenceStore lookups for every sender
+  * format_list  - fetch_inbox_emails output formatting
+
+Each result reports throughput (messages/second) and peak traced memory, and
+is compared against benchmarks/baseline.json. A throughput drop or memory
+growth beyond the tolerance fails the run with exit code 1.
+
+Usage:
+    python benchmarks/bench_hot_paths.py
+    python benchmarks/bench_hot_paths.py --sizes 100 1000 --repeat 5
+    python benchmarks/bench_hot_paths.py --update-baseline
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_mailbox import FakeGmailApi, SyntheticMailbox
+from digital_declutter.agent import format_email_list
+from digital_declutter.preferences import PreferenceStore
+from digital_declutter.tools.email_record import EmailRecord
+from digital_declutter.tools.gmail_scheduler import GmailRequestScheduler
+from digital_declutter.tools.gmail_tool import GmailService
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+DEFAULT_SIZES = [100, 1000, 10000]
+
+
+def make_service(mailbox):
+    # Unthrottled scheduler: we're measuring our code, not Gmail's quota
+    scheduler = GmailRequestScheduler(max_units_per_second=1e12)
+    return GmailService(service=FakeGmailApi(mailbox), scheduler=scheduler)
+
+
+def bench_fetch_parse(mailbox):
+    # A fresh service per run so the hydration cache doesn't short-circuit the work
+    return lambda: make_service(mailbox).fetch_recent_emails(max_results=mailbox.size)
+
+
+def bench_body_decode(mailbox):
+    def run():
+        for msg in mailbox.messages:
+            EmailRecord.from_api(msg).body
+    return run
+
+
+def bench_rule_match(mailbox, prefs):
+    records = [EmailRecord.from_api(msg) for msg in mailbox.messages]
+
+    def run():
+        for record in records:
+            prefs.get_rule(record.sender)
+    return run
+
+
+def bench_format_list(mailbox):
+    records = [EmailRecord.from_api(msg) for msg in mailbox.messages]
+    return lambda: format_email_list(records)
+
+
+# Fast cases are looped until one timing takes at least this long, to keep noise down
+MIN_TIMING_SECONDS = 0.2
+
+
+def measure(fn, count, repeat):
+    """Returns (best messages/second, peak traced MB) for `fn`."""
+    started = time.perf_counter()
+    fn()
+    loops = max(1, int(MIN_TIMING_SECONDS / max(time.perf_counter() - started, 1e-9)))
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        timings.append((time.perf_counter() - started) / loops)
+
+    # Memory is measured in a separate run: tracing slows everything down
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return count / min(timings), peak / (1024 * 1024)
+
+
+def run_benchmarks(sizes, repeat):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            mailbox = SyntheticMailbox(size)
+            prefs = PreferenceStore(os.path.join(tmp, f'prefs_{size}.json'))
+            prefs.preferences = {sender: 'always_archive' for sender in mailbox.rule_senders}
+
+            cases = {
+                'fetch_parse': bench_fetch_parse(mailbox),
+                'body_decode': bench_body_decode(mailbox),
+                'rule_match': bench_rule_match(mailbox, prefs),
+                'format_list': bench_format_list(mailbox),
+            }
+            # The full fetch is much slower; keep large sizes affordable
+            for name, fn in cases.items():
+                runs = max(1, repeat // 2) if name == 'fetch_parse' and size >= 10000 else repeat
+                throughput, peak_mb = measure(fn, size, runs)
+                results[f'{name}@{size}'] = {'throughput': round(throughput, 1), 'peak_mb': round(peak_mb, 3)}
+                print(f"{name:<12} {size:>6} msgs  {throughput:>12,.0f} msg/s  {peak_mb:>9.2f} MB peak")
+    return results
+
+
+def compare(results, baseline, tolerance, memory_tolerance):
+    """Returns a list of human-readable regressions."""
+    regressions = []
+    for key, current in results.items():
+        expected = baseline.get(key)
+        if not expected:
+            continue
+        if current['throughput'] < expected['throughput'] * (1 - tolerance):
+            regressions.append(
+                f"{key}: throughput {current['throughput']:,.0f} msg/s < baseline {expected['throughput']:,.0f} msg/s")
+        # Small absolute slack so tiny allocations don't cause flaky failures
+        if current['peak_mb'] > expected['peak_mb'] * (1 + memory_tolerance) + 0.05:
+            regressions.append(
+                f"{key}: peak memory {current['peak_mb']:.2f} MB > baseline {expected['peak_mb']:.2f} MB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='Allowed throughput drop vs. baseline (default: 0.5 = 50%%)')
+    parser.add_argument('--memory-tolerance', type=float, default=0.2,
+                        help='Allowed peak memory growth vs. baseline (default: 0.2 = 20%%)')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='Store these results as the new baseline instead of comparing')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes, args.repeat)
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=4, sort_keys=True)
+        print(f"\nBaseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}; run with --update-baseline first.")
+        return 0
+
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f), args.tolerance, args.memory_tolerance)
+    if regressions:
+        print("\n[FAILED]: performance regressions against baseline:")
+        for line in regressions:
+            print(f"  - {line}")
+        return 1
+    print("\n[SUCCESS]: no regressions against baseline.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
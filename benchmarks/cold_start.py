@@ -0,0 +1,128 @@
+"""
+Cold-start benchmark for the FastAPI backend, fully offline.
+
+Spawns the backend in a fresh Python process (with the load test's fake model,
+fake Gmail mailbox and fake Notion MCP server) and measures, from process
+spawn:
+  * ready:  /health reports the agent, MCP servers and Gmail client initialized
+  * first:  the first /chat response has arrived
+plus the server's own startup phases (imports, serving, agent, gmail).
+Exits non-zero if the median time to ready exceeds --target.
+
+Usage:
+    python benchmarks/cold_start.py --runs 3 --target 5.0
+    python benchmarks/cold_start.py --lazy     # old behaviour: initialize on the first request
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.abspath(os.path.join(BENCH_DIR, '..'))
+
+
+def run_child(args):
+    """Runs the backend with fakes installed; started by the parent in a fresh process."""
+    sys.path.append(ROOT_DIR)
+    sys.path.append(os.path.join(ROOT_DIR, 'backend'))
+    sys.path.append(BENCH_DIR)
+    os.environ.setdefault("DECLUTTER_CONTEXT_CACHE", "0")
+
+    # Imported first so the server's own import timing is not skewed
+    import server
+    import uvicorn
+    from digital_declutter import agent as agent_module
+    from digital_declutter.tools.gmail_scheduler import GmailRequestScheduler
+    from digital_declutter.tools.gmail_tool import GmailService
+    from load_test import ScriptedFakeLlm
+    from synthetic_mailbox import FakeGmailApi, SyntheticMailbox
+
+    server.debug_log = lambda message: None
+    agent_module._gmail_service = GmailService(service=FakeGmailApi(SyntheticMailbox(200), latency=0.0),
+                                               scheduler=GmailRequestScheduler(max_units_per_second=1e12))
+    model = ScriptedFakeLlm(delay=0.0, max_results=10)
+    real_create_agent = server.create_agent
+    server.create_agent = lambda **kwargs: real_create_agent(model=model, **kwargs)
+
+    uvicorn.run(server.app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+def measure_once(args, mcp_config_path):
+    import httpx
+
+    env = dict(os.environ, DECLUTTER_MCP_CONFIG=mcp_config_path, DECLUTTER_CONTEXT_CACHE="0")
+    if args.lazy:
+        env["DECLUTTER_LAZY_INIT"] = "1"
+    started = time.perf_counter()
+    child = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--child', '--port', str(args.port)],
+                             env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{args.port}", timeout=args.timeout) as client:
+            health = None
+            while time.perf_counter() - started < args.timeout:
+                try:
+                    health = client.get("/health").json()
+                    if args.lazy or "ready" in health["startup"]:
+                        break
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.02)
+            else:
+                raise TimeoutError("backend did not become ready")
+            ready = time.perf_counter() - started
+
+            response = client.post("/chat", json={"message": "Clean my inbox"})
+            response.raise_for_status()
+            first = time.perf_counter() - started
+            profile = client.get("/health").json()["startup"]
+    finally:
+        child.terminate()
+        child.wait()
+    return ready, first, profile
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--target', type=float, default=5.0,
+                        help='Max median seconds from process spawn to ready (default: 5.0)')
+    parser.add_argument('--lazy', action='store_true', help='Disable the startup warm-up (DECLUTTER_LAZY_INIT=1)')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return run_child(args)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        mcp_config_path = os.path.join(tmp, 'mcp_config.json')
+        with open(mcp_config_path, 'w') as f:
+            json.dump({"mcpServers": {"notion": {
+                "command": sys.executable,
+                "args": [os.path.join(BENCH_DIR, 'fake_notion_mcp.py')],
+                "env": {"FAKE_NOTION_DELAY": "0"},
+            }}}, f)
+
+        readies, firsts = [], []
+        for run in range(1, args.runs + 1):
+            ready, first, profile = measure_once(args, mcp_config_path)
+            readies.append(ready)
+            firsts.append(first)
+            print(f"run {run}: ready {ready:.2f}s  first response {first:.2f}s  server phases {profile}")
+
+    ready, first = statistics.median(readies), statistics.median(firsts)
+    print(f"\nMedian: ready {ready:.2f}s  first response {first:.2f}s  (target: ready <= {args.target:.2f}s)")
+    if args.lazy:
+        # Nothing is initialized before the first request, so "ready" only means "listening"
+        return 0
+    return 0 if ready <= args.target else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
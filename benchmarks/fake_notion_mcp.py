@@ -0,0 +1,44 @@
+"""
+Fake Notion MCP server for load tests.
+
+Exposes the same `create_notion_task` tool as mcp_server_notion.py over stdio,
+but only sleeps for FAKE_NOTION_DELAY seconds instead of calling Notion.
+"""
+import asyncio
+import itertools
+import os
+try:
+    from mcp.server.fastmcp import FastMCP
+except ImportError:
+    # mcp 2.x renamed FastMCP to MCPServer
+    from mcp.server.mcpserver import MCPServer as FastMCP
+
+mcp = FastMCP("fake-notion-server")
+DELAY = float(os.environ.get("FAKE_NOTION_DELAY", "0.2"))
+_ids = itertools.count(1)
+
+@mcp.tool()
+async def create_notion_task(
+    title: str,
+    description: str = "",
+    sender: str = "",
+    action_item: str = "",
+    due_date: str = "",
+    received_on: str = ""
+) -> str:
+    """
+    Create a new task in the Notion database with detailed metadata.
+
+    Args:
+        title: The title of the task
+        description: A description or details for the task
+        sender: The sender of the email
+        action_item: The specific action required
+        due_date: Due date in ISO 8601 format (YYYY-MM-DD)
+        received_on: Date received in ISO 8601 format (YYYY-MM-DD)
+    """
+    await asyncio.sleep(DELAY)
+    return f"Successfully created Notion task: {title}\nURL: https://notion.so/fake-{next(_ids)}"
+
+if __name__ == "__main__":
+    mcp.run(transport="stdio")
@@ -0,0 +1,298 @@
+"""
+Load test for the FastAPI backend, fully offline.
+
+Boots backend/server.py in-process under uvicorn with:
+  * a scripted fake LLM that calls tools and answers with configurable delays
+  * a fake GmailService serving a synthetic mailbox (benchmarks/synthetic_mailbox.py)
+  * a fake Notion MCP server subprocess (benchmarks/fake_notion_mcp.py)
+then drives /chat with N concurrent clients, each in its own session, and
+reports latency percentiles, throughput and event-loop lag.
+
+Usage:
+    python benchmarks/load_test.py --clients 20 --requests 5
+    python benchmarks/load_test.py --clients 50 --model-delay 0.5 --gmail-latency 0.05
+    python benchmarks/load_test.py --metrics
+    python benchmarks/load_test.py --accounts 5   # spread clients over 5 mailboxes
+    python benchmarks/load_test.py --workers 4    # production mode: 4 processes, shared SQLite state
+
+With --workers the server runs as separate uvicorn worker processes (each
+with its own fakes and MCP subprocess) sharing sessions and usage through
+SQLite, and is stopped with SIGTERM at the end to check it drains cleanly.
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from typing import AsyncGenerator, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.abspath(os.path.join(BENCH_DIR, '..'))
+sys.path.append(ROOT_DIR)
+sys.path.append(os.path.join(ROOT_DIR, 'backend'))
+sys.path.append(BENCH_DIR)
+
+# The fake model has no use for Gemini context caching
+os.environ.setdefault("DECLUTTER_CONTEXT_CACHE", "0")
+
+import httpx
+import uvicorn
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.llm_response import LlmResponse
+from google.adk.runners import Runner
+from google.adk.sessions import InMemorySessionService
+from google.genai import types
+
+import server
+from digital_declutter import agent as agent_module, metrics
+from digital_declutter.tools.gmail_pool import GmailServicePool
+from digital_declutter.tools.gmail_scheduler import GmailRequestScheduler
+from digital_declutter.tools.gmail_tool import GmailService
+from synthetic_mailbox import FakeGmailApi, SyntheticMailbox
+
+
+class ScriptedFakeLlm(BaseLlm):
+    """
+    Plays a fixed script per user turn: each entry is a tool to call, and the
+    turn ends with a text answer. Each step waits `delay` seconds and reports
+    token usage proportional to the request size.
+    """
+
+    model: str = "scripted-fake-llm"
+    script: List[str] = ["fetch_inbox_emails", "create_notion_task"]
+    delay: float = 0.2
+    max_results: int = 20
+
+    async def generate_content_async(self, llm_request, stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        # Steps taken this turn = function responses after the last user text
+        step = 0
+        for content in reversed(llm_request.contents or []):
+            parts = content.parts or []
+            if any(part.function_response for part in parts):
+                step += 1
+            elif any(part.text for part in parts) and content.role == "user":
+                break
+
+        await asyncio.sleep(self.delay)
+        prompt_chars = sum(len(part.text or "") for content in llm_request.contents or [] for part in content.parts or [])
+        usage = types.GenerateContentResponseUsageMetadata(
+            prompt_token_count=prompt_chars // 4, candidates_token_count=50)
+
+        if step < len(self.script):
+            name = self.script[step]
+            args = {"days": 3, "max_results": self.max_results} if name == "fetch_inbox_emails" \
+                else {"title": "Follow up on project update", "description": "Load test task"}
+            part = types.Part(function_call=types.FunctionCall(name=name, args=args))
+        else:
+            part = types.Part(text="### 🚨 Important\n*   **Load Test**: done\n\n> **Recommendation**: archive the rest.")
+        yield LlmResponse(content=types.Content(role="model", parts=[part]), usage_metadata=usage)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def monitor_loop_lag(samples: list, stop: asyncio.Event, interval: float = 0.01):
+    """Measures how late the event loop wakes up a sleeping task."""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.perf_counter() - started - interval))
+
+
+async def setup_app(args, mcp_config_path):
+    """Builds the agent with the fakes and installs it into the server module."""
+    if not args.verbose:
+        # Per-event debug.log writes would dominate the measurement
+        server.debug_log = lambda message: None
+
+    def fake_gmail(seed):
+        scheduler = GmailRequestScheduler(max_units_per_second=args.gmail_quota) if args.gmail_quota \
+            else GmailRequestScheduler(max_units_per_second=1e12)
+        return GmailService(service=FakeGmailApi(SyntheticMailbox(args.mailbox_size, seed=seed),
+                                                 latency=args.gmail_latency), scheduler=scheduler)
+
+    agent_module._gmail_service = fake_gmail(42)
+    # Extra accounts (--accounts) each get their own mailbox, quota and caches
+    agent_module._gmail_pool = GmailServicePool(factory=lambda account: fake_gmail(int(account.split('-')[-1])))
+
+    model = ScriptedFakeLlm(delay=args.model_delay, max_results=args.max_results)
+    server.agent = await agent_module.create_agent(mcp_config_path=mcp_config_path, model=model)
+    server.session_service = InMemorySessionService()
+    server.runner = Runner(agent=server.agent, app_name=server.APP_NAME, session_service=server.session_service)
+
+
+def worker_app():
+    """uvicorn app factory for --workers: installs the fakes in each worker process."""
+    args = argparse.Namespace(**json.loads(os.environ["LOAD_TEST_ARGS"]))
+    if not args.verbose:
+        server.debug_log = lambda message: None
+
+    def fake_gmail(seed):
+        scheduler = GmailRequestScheduler(max_units_per_second=args.gmail_quota or 1e12)
+        return GmailService(service=FakeGmailApi(SyntheticMailbox(args.mailbox_size, seed=seed),
+                                                 latency=args.gmail_latency), scheduler=scheduler)
+
+    agent_module._gmail_service = fake_gmail(42)
+    agent_module._gmail_pool = GmailServicePool(factory=lambda account: fake_gmail(int(account.split('-')[-1])))
+    model = ScriptedFakeLlm(delay=args.model_delay, max_results=args.max_results)
+    real_create_agent = server.create_agent
+    # The server's own startup builds the agent, session service and job queue
+    server.create_agent = lambda **kwargs: real_create_agent(model=model, **kwargs)
+    return server.app
+
+
+def serve_workers(args):
+    server.prepare_session_db()
+    uvicorn.run("load_test:worker_app", factory=True, app_dir=BENCH_DIR, host="127.0.0.1", port=args.port,
+                workers=args.workers, log_level="warning", timeout_graceful_shutdown=server.DRAIN_SECONDS)
+
+
+async def client_worker(client, client_id, count, latencies, errors, accounts):
+    body = {"message": "Clean my inbox", "session_id": f"load-{client_id}"}
+    if accounts > 1:
+        body["user_id"] = f"account-{client_id % accounts}"
+    for i in range(count):
+        started = time.perf_counter()
+        try:
+            response = await client.post("/chat", json=body)
+            if response.status_code != 200:
+                errors.append(f"HTTP {response.status_code}")
+                continue
+        except Exception as e:
+            errors.append(type(e).__name__)
+            continue
+        latencies.append(time.perf_counter() - started)
+
+
+async def run_load_test(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        mcp_config_path = os.path.join(tmp, 'mcp_config.json')
+        with open(mcp_config_path, 'w') as f:
+            json.dump({"mcpServers": {"notion": {
+                "command": sys.executable,
+                "args": [os.path.join(BENCH_DIR, 'fake_notion_mcp.py')],
+                "env": {"FAKE_NOTION_DELAY": str(args.notion_delay)},
+            }}}, f)
+
+        if args.workers > 1:
+            env = dict(os.environ, DECLUTTER_MCP_CONFIG=mcp_config_path, LOAD_TEST_ARGS=json.dumps(vars(args)),
+                       DECLUTTER_STATE_DB=os.path.join(tmp, 'state.db'),
+                       DECLUTTER_SESSION_DB=os.path.join(tmp, 'sessions.db'),
+                       DECLUTTER_JOBS_DB=os.path.join(tmp, 'jobs.db'))
+            child = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve-workers',
+                                      '--workers', str(args.workers), '--port', str(args.port)], env=env)
+            await wait_until_ready(args, child)
+        else:
+            await setup_app(args, mcp_config_path)
+            config = uvicorn.Config(server.app, host="127.0.0.1", port=args.port, log_level="warning")
+            uvicorn_server = uvicorn.Server(config)
+            serve_task = asyncio.create_task(uvicorn_server.serve())
+            while not uvicorn_server.started:
+                await asyncio.sleep(0.05)
+
+        lag_samples, latencies, errors = [], [], []
+        stop = asyncio.Event()
+        monitor = asyncio.create_task(monitor_loop_lag(lag_samples, stop))
+
+        limits = httpx.Limits(max_connections=args.clients)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=args.timeout,
+                                     limits=limits) as client:
+            started = time.perf_counter()
+            await asyncio.gather(*(client_worker(client, i, args.requests, latencies, errors, args.accounts)
+                                   for i in range(args.clients)))
+            elapsed = time.perf_counter() - started
+            if args.metrics and args.workers > 1:
+                # Let every worker publish its final numbers
+                await asyncio.sleep(2 * metrics.PUBLISH_INTERVAL_SECONDS)
+            scraped = (await client.get("/metrics")).text if args.metrics else None
+            sessions = (await client.get("/health")).json()["sessions"]
+
+        stop.set()
+        await monitor
+        if args.workers > 1:
+            # Graceful shutdown: workers drain, stop their MCP servers and exit
+            stop_started = time.perf_counter()
+            child.send_signal(signal.SIGTERM)
+            exit_code = await asyncio.to_thread(child.wait, server.DRAIN_SECONDS + 30)
+            print(f"Workers stopped in {time.perf_counter() - stop_started:.2f}s (exit code {exit_code})")
+        else:
+            uvicorn_server.should_exit = True
+            await serve_task
+
+    total = args.clients * args.requests
+    print("\n=== Load test results ===")
+    print(f"Clients: {args.clients}  Requests/client: {args.requests}  Total: {total}  Workers: {args.workers}")
+    # Usage is recorded per session; with workers it only adds up if they share it
+    print(f"Sessions with recorded usage: {sessions} (expected {args.clients})")
+    print(f"Succeeded: {len(latencies)}  Failed: {len(errors)}" + (f"  ({', '.join(sorted(set(errors)))})" if errors else ""))
+    print(f"Duration: {elapsed:.2f}s  Throughput: {len(latencies) / elapsed:.2f} req/s")
+    print(f"Latency p50: {percentile(latencies, 50):.3f}s  p95: {percentile(latencies, 95):.3f}s  "
+          f"p99: {percentile(latencies, 99):.3f}s  max: {max(latencies, default=0):.3f}s")
+    print(f"Event-loop lag p50: {percentile(lag_samples, 50) * 1000:.1f}ms  p99: {percentile(lag_samples, 99) * 1000:.1f}ms  "
+          f"max: {max(lag_samples, default=0) * 1000:.1f}ms")
+    if scraped:
+        print("\n=== /metrics ===")
+        print("\n".join(line for line in scraped.splitlines()
+                        if not line.startswith("#") and "_bucket{" not in line))
+    return 1 if errors or sessions != args.clients else 0
+
+
+async def wait_until_ready(args, child, timeout: float = 60):
+    """Waits until every worker process serves requests with the agent initialized."""
+    deadline = time.perf_counter() + timeout
+    ready = set()
+    # A fresh connection per probe, so the kernel spreads them over the workers
+    limits = httpx.Limits(max_keepalive_connections=0)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=2, limits=limits) as client:
+        while time.perf_counter() < deadline:
+            if child.poll() is not None:
+                raise RuntimeError(f"Server exited with code {child.returncode}")
+            try:
+                health = (await client.get("/health")).json()
+                if health["agent_initialized"]:
+                    ready.add(health["worker_pid"])
+                    if len(ready) == args.workers:
+                        return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.05)
+    child.kill()
+    raise RuntimeError("Server didn't become ready in time")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=10, help='Concurrent clients')
+    parser.add_argument('--requests', type=int, default=3, help='Sequential /chat requests per client')
+    parser.add_argument('--model-delay', type=float, default=0.2, help='Fake model latency per call (s)')
+    parser.add_argument('--gmail-latency', type=float, default=0.01, help='Fake Gmail latency per API call (s)')
+    parser.add_argument('--gmail-quota', type=float, default=0,
+                        help='Gmail quota units/second for the scheduler (default: unlimited)')
+    parser.add_argument('--notion-delay', type=float, default=0.2, help='Fake Notion tool latency (s)')
+    parser.add_argument('--mailbox-size', type=int, default=500)
+    parser.add_argument('--max-results', type=int, default=20, help='Emails fetched per turn')
+    parser.add_argument('--accounts', type=int, default=1, help='Mailboxes the clients are spread over')
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--metrics', action='store_true', help='Print the server\'s /metrics (without buckets) afterwards')
+    parser.add_argument('--verbose', action='store_true', help='Keep the server\'s debug.log output')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Serve with this many worker processes sharing SQLite state (default: 1, in-process)')
+    parser.add_argument('--serve-workers', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve_workers:
+        return serve_workers(args)
+    return asyncio.run(run_load_test(args))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,242 @@
+"""
+Synthetic Gmail mailboxes for offline benchmarks and load tests.
+
+`SyntheticMailbox` generates Gmail API `users.messages.get` JSON with
+realistic MIME trees (single-part, multipart/alternative, multipart/mixed
+with attachments), body sizes and a skewed sender distribution.
+`FakeGmailApi` serves it through the same `service.users().messages()...
+.execute()` call chain as googleapiclient, so it can be passed to
+`GmailService(service=...)`.
+"""
+import base64
+import copy
+import random
+import threading
+import time
+
+PEOPLE = ["Alice Chen", "Bob Martin", "Priya Nair", "Diego Alvarez", "Emma Schulz", "Kenji Watanabe"]
+NEWSLETTERS = ["Morning Brew", "The Hustle", "Product Hunt Daily", "Medium Digest", "Substack Weekly"]
+SERVICES = ["GitHub", "Google", "Amazon", "LinkedIn", "Slack", "Stripe", "Notion", "Zoom"]
+DOMAINS = ["gmail.com", "outlook.com", "company.com", "example.org"]
+
+SUBJECTS = {
+    "person": ["Re: Project update", "Meeting tomorrow at 10", "Quick question about the invoice",
+               "Action required: review the proposal", "Lunch on Friday?", "Deadline moved to next week"],
+    "newsletter": ["This week's top stories", "50% off everything this weekend", "Your weekly digest",
+                   "New deals just for you", "The newsletter you asked for"],
+    "service": ["Security alert: new sign-in", "Your receipt #{n}", "Build #{n} passed",
+                "You have 3 new notifications", "Your order has shipped", "Password changed"],
+}
+
+WORDS = ("the a to of and in is for on with project update meeting please review attached invoice "
+         "deadline team next week thanks regards schedule report customer release notes").split()
+
+
+def _b64(text: str) -> str:
+    return base64.urlsafe_b64encode(text.encode()).decode()
+
+
+class SyntheticMailbox:
+    """A deterministic, generated mailbox of Gmail API message resources."""
+
+    def __init__(self, size: int, seed: int = 42, rule_senders: int = 50):
+        self.size = size
+        self.rng = random.Random(seed)
+        self.senders = self._make_senders()
+        # Zipf-like weights: a few senders account for most of the mail
+        self.weights = [1.0 / (rank + 1) ** 1.1 for rank in range(len(self.senders))]
+        self.messages = [self._make_message(i) for i in range(size)]
+        self.by_id = {msg['id']: msg for msg in self.messages}
+        self.rule_senders = [sender for sender, _ in self.senders[:rule_senders]]
+        # Label changes, as history.list records (oldest first), and the mailbox's current historyId
+        self.history = []
+        self.history_id = 1000
+
+    def _make_senders(self):
+        senders = []
+        for name in NEWSLETTERS:
+            senders.append((f"{name} <news@{name.lower().replace(' ', '')}.com>", "newsletter"))
+        for name in SERVICES:
+            senders.append((f"{name} <noreply@{name.lower()}.com>", "service"))
+        for name in PEOPLE:
+            for domain in DOMAINS:
+                senders.append((f"{name} <{name.split()[0].lower()}@{domain}>", "person"))
+        # Long tail of one-off senders
+        for i in range(200):
+            senders.append((f"Sender {i} <sender{i}@{self.rng.choice(DOMAINS)}>", self.rng.choice(list(SUBJECTS))))
+        self.rng.shuffle(senders)
+        return senders
+
+    def _text(self, min_words: int, max_words: int) -> str:
+        # Log-uniform lengths: mostly short mails, occasionally long ones
+        count = int(min_words * (max_words / min_words) ** self.rng.random())
+        return " ".join(self.rng.choice(WORDS) for _ in range(count))
+
+    def _make_payload(self, headers, kind):
+        plain = self._text(20, 1500)
+        html = f"<html><body><p>{plain}</p></body></html>"
+        shape = self.rng.random()
+        if shape < 0.3:
+            return {"mimeType": "text/plain", "headers": headers,
+                    "body": {"size": len(plain), "data": _b64(plain)}}
+        alternative = {
+            "mimeType": "multipart/alternative", "headers": [], "body": {"size": 0},
+            "parts": [
+                {"partId": "0", "mimeType": "text/plain", "body": {"size": len(plain), "data": _b64(plain)}},
+                {"partId": "1", "mimeType": "text/html", "body": {"size": len(html), "data": _b64(html)}},
+            ],
+        }
+        if shape < 0.8 or kind == "newsletter":
+            return {**alternative, "headers": headers}
+        return {
+            "mimeType": "multipart/mixed", "headers": headers, "body": {"size": 0},
+            "parts": [alternative, {
+                "partId": "2", "mimeType": "application/pdf", "filename": "attachment.pdf",
+                "body": {"size": self.rng.randint(10_000, 2_000_000), "attachmentId": f"att-{self.rng.random()}"},
+            }],
+        }
+
+    def _make_message(self, index: int) -> dict:
+        sender, kind = self.rng.choices(self.senders, weights=self.weights)[0]
+        subject = self.rng.choice(SUBJECTS[kind]).format(n=self.rng.randint(1000, 9999))
+        received = time.gmtime(1_760_000_000 - index * 900)
+        headers = [
+            {"name": "Delivered-To", "value": "me@example.com"},
+            {"name": "Received", "value": "from mail.example.com by mx.google.com"},
+            {"name": "From", "value": sender},
+            {"name": "To", "value": "me@example.com"},
+            {"name": "Subject", "value": subject},
+            {"name": "Date", "value": time.strftime("%a, %d %b %Y %H:%M:%S +0000", received)},
+            {"name": "Message-ID", "value": f"<{index}@synthetic>"},
+        ]
+        if kind == "newsletter":
+            headers.append({"name": "List-Unsubscribe", "value": "<mailto:unsubscribe@example.com>"})
+        labels = ["INBOX"] + (["UNREAD"] if self.rng.random() < 0.4 else [])
+        if kind == "newsletter":
+            labels.append("CATEGORY_UPDATES")
+        return {
+            "id": f"{index:016x}",
+            "threadId": f"{index // 3:016x}",
+            "labelIds": labels,
+            "snippet": self._text(10, 30)[:200],
+            "internalDate": str(int(time.mktime(received)) * 1000),
+            "sizeEstimate": 0,
+            "payload": self._make_payload(headers, kind),
+        }
+
+
+class _Request:
+    def __init__(self, fn, latency: float = 0.0):
+        self._fn = fn
+        self._latency = latency
+
+    def execute(self):
+        if self._latency:
+            time.sleep(self._latency)
+        return self._fn()
+
+
+class _Messages:
+    def __init__(self, api):
+        self.api = api
+
+    def list(self, userId='me', q=None, maxResults=100, pageToken=None, labelIds=None, includeSpamTrash=False):
+        def run():
+            start = int(pageToken or 0)
+            end = min(start + min(maxResults, 500), len(self.api.mailbox.messages))
+            page = [{"id": m["id"], "threadId": m["threadId"]} for m in self.api.mailbox.messages[start:end]]
+            result = {"messages": page, "resultSizeEstimate": len(page)}
+            if end < len(self.api.mailbox.messages):
+                result["nextPageToken"] = str(end)
+            return result
+        return self.api._request("messages.list", run)
+
+    def get(self, userId='me', id=None, format='full', metadataHeaders=None):
+        def run():
+            # Each get returns fresh JSON, like a real HTTP response
+            msg = copy.deepcopy(self.api.mailbox.by_id[id])
+            if format == 'metadata':
+                msg["payload"].pop("parts", None)
+                msg["payload"].pop("body", None)
+                if metadataHeaders:
+                    wanted = {h.lower() for h in metadataHeaders}
+                    msg["payload"]["headers"] = [h for h in msg["payload"]["headers"] if h["name"].lower() in wanted]
+            return msg
+        return self.api._request("messages.get", run)
+
+    def trash(self, userId='me', id=None):
+        return self.api._request("messages.trash", lambda: {"id": id, "labelIds": ["TRASH"]})
+
+    def modify(self, userId='me', id=None, body=None):
+        return self.api._request("messages.modify", lambda: {"id": id})
+
+    def batchModify(self, userId='me', body=None):
+        def run():
+            # Applied to the mailbox, so a later sweep sees the new labels
+            mailbox = self.api.mailbox
+            with self.api._lock:
+                for msg_id in body["ids"]:
+                    labels = mailbox.by_id[msg_id]["labelIds"]
+                    labels[:] = [l for l in labels if l not in body.get("removeLabelIds", [])]
+                    labels.extend(l for l in body.get("addLabelIds", []) if l not in labels)
+                    mailbox.history_id += 1
+                    message = {"id": msg_id, "labelIds": list(labels)}
+                    record = {"id": str(mailbox.history_id), "messages": [message]}
+                    if body.get("addLabelIds"):
+                        record["labelsAdded"] = [{"message": message, "labelIds": body["addLabelIds"]}]
+                    if body.get("removeLabelIds"):
+                        record["labelsRemoved"] = [{"message": message, "labelIds": body["removeLabelIds"]}]
+                    mailbox.history.append(record)
+            return ""
+        return self.api._request("messages.batchModify", run)
+
+
+class _History:
+    def __init__(self, api):
+        self.api = api
+
+    def list(self, userId='me', startHistoryId=None, pageToken=None, historyTypes=None, maxResults=100):
+        def run():
+            mailbox = self.api.mailbox
+            changes = [r for r in mailbox.history if int(r["id"]) > int(startHistoryId)]
+            start = int(pageToken or 0)
+            result = {"history": changes[start:start + maxResults], "historyId": str(mailbox.history_id)}
+            if start + maxResults < len(changes):
+                result["nextPageToken"] = str(start + maxResults)
+            return result
+        return self.api._request("history.list", run)
+
+
+class _Users:
+    def __init__(self, api):
+        self.api = api
+
+    def messages(self):
+        return _Messages(self.api)
+
+    def history(self):
+        return _History(self.api)
+
+    def getProfile(self, userId='me'):
+        mailbox = self.api.mailbox
+        return self.api._request("getProfile", lambda: {
+            "emailAddress": "me@example.com", "messagesTotal": len(mailbox.messages),
+            "historyId": str(mailbox.history_id)})
+
+
+class FakeGmailApi:
+    """Serves a SyntheticMailbox through the googleapiclient call chain."""
+
+    def __init__(self, mailbox: SyntheticMailbox, latency: float = 0.0):
+        self.mailbox = mailbox
+        self.latency = latency
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def _request(self, method, fn):
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        return _Request(fn, self.latency)
+
+    def users(self):
+        return _Users(self)
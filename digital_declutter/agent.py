@@ -1,33 +1,117 @@
 import os
 import json
-from typing import List
+import asyncio
+import time
+import re
+import threading
+import datetime
+from email.utils import parsedate_to_datetime
+from typing import List, Optional
 from google.adk.agents import LlmAgent
-from google.adk.models.google_llm import Gemini
-from google.adk.tools.mcp_tool.mcp_toolset import McpToolset
-from google.adk.tools.mcp_tool.mcp_session_manager import StdioConnectionParams
-from mcp import StdioServerParameters
 from dotenv import load_dotenv
 from .preferences import PreferenceStore
-from .tools.gmail_tool import GmailService
+from .tools.gmail_pool import DEFAULT_ACCOUNT, GmailServicePool, current_account
+from .model_router import ModelRouter
+from .context_cache import InstructionCache, context_cache_enabled
+from .cassette import get_cassette
+from . import metrics, tracing
+from .usage import BUDGET_EXCEEDED_MESSAGE, current_usage, prompt_breakdown
+from .triage import GeminiTriageModel, triage_emails, render_triage_markdown
+from .jobs import JobQueue, JobStore
+from .analytics import SenderAnalytics, analytics_db_path, format_report
+from .shared_state import get_shared_cache
 
 # Load environment variables
 load_dotenv()
 
+# The MCP client stack (~1s), googleapiclient/OAuth and the Gemini model class
+# are imported where they are first needed rather than here, so importing this
+# module (and starting the backend) stays fast. See benchmarks/cold_start.py.
+
 # Global services
 _preference_store = None
 _gmail_service = None
+# warm_up() builds the default client in a thread while request tools may ask for it
+_gmail_service_lock = threading.Lock()
+_gmail_pool = None
+_triage_model = None
+_model_router = None
+_instruction_cache = None
+_job_queue = None
+# account -> SenderAnalytics
+_analytics = {}
+# The Notion MCP tool background jobs create tasks with (set by create_agent)
+_notion_task_tool = None
+# (preferences version, rendered rules block)
+_rules_block = (None, "")
 
 def get_prefs():
     global _preference_store
     if not _preference_store:
         _preference_store = PreferenceStore()
+    else:
+        # Picks up rules saved by other backend workers (one stat call)
+        _preference_store.reload_if_changed()
     return _preference_store
 
 def get_gmail():
+    """The Gmail client for the current request's account (see tools/gmail_pool.py)."""
+    account = current_account()
+    if account and account != DEFAULT_ACCOUNT:
+        return get_gmail_pool().get(account)
     global _gmail_service
-    if not _gmail_service:
-        _gmail_service = GmailService()
-    return _gmail_service
+    with _gmail_service_lock:
+        if not _gmail_service:
+            from .tools.gmail_tool import GmailService
+            _gmail_service = GmailService()
+        return _gmail_service
+
+def get_gmail_pool():
+    global _gmail_pool
+    if _gmail_pool is None:
+        from .tools.credentials import interactive_auth_allowed
+        # Long-running servers keep every active account's token fresh
+        _gmail_pool = GmailServicePool(background_refresh=not interactive_auth_allowed())
+    return _gmail_pool
+
+def get_analytics():
+    """Sender analytics of the current request's account."""
+    account = current_account() or DEFAULT_ACCOUNT
+    if account not in _analytics:
+        _analytics[account] = SenderAnalytics(analytics_db_path(None if account == DEFAULT_ACCOUNT else account))
+    return _analytics[account]
+
+def get_instruction_cache():
+    global _instruction_cache
+    if not _instruction_cache:
+        shared = get_shared_cache()
+        _instruction_cache = InstructionCache(shared=shared if shared.shared else None)
+    return _instruction_cache
+
+def get_rules_block() -> str:
+    """Renders the saved rules for the system instruction, re-rendering only when they change."""
+    global _rules_block
+    prefs = get_prefs()
+    if _rules_block[0] != prefs.version:
+        rules = prefs.get_all_rules()
+        if rules:
+            lines = "\n".join(f"    - {sender}: {rule}" for sender, rule in sorted(rules.items()))
+        else:
+            lines = "    - (no rules saved yet)"
+        _rules_block = (prefs.version, f"\n    **Current Sender Rules:**\n{lines}\n")
+    return _rules_block[1]
+
+def get_router():
+    global _model_router
+    if not _model_router:
+        _model_router = ModelRouter()
+    return _model_router
+
+def get_triage_model():
+    global _triage_model
+    if not _triage_model:
+        _triage_model = GeminiTriageModel(router=get_router())
+    return _triage_model
 
 # --- Preference Tools ---
 
@@ -63,7 +147,7 @@ def get_all_rules() -> str:
 
 # --- Gmail Tools (Custom) ---
 
-def fetch_inbox_emails(days: int = 3, max_results: int = 20) -> str:
+async def fetch_inbox_emails(days: int = 3, max_results: int = 20) -> str:
     """
     Fetches recent emails from the inbox.
     Args:
@@ -73,20 +157,41 @@ def fetch_inbox_emails(days: int = 3, max_results: int = 20) -> str:
         A formatted string with email details
     """
     gmail = get_gmail()
-    emails = gmail.fetch_recent_emails(days=days, max_results=max_results)
+    # Off the event loop, so concurrent sessions can share one in-flight fetch
+    emails = await asyncio.to_thread(gmail.fetch_recent_emails, days=days, max_results=max_results)
     
+    return format_email_list(emails)
+
+def format_email_list(emails) -> str:
+    """Renders fetched emails as the numbered list returned to the agent."""
     if not emails:
         return "No emails found."
     
-    result = f"Found {len(emails)} emails:\n\n"
+    lines = [f"Found {len(emails)} emails:\n"]
     for i, email in enumerate(emails, 1):
-        result += f"{i}. ID: {email['id']}\n"
-        result += f"   From: {email['sender']}\n"
-        result += f"   Subject: {email['subject']}\n"
-        result += f"   Date: {email['date']}\n"
-        result += f"   Snippet: {email['snippet'][:100]}...\n\n"
-    
-    return result
+        lines.append(
+            f"{i}. ID: {email.id}\n"
+            f"   From: {email.sender}\n"
+            f"   Subject: {email.subject}\n"
+            f"   Date: {email.date}\n"
+            f"   Snippet: {email.snippet[:100]}...\n"
+        )
+    return "\n".join(lines) + "\n"
+
+async def triage_inbox(days: int = 3, max_results: int = 100) -> str:
+    """
+    Fetches and categorizes many inbox emails at once using parallel batch classification.
+    Prefer this over fetch_inbox_emails when triaging more than ~30 emails.
+    Args:
+        days: Number of days to look back (default: 3)
+        max_results: Maximum number of emails to triage (default: 100)
+    Returns:
+        Categorized Markdown with one line per email, including its ID
+    """
+    gmail = get_gmail()
+    emails = await asyncio.to_thread(gmail.fetch_recent_emails, days=days, max_results=max_results)
+    results = await triage_emails(emails, model=get_triage_model(), prefs=get_prefs())
+    return render_triage_markdown(results)
 
 def trash_email(email_id: str) -> str:
     """
@@ -108,49 +213,288 @@ def archive_email(email_id: str) -> str:
     success = gmail.archive_email(email_id)
     return f"Email {email_id} archived." if success else f"Failed to archive email {email_id}."
 
+# --- Sender Analytics ---
+
+async def sender_report(rank_by: str = "volume", group_by: str = "sender", top_n: int = 10) -> str:
+    """
+    Ranks who sends the user mail, from locally synced metadata instead of fetching emails.
+    Use for questions like "who emails me the most?" or "which newsletters do I never open?".
+    Args:
+        rank_by: 'volume' (most mail), 'unread' (highest unread ratio) or 'noise' (unread mail from senders with an unsubscribe link)
+        group_by: 'sender' or 'domain'
+        top_n: How many senders or domains to return (default: 10, max 50)
+    Returns:
+        One line per sender or domain: message count, recent count, unread ratio, unsubscribe link and saved rule
+    """
+    analytics = get_analytics()
+    gmail = get_gmail()
+    if analytics.status()["initial_sync_done"]:
+        # Off the event loop: usually a single history call. If the history has expired, no
+        # listing pages are fetched here; the initial sync below starts over in the background
+        await asyncio.to_thread(analytics.sync, gmail, 0)
+    status = analytics.status()
+    if not status["initial_sync_done"]:
+        # The initial sync lists the whole mailbox, far too much for one chat turn
+        await asyncio.to_thread(analytics.start_initial_sync, gmail)
+        return (f"Sender analytics are still being built ({status['messages']} messages from "
+                f"{status['senders']} senders synced so far); the mailbox sync is running in the background. "
+                f"Ask again in a few minutes.")
+    try:
+        rows = analytics.top(rank_by, group_by, limit=max(1, min(top_n, 50)))
+    except ValueError as e:
+        return f"Could not build the report: {e}"
+    return format_report(rows, get_prefs(), rank_by, group_by, analytics.status())
+
+# Tools report failures to the model as text rather than raising; these prefixes count as errors in metrics
+TOOL_FAILURE_PREFIXES = ("Failed to", "Could not", "No job", "Error")
+
+def tool_failed(tool_response) -> bool:
+    """Whether a tool's response reports a failure (returned text, or an MCP error result)."""
+    if isinstance(tool_response, dict):
+        if tool_response.get("isError") or tool_response.get("error"):
+            return True
+        text = tool_response.get("result") if "result" in tool_response else _tool_result_text(tool_response)
+    else:
+        text = tool_response
+    return isinstance(text, str) and text.lstrip().startswith(TOOL_FAILURE_PREFIXES)
+
+# --- Background Jobs ---
+
+NOTION_TASK_TOOL = "create_notion_task"
+# The Notion MCP servers report failures as a text result with this prefix, not as isError
+NOTION_ERROR_PREFIX = "Error"
+
+def iso_date(value) -> str:
+    """YYYY-MM-DD for an ISO 8601 or RFC 2822 (email Date header) date; "" if it isn't one."""
+    value = (value or "").strip()
+    if not value:
+        return ""
+    try:
+        return datetime.date.fromisoformat(value[:10]).isoformat()
+    except ValueError:
+        pass
+    try:
+        return parsedate_to_datetime(value).date().isoformat()
+    except (TypeError, ValueError):
+        return ""
+
+def _tool_result_text(result) -> str:
+    """The text parts of an MCP tool result, joined."""
+    if not isinstance(result, dict):
+        return str(result or "")
+    return "\n".join(part.get("text", "") for part in result.get("content") or [] if isinstance(part, dict))
+
+async def _archive_step(step) -> str:
+    if not await asyncio.to_thread(lambda: get_gmail().archive_email(step["email_id"])):
+        raise RuntimeError(f"Gmail refused to archive {step['email_id']}")
+    return "archived"
+
+async def _trash_step(step) -> str:
+    if not await asyncio.to_thread(lambda: get_gmail().trash_email(step["email_id"])):
+        raise RuntimeError(f"Gmail refused to trash {step['email_id']}")
+    return "trashed"
+
+async def _create_task_step(step) -> str:
+    if _notion_task_tool is None:
+        raise RuntimeError(f"The Notion MCP tool '{NOTION_TASK_TOOL}' is not loaded")
+    fields = step["task"]
+    if not fields:
+        draft = await draft_task_from_email(step["email_id"])
+        if not draft.startswith("{"):
+            raise RuntimeError(draft)
+        fields = json.loads(draft)
+    # Notion date properties only accept ISO dates
+    fields = dict(fields)
+    for name in ("due_date", "received_on"):
+        if name in fields:
+            fields[name] = iso_date(fields[name])
+    result = await _notion_task_tool.run_async(args=fields, tool_context=None)
+    text = _tool_result_text(result)
+    if isinstance(result, dict) and (result.get("isError") or result.get("error")):
+        raise RuntimeError(str(result.get("error") or text))
+    if text.lstrip().startswith(NOTION_ERROR_PREFIX):
+        raise RuntimeError(text.strip())
+    return f"task created: {fields.get('title', '')}"
+
+def get_job_queue():
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = JobQueue(JobStore(), executors={
+            "archive": _archive_step,
+            "trash": _trash_step,
+            "create_task": _create_task_step,
+        })
+    return _job_queue
+
+async def submit_action_plan(archive_ids: Optional[List[str]] = None, trash_ids: Optional[List[str]] = None,
+                             task_email_ids: Optional[List[str]] = None) -> str:
+    """
+    Runs an approved action plan as a background job instead of one tool call per email.
+    Use this once the user confirms a plan with more than a handful of actions.
+    Args:
+        archive_ids: Gmail message IDs to archive
+        trash_ids: Gmail message IDs to move to trash
+        task_email_ids: Gmail message IDs to create Notion tasks for (drafted automatically)
+    Returns:
+        The job ID; check on it with get_job_status
+    """
+    actions = [{"action": "archive", "email_id": i} for i in archive_ids or []] + \
+              [{"action": "trash", "email_id": i} for i in trash_ids or []] + \
+              [{"action": "create_task", "email_id": i} for i in task_email_ids or []]
+    try:
+        job_id = await get_job_queue().submit(actions, account=current_account())
+    except ValueError as e:
+        return f"Could not submit the plan: {e}"
+    return f"Job {job_id} started with {len(actions)} actions. It runs in the background; check it with get_job_status."
+
+def get_job_status(job_id: str) -> str:
+    """
+    Reports the progress of a background job started with submit_action_plan.
+    Args:
+        job_id: The job ID returned by submit_action_plan
+    """
+    job = get_job_queue().get(job_id)
+    if job is None or job["account"] != current_account():
+        return f"No job {job_id}."
+    progress = job["progress"]
+    lines = [f"Job {job_id}: {job['status']} ({progress['done']} done, {progress['failed']} failed, "
+             f"{progress['pending']} pending of {progress['total']})"]
+    lines += [f"- {step['action']} {step['email_id']}: {step['result']}" for step in job["steps"]
+              if step["status"] == "failed"]
+    return "\n".join(lines)
+
+# --- Task Composition ---
+
+TASK_DRAFT_PROMPT = """Draft a Notion task from this email. Return ONLY JSON:
+{{"title": "<Subject + key action>", "action_item": "<the specific action required>",
+  "due_date": "<YYYY-MM-DD or empty>", "description": "<summary, sender, date and any deadlines>"}}
+
+From: {sender}
+Date: {date}
+Subject: {subject}
+
+{body}
+"""
+
+async def draft_task_from_email(email_id: str) -> str:
+    """
+    Drafts a Notion task (title, action item, due date, description) from an email.
+    Call this before creating a Notion task, then pass its fields to the Notion tool.
+    Args:
+        email_id: The Gmail message ID
+    Returns:
+        A JSON object with title, action_item, due_date, description, sender and received_on
+    """
+    from google.genai import types
+
+    gmail = get_gmail()
+    email = await asyncio.to_thread(gmail.get_email, email_id)
+    if not email:
+        return f"Could not read email {email_id}."
+
+    response = await get_router().generate(
+        "compose",
+        TASK_DRAFT_PROMPT.format(sender=email.sender, date=email.date, subject=email.subject, body=email.body),
+        config=types.GenerateContentConfig(response_mime_type="application/json", temperature=0.2),
+    )
+    cleaned = re.sub(r"^```(?:json)?|```$", "", (response.text or "").strip(), flags=re.MULTILINE).strip()
+    try:
+        draft = json.loads(cleaned)
+    except json.JSONDecodeError:
+        draft = {"title": email.subject, "action_item": "", "due_date": "", "description": email.snippet}
+    draft["sender"] = email.sender
+    # The Notion tool expects YYYY-MM-DD, not the raw Date header
+    draft["due_date"] = iso_date(draft.get("due_date"))
+    draft["received_on"] = iso_date(email.date)
+    return json.dumps(draft, ensure_ascii=False)
+
 # --- Agent Definition ---
 
-async def create_agent(model_name="gemini-2.5-flash-lite", mcp_config_path="mcp_config.json"):
-    """Creates and returns the Digital Declutter Agent with hybrid tools (custom Gmail + MCP Notion)."""
+def _import_mcp_client():
+    """Imports the MCP client stack, the slowest import in the app."""
+    from google.adk.tools.mcp_tool.mcp_toolset import McpToolset
+    from google.adk.tools.mcp_tool.mcp_session_manager import StdioConnectionParams
+    from mcp import StdioServerParameters
+    return McpToolset, StdioConnectionParams, StdioServerParameters
+
+async def load_mcp_server(server_name, server_config):
+    """Starts one MCP server and returns its tools (none if it fails to start)."""
+    McpToolset, StdioConnectionParams, StdioServerParameters = _import_mcp_client()
+    print(f"Initializing MCP server: {server_name}")
+    try:
+        # Create connection params with increased timeout
+        conn_params = StdioConnectionParams(
+            server_params=StdioServerParameters(
+                command=server_config["command"],
+                args=server_config["args"],
+                env=server_config.get("env")
+            ),
+            timeout=60  # Increase timeout to 60 seconds
+        )
+        
+        # Create toolset
+        toolset = McpToolset(connection_params=conn_params)
+        tools = await toolset.get_tools()
+        metrics.MCP_LAST_CALL_OK.labels(server_name).set(1)
+        metrics.MCP_SERVER_TOOLS.labels(server_name).set(len(tools))
+        print(f"✅ Successfully loaded {len(tools)} tools from {server_name}")
+        for tool in tools:
+            print(f"   - {tool.name}")
+        return tools
+    except Exception as e:
+        metrics.MCP_LAST_CALL_OK.labels(server_name).set(0)
+        metrics.MCP_SERVER_TOOLS.labels(server_name).set(0)
+        print(f"❌ Failed to load MCP server {server_name}: {e}")
+        print(f"   Error type: {type(e).__name__}")
+        return []
+
+async def create_agent(model_name=None, mcp_config_path="mcp_config.json", model=None):
+    """Creates and returns the Digital Declutter Agent with hybrid tools (custom Gmail + MCP Notion).
+
+    `model_name` overrides the router's `agent` route; other steps use their own routes.
+    `model` replaces the agent's Gemini model with any ADK model instance (e.g. a fake for load tests).
+    """
     
     print("Initializing Digital Declutter Agent...")
+    router = get_router()
+    if model_name:
+        router.routes["agent"] = model_name
+    model_name = router.model_for("agent")
     
     # Load Notion MCP Tools
     mcp_tools = []
-    if os.path.exists(mcp_config_path):
+    # tool name -> MCP server it came from, for the server health gauge
+    mcp_tool_servers = {}
+    cassette = get_cassette()
+    if cassette and cassette.replaying:
+        # Replayed sessions serve MCP results from the cassette; no servers are started
+        from .cassette_adk import CassetteTool
+        mcp_tools = CassetteTool.from_cassette(cassette)
+        print(f"Replaying {len(mcp_tools)} MCP tools from cassette")
+    elif os.path.exists(mcp_config_path):
         try:
             with open(mcp_config_path, 'r') as f:
                 config = json.load(f)
                 
             servers = config.get("mcpServers", {})
-            for server_name, server_config in servers.items():
-                print(f"Initializing MCP server: {server_name}")
-                try:
-                    # Create connection params with increased timeout
-                    conn_params = StdioConnectionParams(
-                        server_params=StdioServerParameters(
-                            command=server_config["command"],
-                            args=server_config["args"],
-                            env=server_config.get("env")
-                        ),
-                        timeout=60  # Increase timeout to 60 seconds
-                    )
-                    
-                    # Create toolset
-                    toolset = McpToolset(connection_params=conn_params)
-                    tools = await toolset.get_tools()
-                    mcp_tools.extend(tools)
-                    print(f"✅ Successfully loaded {len(tools)} tools from {server_name}")
-                    for tool in tools:
-                        print(f"   - {tool.name}")
-                except Exception as e:
-                    print(f"❌ Failed to load MCP server {server_name}: {e}")
-                    print(f"   Error type: {type(e).__name__}")
+            # Each server is a subprocess that takes a while to boot, so start them all at once
+            results = await asyncio.gather(*(load_mcp_server(name, cfg) for name, cfg in servers.items()))
+            for server_name, tools in zip(servers, results):
+                mcp_tools.extend(tools)
+                mcp_tool_servers.update({tool.name: server_name for tool in tools})
         except Exception as e:
             print(f"Error reading MCP config: {e}")
     else:
         print(f"Warning: MCP config not found at {mcp_config_path}")
 
+    if cassette and cassette.recording:
+        from .cassette_adk import CassetteTool
+        CassetteTool.record_declarations(cassette, mcp_tools)
+        mcp_tools = [CassetteTool(cassette, inner=tool) for tool in mcp_tools]
+
+    global _notion_task_tool
+    _notion_task_tool = next((tool for tool in mcp_tools if tool.name == NOTION_TASK_TOOL), None)
+
     # Load Notion database ID from environment
     notion_db_id = os.getenv("NOTION_DATABASE_ID", "2b8c3719a408805a9871ce867656d1e7")
     
@@ -158,9 +502,11 @@ async def create_agent(model_name="gemini-2.5-flash-lite", mcp_config_path="mcp_
     You are the Digital Declutter Assistant. Your goal is to help the user triage their inbox intelligently.
     
     **Tools Available:**
-    *   Gmail tools: `fetch_inbox_emails`, `trash_email`, `archive_email`
-    *   Notion tools: via MCP (for creating tasks)
+    *   Gmail tools: `fetch_inbox_emails`, `triage_inbox`, `trash_email`, `archive_email`
+    *   Notion tools: `draft_task_from_email`, plus MCP tools (for creating tasks)
     *   User Preference tools: `get_user_rules`, `save_user_rule`, `get_all_rules`
+    *   Background jobs: `submit_action_plan`, `get_job_status`
+    *   Analytics: `sender_report` answers "who sends me the most mail / which newsletters do I never open?" from local stats; use it instead of fetching emails for such questions
     
     **Notion Configuration:**
     *   Database ID: {notion_db_id} (already configured, never ask for it)
@@ -175,19 +521,19 @@ async def create_agent(model_name="gemini-2.5-flash-lite", mcp_config_path="mcp_
     **Task Creation Intelligence:**
     When user says "create a task" or "this is important":
     1. **Automatically** create the task without asking for title
-    2. Generate a smart title from: Subject + key action items
+    2. Call `draft_task_from_email(email_id)` to get a smart title, action item, due date and description, then create the Notion task from its fields
     3. Include in task body: Email summary, sender, date, and any deadlines mentioned
     4. Extract due dates from email content if mentioned
     5. **Never ask** the user for task details - be intelligent and autonomous
     
     **Sender Rules & Memory:**
     - When user says "this sender is always important/promotional/spam", use `save_user_rule(sender, rule)`
-    - **Always** check `get_all_rules()` at the start to apply saved preferences
+    - The saved rules are listed under **Current Sender Rules** at the end of these instructions and are always up to date; apply them without calling `get_all_rules()`
     - Rules: 'always_important', 'always_archive', 'always_trash', 'promotional'
     
     **Workflow & Proactivity:**
-    1. **Start**: Check `get_all_rules()` to load user preferences.
-    2. **Fetch**: Get emails using `fetch_inbox_emails`.
+    1. **Start**: Review the **Current Sender Rules** below.
+    2. **Fetch**: Get emails using `fetch_inbox_emails`. For large inboxes (more than ~30 emails), use `triage_inbox` instead: it returns the emails already categorized, so present its output directly.
     3. **Analyze & Categorize (IMMEDIATELY)**:
        - Group emails into: **Important**, **Promotional**, **Spam**, **FYI/Neutral**.
        - Apply saved rules (e.g., if 'always_important', put in Important).
@@ -197,6 +543,8 @@ async def create_agent(model_name="gemini-2.5-flash-lite", mcp_config_path="mcp_
        - **Propose an Action Plan**: "I recommend creating tasks for the Important ones and archiving the Promotional ones. Shall I proceed?"
        - **DO NOT** just list emails and ask "What next?". **Always suggest the next step.**
     5. **Execute**: Wait for user confirmation, then run the tools (create tasks, archive, etc.).
+       For plans with more than 5 actions, call `submit_action_plan` once with all the IDs instead, tell the user the job ID,
+       and use `get_job_status` when they ask how it is going.
 
     **Categorization Logic:**
     - **Important**: Personal emails, work updates, security alerts, bills, or senders marked 'always_important'.
@@ -219,20 +567,109 @@ async def create_agent(model_name="gemini-2.5-flash-lite", mcp_config_path="mcp_
       
       > **Recommendation**: I suggest creating tasks for the Important emails...
     """
+
+    def instruction_provider(context) -> str:
+        # A callable instruction also stops ADK from treating braces as state placeholders
+        return instruction + get_rules_block()
+
+    # invocation id -> (start time, trace span) of the in-flight agent model call
+    model_call_started = {}
+
+    async def before_model(callback_context, llm_request):
+        request_usage = current_usage()
+        if request_usage is not None:
+            if request_usage.exhausted:
+                # End the turn instead of making a model call the session has no budget for
+                from google.adk.models.llm_response import LlmResponse
+                from google.genai import types
+                metrics.SESSION_BUDGET_EXCEEDED.inc()
+                return LlmResponse(content=types.Content(role="model", parts=[types.Part(text=BUDGET_EXCEEDED_MESSAGE)]))
+            # Measured before the context cache strips the instruction and tool declarations
+            request_usage.record_prompt(prompt_breakdown(llm_request))
+        if context_cache_enabled() and not (cassette and cassette.replaying):
+            # Serve the static instruction, rules and tool declarations from the context cache
+            await get_instruction_cache().apply(llm_request)
+        span = tracing.start_span("model agent", "model", model=llm_request.model,
+                                  contents=len(llm_request.contents or []))
+        model_call_started[callback_context.invocation_id] = (time.perf_counter(), span)
+        return None
+
+    def after_model(callback_context, llm_response):
+        started, span = model_call_started.pop(callback_context.invocation_id, (None, None))
+        if started is not None:
+            usage = getattr(llm_response, "usage_metadata", None)
+            router.record("agent", time.perf_counter() - started, usage=usage,
+                          error=bool(getattr(llm_response, "error_code", None)))
+            tracing.end_span(span, input_tokens=getattr(usage, "prompt_token_count", None),
+                             output_tokens=getattr(usage, "candidates_token_count", None))
+        return None
+
+    def on_model_error(callback_context, llm_request, error):
+        started, span = model_call_started.pop(callback_context.invocation_id, (None, None))
+        if started is not None:
+            router.record("agent", time.perf_counter() - started, error=True)
+            tracing.end_span(span, error=type(error).__name__)
+        return None
+
+    # function call id -> (start time, trace span) of the in-flight tool call
+    tool_call_started = {}
+
+    def before_tool(tool, args, tool_context):
+        category = "mcp" if tool.name in mcp_tool_servers else "tool"
+        span = tracing.start_span(f"tool {tool.name}", category, args_bytes=tracing.payload_size(args)) \
+            if tracing.current_span() else None
+        tool_call_started[tool_context.function_call_id] = (time.perf_counter(), span)
+        return None
+
+    def finish_tool(tool, tool_context, status, **span_attributes):
+        started, span = tool_call_started.pop(tool_context.function_call_id, (None, None))
+        if started is not None:
+            metrics.TOOL_SECONDS.labels(tool.name).observe(time.perf_counter() - started)
+        tracing.end_span(span, status=status, **span_attributes)
+        metrics.TOOL_CALLS.labels(tool.name, status).inc()
+        server_name = mcp_tool_servers.get(tool.name)
+        if server_name:
+            metrics.MCP_LAST_CALL_OK.labels(server_name).set(1 if status == "ok" else 0)
+
+    def after_tool(tool, args, tool_context, tool_response):
+        finish_tool(tool, tool_context, "error" if tool_failed(tool_response) else "ok",
+                    response_bytes=tracing.payload_size(tool_response) if tracing.current_span() else None)
+        return None
+
+    def on_tool_error(tool, args, tool_context, error):
+        finish_tool(tool, tool_context, "error", error=type(error).__name__)
+        return None
     
     # Combine custom Gmail tools, preference tools, and MCP Notion tools
-    gmail_tools = [fetch_inbox_emails, trash_email, archive_email]
+    gmail_tools = [fetch_inbox_emails, triage_inbox, trash_email, archive_email, sender_report]
     preference_tools = [get_user_rules, save_user_rule, get_all_rules]
-    all_tools = preference_tools + gmail_tools + mcp_tools
+    notion_tools = [draft_task_from_email] + mcp_tools
+    job_tools = [submit_action_plan, get_job_status]
+    all_tools = preference_tools + gmail_tools + notion_tools + job_tools
     
     print(f"\nAgent configured with {len(all_tools)} tools total:")
     print(f"  - {len(preference_tools)} preference tools")
     print(f"  - {len(gmail_tools)} Gmail tools")
-    print(f"  - {len(mcp_tools)} Notion MCP tools")
+    print(f"  - {len(mcp_tools)} Notion MCP tools (+ draft_task_from_email)")
+    print(f"  - {len(job_tools)} background job tools")
+    print(f"  Model routes: {router.routes}")
+    
+    if model is None:
+        from google.adk.models.google_llm import Gemini
+        model = Gemini(model=model_name)
+    if cassette:
+        from .cassette_adk import CassetteLlm
+        model = CassetteLlm.wrap(model, cassette)
     
     return LlmAgent(
         name="DigitalDeclutter",
-        model=Gemini(model=model_name),
-        instruction=instruction,
-        tools=all_tools
+        model=model,
+        instruction=instruction_provider,
+        tools=all_tools,
+        before_model_callback=before_model,
+        after_model_callback=after_model,
+        on_model_error_callback=on_model_error,
+        before_tool_callback=before_tool,
+        after_tool_callback=after_tool,
+        on_tool_error_callback=on_tool_error
     )
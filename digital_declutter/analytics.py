@@ -0,0 +1,406 @@
+import argparse
+import datetime
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parseaddr
+from typing import List, Optional
+
+from googleapiclient.errors import HttpError
+
+from .preferences import PreferenceStore
+from .shared_state import connect
+
+# Sender analytics over locally synced message metadata.
+#
+# "Who sends me the most mail?" shouldn't take a fetch of hundreds of emails
+# and a model pass over them. This module keeps each message's sender,
+# month, unread flag and List-Unsubscribe presence in SQLite, and keeps the
+# per-sender totals and monthly volumes up to date as messages are added,
+# changed or removed. A report is then a single query over the senders
+# table. The first sync lists the whole mailbox (resumably, page by page, from
+# the command line or a background thread); later syncs only read the Gmail
+# history since the last one.
+#
+#   python -m digital_declutter.analytics sync [--account ACCOUNT]
+#   python -m digital_declutter.analytics report [--rank-by noise] [--group-by domain]
+
+METADATA_HEADERS = ("From", "List-Unsubscribe")
+# Metadata fetches in flight at once; the scheduler still paces them to the quota
+FETCH_CONCURRENCY = 8
+# "Recent" volume in reports covers this many months, the current one included
+RECENT_MONTHS = 3
+RANKINGS = ("volume", "unread", "noise")
+GROUPINGS = ("sender", "domain")
+# A background initial sync whose last page is more recent than this is left
+# to run; an older one is taken to have died and may be started again
+LISTING_STALE_SECONDS = 300
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id TEXT PRIMARY KEY,
+    address TEXT NOT NULL,
+    month TEXT NOT NULL,
+    unread INTEGER NOT NULL,
+    unsubscribe INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS senders (
+    address TEXT PRIMARY KEY,
+    from_header TEXT NOT NULL,
+    domain TEXT NOT NULL,
+    messages INTEGER NOT NULL DEFAULT 0,
+    unread INTEGER NOT NULL DEFAULT 0,
+    unsubscribe INTEGER NOT NULL DEFAULT 0,
+    last_received INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS senders_by_domain ON senders(domain);
+CREATE TABLE IF NOT EXISTS sender_months (
+    address TEXT NOT NULL,
+    month TEXT NOT NULL,
+    messages INTEGER NOT NULL,
+    PRIMARY KEY (address, month)
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def analytics_db_path(account: Optional[str] = None) -> str:
+    if account:
+        from .tools.gmail_pool import token_path_for
+        return os.path.join(os.path.dirname(token_path_for(account)), "analytics.db")
+    return os.getenv("DECLUTTER_ANALYTICS_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "analytics.db"))
+
+
+def _recent_since(today: datetime.date) -> str:
+    """The first month (YYYY-MM) counted as recent."""
+    year, month = today.year, today.month - (RECENT_MONTHS - 1)
+    while month <= 0:
+        year, month = year - 1, month + 12
+    return f"{year}-{month:02d}"
+
+
+def _month(internal_date: Optional[int]) -> str:
+    if not internal_date:
+        return "unknown"
+    return datetime.datetime.fromtimestamp(internal_date / 1000, datetime.timezone.utc).strftime("%Y-%m")
+
+
+class SenderAnalytics:
+    """Per-sender aggregates of one mailbox, kept in SQLite. Safe to share across threads."""
+
+    def __init__(self, path: str = None):
+        self.path = path or analytics_db_path()
+        # WAL, plus a busy timeout for backend workers syncing the same mailbox
+        self._conn = connect(self.path)
+        self._lock = threading.Lock()
+        # Held for a whole sync, so concurrent callers don't fetch the same pages twice
+        self._sync_lock = threading.Lock()
+        self._sync_thread = None
+        with self._lock:
+            self._conn.executescript(_SCHEMA)
+
+    # --- Sync state ---
+
+    def _state(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    def _set_state(self, key: str, value: Optional[str]):
+        self._conn.execute("INSERT INTO sync_state (key, value) VALUES (?, ?) "
+                           "ON CONFLICT(key) DO UPDATE SET value = excluded.value", (key, value))
+
+    def status(self) -> dict:
+        with self._lock:
+            messages = self._conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+            senders = self._conn.execute("SELECT COUNT(*) FROM senders WHERE messages > 0").fetchone()[0]
+            return {"messages": messages, "senders": senders, "initial_sync_done": self._state("full_sync_done") == "1",
+                    "history_id": self._state("history_id"), "synced_at": self._state("synced_at")}
+
+    # --- Incremental aggregates; callers hold the lock inside a transaction ---
+
+    def _add(self, record):
+        if self._conn.execute("SELECT 1 FROM messages WHERE id = ?", (record.id,)).fetchone():
+            return
+        from_header = record.header("from")
+        address = (parseaddr(from_header)[1] or from_header or "unknown").lower()
+        month = _month(record.internal_date)
+        unread = int("UNREAD" in record.label_ids)
+        unsubscribe = int(bool(record.header("list-unsubscribe")))
+        self._conn.execute("INSERT INTO messages (id, address, month, unread, unsubscribe) VALUES (?, ?, ?, ?, ?)",
+                           (record.id, address, month, unread, unsubscribe))
+        self._conn.execute(
+            "INSERT INTO senders (address, from_header, domain, messages, unread, unsubscribe, last_received) "
+            "VALUES (?, ?, ?, 1, ?, ?, ?) ON CONFLICT(address) DO UPDATE SET "
+            "from_header = excluded.from_header, messages = messages + 1, unread = unread + excluded.unread, "
+            "unsubscribe = unsubscribe + excluded.unsubscribe, "
+            "last_received = MAX(last_received, excluded.last_received)",
+            (address, from_header or address, address.partition("@")[2], unread, unsubscribe, record.internal_date or 0))
+        self._conn.execute("INSERT INTO sender_months (address, month, messages) VALUES (?, ?, 1) "
+                           "ON CONFLICT(address, month) DO UPDATE SET messages = messages + 1", (address, month))
+
+    def _remove(self, msg_id: str):
+        row = self._conn.execute("SELECT * FROM messages WHERE id = ?", (msg_id,)).fetchone()
+        if row is None:
+            return
+        self._conn.execute("DELETE FROM messages WHERE id = ?", (msg_id,))
+        self._conn.execute("UPDATE senders SET messages = messages - 1, unread = unread - ?, "
+                           "unsubscribe = unsubscribe - ? WHERE address = ?",
+                           (row["unread"], row["unsubscribe"], row["address"]))
+        self._conn.execute("UPDATE sender_months SET messages = messages - 1 WHERE address = ? AND month = ?",
+                           (row["address"], row["month"]))
+
+    def _set_unread(self, msg_id: str, unread: bool):
+        row = self._conn.execute("SELECT address, unread FROM messages WHERE id = ?", (msg_id,)).fetchone()
+        if row is None or row["unread"] == int(unread):
+            return
+        self._conn.execute("UPDATE messages SET unread = ? WHERE id = ?", (int(unread), msg_id))
+        self._conn.execute("UPDATE senders SET unread = unread + ? WHERE address = ?",
+                           (1 if unread else -1, row["address"]))
+
+    def _write(self, fn):
+        with self._lock, self._conn:
+            # IMMEDIATE takes the write lock up front, so another process syncing the same
+            # database waits (busy timeout) instead of failing on the read-then-write upgrade
+            self._conn.execute("BEGIN IMMEDIATE")
+            fn()
+
+    # --- Sync ---
+
+    def sync(self, gmail, max_pages: Optional[int] = None) -> dict:
+        """
+        Brings the aggregates up to date: continues the initial listing if it
+        isn't finished (at most `max_pages` pages per call), otherwise applies
+        the mailbox history since the last sync. Returns status().
+        """
+        with self._sync_lock:
+            with self._lock:
+                initial_done = self._state("full_sync_done") == "1"
+            if initial_done:
+                try:
+                    self._sync_history(gmail)
+                except HttpError as error:
+                    if getattr(error.resp, "status", None) != 404:
+                        raise
+                    # Gmail keeps about a week of history; after that, list everything again
+                    print("Mailbox history expired; starting a full analytics sync")
+                    self._write(self._reset)
+                    self._sync_listing(gmail, max_pages)
+            else:
+                self._sync_listing(gmail, max_pages)
+            with self._lock:
+                self._set_state("synced_at", str(int(time.time())))
+        return self.status()
+
+    def start_initial_sync(self, gmail) -> bool:
+        """
+        Runs the initial listing in a background thread, unless it is finished
+        or already running in this or another process. Returns whether a sync
+        was started.
+        """
+        with self._lock:
+            if self._state("full_sync_done") == "1" or (self._sync_thread and self._sync_thread.is_alive()):
+                return False
+            # Claimed in one statement, so only one worker wins a race to start it
+            now = time.time()
+            claimed = self._conn.execute(
+                "INSERT INTO sync_state (key, value) VALUES ('listing_heartbeat', ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value WHERE CAST(value AS REAL) < ?",
+                (str(now), now - LISTING_STALE_SECONDS)).rowcount
+            if not claimed:
+                return False
+            self._sync_thread = threading.Thread(target=self._background_sync, args=(gmail,),
+                                                 name="analytics-sync", daemon=True)
+            self._sync_thread.start()
+        return True
+
+    def _background_sync(self, gmail):
+        try:
+            self.sync(gmail)
+        except Exception as e:
+            print(f"Background analytics sync failed: {e}")
+            with self._lock:
+                self._set_state("listing_heartbeat", "0")
+
+    def _reset(self):
+        for table in ("messages", "senders", "sender_months", "sync_state"):
+            self._conn.execute(f"DELETE FROM {table}")
+
+    def _fetch(self, gmail, msg_ids: List[str], pool: ThreadPoolExecutor) -> list:
+        def fetch(msg_id):
+            try:
+                return gmail.get_metadata(msg_id, METADATA_HEADERS)
+            except HttpError as error:
+                if getattr(error.resp, "status", None) == 404:
+                    return None
+                raise
+        return [record for record in pool.map(fetch, msg_ids) if record is not None]
+
+    def _sync_listing(self, gmail, max_pages: Optional[int]):
+        with self._lock:
+            starting = self._state("listing_history_id") is None
+            page_token = self._state("listing_page_token")
+        if starting:
+            # Changes made while we list are picked up from this point by the first history sync
+            history_id = str(gmail.get_profile()["historyId"])
+            with self._lock:
+                self._set_state("listing_history_id", history_id)
+        pages = 0
+        with ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY, thread_name_prefix="analytics") as pool:
+            while max_pages is None or pages < max_pages:
+                ids, next_token = gmail.list_message_ids("", page_token)
+                with self._lock:
+                    known = {row[0] for row in self._conn.execute(
+                        f"SELECT id FROM messages WHERE id IN ({','.join('?' * len(ids))})", ids)} if ids else set()
+                records = self._fetch(gmail, [i for i in ids if i not in known], pool)
+
+                def apply():
+                    for record in records:
+                        self._add(record)
+                    self._set_state("listing_page_token", next_token)
+                    self._set_state("listing_heartbeat", str(time.time()))
+                    if next_token is None:
+                        self._set_state("full_sync_done", "1")
+                        self._set_state("history_id", self._state("listing_history_id"))
+                self._write(apply)
+                pages += 1
+                page_token = next_token
+                if next_token is None:
+                    break
+        print(f"Analytics sync: {self.status()['messages']} messages after {pages} page(s)")
+
+    def _sync_history(self, gmail):
+        with self._lock:
+            history_id = self._state("history_id")
+        page_token, latest = None, history_id
+        with ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY, thread_name_prefix="analytics") as pool:
+            while True:
+                response = gmail.list_history(history_id, page_token)
+                added, removed, unread = [], set(), {}
+                for change in response.get("history", []):
+                    for item in change.get("messagesAdded", []):
+                        added.append(item["message"]["id"])
+                    for item in change.get("messagesDeleted", []):
+                        removed.add(item["message"]["id"])
+                    for item, present in [(i, True) for i in change.get("labelsAdded", [])] + \
+                                         [(i, False) for i in change.get("labelsRemoved", [])]:
+                        msg_id, labels = item["message"]["id"], item.get("labelIds", [])
+                        if "UNREAD" in labels:
+                            unread[msg_id] = present
+                        if "TRASH" in labels or "SPAM" in labels:
+                            # Trashed or spammed mail drops out of the stats, and comes back if restored
+                            if present:
+                                removed.add(msg_id)
+                            else:
+                                added.append(msg_id)
+                records = self._fetch(gmail, [i for i in dict.fromkeys(added) if i not in removed], pool)
+                page_token = response.get("nextPageToken")
+                latest = response.get("historyId", latest)
+
+                def apply():
+                    for msg_id in removed:
+                        self._remove(msg_id)
+                    for record in records:
+                        self._add(record)
+                    for msg_id, is_unread in unread.items():
+                        self._set_unread(msg_id, is_unread)
+                    if page_token is None:
+                        self._set_state("history_id", str(latest))
+                self._write(apply)
+                if page_token is None:
+                    return
+
+    # --- Reports ---
+
+    def top(self, rank_by: str = "volume", group_by: str = "sender", limit: int = 10,
+            min_messages: int = 3) -> List[dict]:
+        """
+        The top senders or domains by total volume, unread ratio, or "noise"
+        (unread mail from senders that offer List-Unsubscribe).
+        """
+        if rank_by not in RANKINGS or group_by not in GROUPINGS:
+            raise ValueError(f"rank_by must be one of {RANKINGS} and group_by one of {GROUPINGS}")
+        key = "address" if group_by == "sender" else "domain"
+        # Aggregates are spelled out: in HAVING, SQLite resolves "messages" to the column of
+        # one row of the group, not to the SUM alias
+        order = {
+            "volume": "SUM(messages) DESC",
+            "unread": "CAST(SUM(unread) AS REAL) / SUM(messages) DESC, SUM(messages) DESC",
+            "noise": "SUM(unread) DESC, SUM(messages) DESC",
+        }[rank_by]
+        where = "SUM(unsubscribe) > 0" if rank_by == "noise" else "1"
+        query = f"""
+            SELECT {key} AS name, MAX(from_header) AS from_header, COUNT(*) AS senders, SUM(messages) AS messages,
+                   SUM(unread) AS unread, SUM(unsubscribe) AS unsubscribe, MAX(last_received) AS last_received
+            FROM senders WHERE messages > 0 GROUP BY {key}
+            HAVING SUM(messages) >= ? AND {where} ORDER BY {order} LIMIT ?"""
+        recent_query = f"""
+            SELECT COALESCE(SUM(m.messages), 0) FROM sender_months m JOIN senders s ON s.address = m.address
+            WHERE s.{key} = ? AND m.month >= ?"""
+        recent_since = _recent_since(datetime.date.today())
+        with self._lock:
+            rows = [dict(row) for row in self._conn.execute(query, (min_messages, limit))]
+            for row in rows:
+                row["recent"] = self._conn.execute(recent_query, (row["name"], recent_since)).fetchone()[0]
+        for row in rows:
+            row["unread_ratio"] = round(row["unread"] / row["messages"], 2)
+        return rows
+
+
+def format_report(rows: List[dict], prefs: PreferenceStore, rank_by: str, group_by: str, status: dict) -> str:
+    """Compact text for the agent: one line per sender or domain."""
+    coverage = f"{status['messages']} synced messages from {status['senders']} senders"
+    if not status["initial_sync_done"]:
+        coverage += ", initial sync still in progress"
+    if not rows:
+        return f"No {group_by}s to report ({coverage})."
+    lines = [f"Top {len(rows)} {group_by}s by {rank_by} ({coverage}; recent = last {RECENT_MONTHS} months):"]
+    for i, row in enumerate(rows, 1):
+        if group_by == "sender":
+            label = row["from_header"]
+            rule = prefs.match_rule(row["from_header"])
+        else:
+            label = f"{row['name']} ({row['senders']} sender{'s' if row['senders'] != 1 else ''})"
+            rule = prefs.match_rule("@" + row["name"]) if row["name"] else None
+        unsubscribe = "yes" if row["unsubscribe"] else "no"
+        lines.append(f"{i}. {label}: {row['messages']} msgs, {row['recent']} recent, "
+                     f"{row['unread_ratio']:.0%} unread, unsubscribe {unsubscribe}, rule {rule or 'none'}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sync and report sender analytics.")
+    parser.add_argument("command", choices=("sync", "report"))
+    parser.add_argument("--account", help="Pooled account (default: the default account)")
+    parser.add_argument("--rank-by", choices=RANKINGS, default="volume")
+    parser.add_argument("--group-by", choices=GROUPINGS, default="sender")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--preferences", default="preferences.json", help="Rules file (default: preferences.json)")
+    args = parser.parse_args(argv)
+
+    analytics = SenderAnalytics(analytics_db_path(args.account))
+    if args.command == "sync":
+        from .tools.gmail_tool import GmailService
+        if args.account:
+            from .tools.gmail_pool import token_path_for
+            gmail = GmailService(token_path=token_path_for(args.account))
+        else:
+            gmail = GmailService()
+        try:
+            print(analytics.sync(gmail))
+        except KeyboardInterrupt:
+            print("\nInterrupted; run sync again to continue where it stopped.")
+            return 130
+        return 0
+
+    rows = analytics.top(args.rank_by, args.group_by, args.top)
+    print(format_report(rows, PreferenceStore(args.preferences), args.rank_by, args.group_by, analytics.status()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
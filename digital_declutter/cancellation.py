@@ -0,0 +1,73 @@
+import contextvars
+import threading
+import time
+from typing import Optional
+
+# Cooperative cancellation for work started on behalf of one request.
+#
+# asyncio cancellation already reaches coroutines (model calls, MCP sessions),
+# but Gmail calls run synchronously, often in worker threads, where a task
+# cancel can't interrupt them. The backend binds a CancelToken to the request
+# context; since contextvars are copied into tasks and asyncio.to_thread
+# workers, blocking code can check it between API calls and stop early.
+
+
+class RequestCancelled(Exception):
+    """Raised inside a request's work once its token has been cancelled."""
+
+
+class CancelToken:
+    def __init__(self):
+        self._event = threading.Event()
+        self.reason: Optional[str] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "cancelled"):
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise RequestCancelled(self.reason)
+
+    def wait(self, timeout: float) -> bool:
+        """Sleeps up to `timeout` seconds, returning early (True) if cancelled."""
+        return self._event.wait(timeout)
+
+
+_current_token: contextvars.ContextVar[Optional[CancelToken]] = contextvars.ContextVar(
+    "declutter_cancel_token", default=None)
+
+
+def bind_token(token: CancelToken):
+    """Makes `token` the current request's token. Returns a handle for `reset_token`."""
+    return _current_token.set(token)
+
+
+def reset_token(handle):
+    _current_token.reset(handle)
+
+
+def current_token() -> Optional[CancelToken]:
+    return _current_token.get()
+
+
+def raise_if_cancelled():
+    """Raises RequestCancelled if the current request has been cancelled."""
+    token = _current_token.get()
+    if token is not None:
+        token.raise_if_cancelled()
+
+
+def interruptible_sleep(seconds: float):
+    """time.sleep that wakes up and raises as soon as the current request is cancelled."""
+    token = _current_token.get()
+    if token is None:
+        time.sleep(seconds)
+        return
+    if token.wait(seconds):
+        token.raise_if_cancelled()
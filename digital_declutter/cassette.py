@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+import threading
+from collections import defaultdict, deque
+from typing import Optional
+
+# Record/replay cassettes for external traffic.
+#
+# In record mode every Gmail API response, Notion/MCP tool exchange and model
+# request/response of a real run is appended to a JSONL cassette file. In
+# replay mode the same calls are answered from the cassette instead of the
+# network, with their original latency or none at all, so a slow production
+# session can be profiled and regression-tested offline.
+#
+# Configure with:
+#   DECLUTTER_CASSETTE=path/to/session.jsonl
+#   DECLUTTER_CASSETTE_MODE=record | replay
+#   DECLUTTER_CASSETTE_LATENCY=original | zero   (replay only, default: original)
+
+GMAIL = "gmail"
+MODEL = "model"
+MCP = "mcp"
+MCP_TOOLS = "mcp_tools"
+
+
+class CassetteMiss(Exception):
+    """Raised in replay mode when the cassette has no answer for a call."""
+
+
+def make_key(*parts) -> str:
+    """Stable key for a call, from JSON-serializable parts."""
+    payload = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()[:24]
+
+
+class Cassette:
+    def __init__(self, path: str, mode: str, latency: str = "original"):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode '{mode}' (expected 'record' or 'replay')")
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self._lock = threading.Lock()
+        # channel -> key -> queue of interactions, and channel -> all interactions in order
+        self._by_key = defaultdict(lambda: defaultdict(deque))
+        self._by_channel = defaultdict(deque)
+
+        if self.replaying:
+            self._load()
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            # Start a fresh recording
+            open(path, 'w').close()
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == "record"
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def _load(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                interaction = json.loads(line)
+                interaction["used"] = False
+                self._by_key[interaction["channel"]][interaction["key"]].append(interaction)
+                self._by_channel[interaction["channel"]].append(interaction)
+        print(f"Loaded cassette {self.path} ({sum(len(v) for v in self._by_channel.values())} interactions)")
+
+    def record(self, channel: str, key: str, response=None, error: Optional[dict] = None, duration: float = 0.0):
+        """Appends one interaction to the cassette file."""
+        line = json.dumps({
+            "channel": channel,
+            "key": key,
+            "response": response,
+            "error": error,
+            "duration": round(duration, 6),
+        }, ensure_ascii=False, default=str)
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
+
+    def replay(self, channel: str, key: str) -> dict:
+        """
+        Returns the recorded interaction for this call.
+
+        Calls are matched by key first. If the key wasn't recorded (e.g. a
+        prompt changed slightly), the next unused interaction of the same
+        channel is served instead, in recording order.
+        """
+        with self._lock:
+            queue = self._by_key[channel].get(key)
+            while queue and queue[0]["used"]:
+                queue.popleft()
+            if queue:
+                interaction = queue.popleft()
+            else:
+                channel_queue = self._by_channel[channel]
+                while channel_queue and channel_queue[0]["used"]:
+                    channel_queue.popleft()
+                if not channel_queue:
+                    raise CassetteMiss(f"No recorded {channel} interaction left for key {key}")
+                interaction = channel_queue.popleft()
+                print(f"Cassette: no exact {channel} match for {key}, serving next recorded interaction")
+            interaction["used"] = True
+            return interaction
+
+    def interactions(self, channel: str):
+        """All recorded interactions of a channel, in order (replay mode)."""
+        return list(self._by_channel[channel])
+
+    def delay(self, interaction: dict) -> float:
+        """Seconds to wait before serving a replayed interaction."""
+        return interaction.get("duration", 0.0) if self.latency == "original" else 0.0
+
+
+_cassette = None
+_cassette_loaded = False
+
+def get_cassette() -> Optional[Cassette]:
+    """Returns the process-wide cassette configured by environment variables, if any."""
+    global _cassette, _cassette_loaded
+    if not _cassette_loaded:
+        _cassette_loaded = True
+        path = os.getenv("DECLUTTER_CASSETTE")
+        if path:
+            _cassette = Cassette(
+                path,
+                mode=os.getenv("DECLUTTER_CASSETTE_MODE", "replay"),
+                latency=os.getenv("DECLUTTER_CASSETTE_LATENCY", "original"),
+            )
+            print(f"Cassette {_cassette.mode} mode: {path}")
+    return _cassette
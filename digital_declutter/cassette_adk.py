@@ -0,0 +1,114 @@
+import asyncio
+import json
+import time
+from typing import Any, AsyncGenerator, Optional
+
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.llm_response import LlmResponse
+from google.adk.tools.base_tool import BaseTool
+from google.genai import types
+
+from .cassette import MCP, MCP_TOOLS, MODEL, Cassette, make_key
+
+# ADK adapters that put the agent's model and MCP tools behind a cassette.
+
+
+def _strip_ids(value):
+    """Drops generated function-call ids, which differ on every run, from a request dump."""
+    if isinstance(value, dict):
+        return {k: _strip_ids(v) for k, v in value.items() if k != "id"}
+    if isinstance(value, list):
+        return [_strip_ids(v) for v in value]
+    return value
+
+
+def model_request_key(llm_request) -> str:
+    contents = [c.model_dump(mode="json", exclude_none=True) for c in llm_request.contents or []]
+    return make_key(MODEL, llm_request.model, _strip_ids(contents))
+
+
+class CassetteLlm(BaseLlm):
+    """Records the wrapped model's responses, or replays them without calling it."""
+
+    inner: BaseLlm
+    cassette: Any
+
+    @classmethod
+    def wrap(cls, inner: BaseLlm, cassette: Cassette) -> "CassetteLlm":
+        return cls(model=inner.model, inner=inner, cassette=cassette)
+
+    @property
+    def capabilities(self):
+        return self.inner.capabilities
+
+    async def generate_content_async(self, llm_request, stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        key = model_request_key(llm_request)
+
+        if self.cassette.replaying:
+            interaction = self.cassette.replay(MODEL, key)
+            await asyncio.sleep(self.cassette.delay(interaction))
+            if interaction.get("error"):
+                raise RuntimeError(f"Replayed model error: {interaction['error']['message']}")
+            for response in interaction["response"]:
+                yield LlmResponse.model_validate(response)
+            return
+
+        started = time.perf_counter()
+        responses = []
+        try:
+            async for response in self.inner.generate_content_async(llm_request, stream=stream):
+                responses.append(response.model_dump(mode="json", exclude_none=True))
+                yield response
+        except Exception as e:
+            self.cassette.record(MODEL, key, error={"type": type(e).__name__, "message": str(e)},
+                                 duration=time.perf_counter() - started)
+            raise
+        self.cassette.record(MODEL, key, response=responses, duration=time.perf_counter() - started)
+
+
+class CassetteTool(BaseTool):
+    """Records an MCP tool's results, or replays them without an MCP server."""
+
+    def __init__(self, cassette: Cassette, inner: Optional[BaseTool] = None,
+                 declaration: Optional[types.FunctionDeclaration] = None):
+        source = inner or declaration
+        super().__init__(name=source.name, description=source.description or "")
+        self.inner = inner
+        self.cassette = cassette
+        self._declaration = declaration or inner._get_declaration()
+
+    @classmethod
+    def record_declarations(cls, cassette: Cassette, tools):
+        """Stores the tools' declarations so replay can advertise them without the server."""
+        for tool in tools:
+            declaration = tool._get_declaration()
+            cassette.record(MCP_TOOLS, tool.name, response=declaration.model_dump(mode="json", exclude_none=True))
+
+    @classmethod
+    def from_cassette(cls, cassette: Cassette):
+        return [cls(cassette, declaration=types.FunctionDeclaration.model_validate(i["response"]))
+                for i in cassette.interactions(MCP_TOOLS)]
+
+    def _get_declaration(self):
+        return self._declaration
+
+    async def run_async(self, *, args, tool_context):
+        key = make_key(MCP, self.name, args)
+
+        if self.cassette.replaying:
+            interaction = self.cassette.replay(MCP, key)
+            await asyncio.sleep(self.cassette.delay(interaction))
+            if interaction.get("error"):
+                return {"error": interaction["error"]["message"]}
+            return interaction["response"]
+
+        started = time.perf_counter()
+        try:
+            result = await self.inner.run_async(args=args, tool_context=tool_context)
+        except Exception as e:
+            self.cassette.record(MCP, key, error={"type": type(e).__name__, "message": str(e)},
+                                 duration=time.perf_counter() - started)
+            raise
+        self.cassette.record(MCP, key, response=json.loads(json.dumps(result, default=str)),
+                             duration=time.perf_counter() - started)
+        return result
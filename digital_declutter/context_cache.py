@@ -0,0 +1,136 @@
+import hashlib
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+# Explicit Gemini context caching for the agent's static prefix.
+#
+# The system instruction (plus the current sender rules and the tool
+# declarations) is identical on every model call of every turn. Instead of
+# resending it, we upload it once as a cached content entry and point each
+# request at the cache. The cache key is a hash of everything that goes into
+# the entry, so a rule change produces a new entry automatically. With a
+# shared store (see shared_state.py) backend workers reuse each other's
+# entries instead of each uploading the same prefix; shared entries are left
+# to expire by their TTL rather than deleted by whichever worker stops first.
+
+DEFAULT_TTL_SECONDS = int(os.getenv("DECLUTTER_CONTEXT_CACHE_TTL", "3600"))
+# Recreate the entry this long before it expires so requests never hit a dead cache
+REFRESH_MARGIN_SECONDS = 120
+# After a failed create (e.g. prefix below the model's minimum cacheable size),
+# send the prefix inline for this long before trying again
+FAILURE_BACKOFF_SECONDS = 600
+
+
+def context_cache_enabled() -> bool:
+    return os.getenv("DECLUTTER_CONTEXT_CACHE", "1").lower() not in ("0", "false", "no")
+
+
+class InstructionCache:
+    """Creates, reuses and expires cached content for the agent's system prefix."""
+
+    def __init__(self, ttl_seconds: int = DEFAULT_TTL_SECONDS, client=None, shared=None):
+        self.ttl_seconds = ttl_seconds
+        self._client = client
+        # SharedCache other workers see, or None to keep entries to this process
+        self._shared = shared
+        # key -> (cache name, expires_at, model)
+        self._entries: Dict[str, Tuple[str, float, str]] = {}
+        # key -> retry_after
+        self._failures: Dict[str, float] = {}
+
+    @property
+    def client(self):
+        if self._client is None:
+            from google import genai
+            self._client = genai.Client()
+        return self._client
+
+    @staticmethod
+    def cache_key(model: str, config) -> str:
+        digest = hashlib.sha256()
+        digest.update(model.encode())
+        digest.update(str(config.system_instruction).encode())
+        for tool in config.tools or []:
+            digest.update(tool.model_dump_json(exclude_none=True).encode() if hasattr(tool, "model_dump_json") else repr(tool).encode())
+        return digest.hexdigest()
+
+    async def get_or_create(self, model: str, config) -> Optional[str]:
+        """Returns the name of a live cache entry for this prefix, or None to send it inline."""
+        from google.genai import types
+
+        key = self.cache_key(model, config)
+        now = time.time()
+
+        entry = self._entries.get(key)
+        if entry and entry[1] - REFRESH_MARGIN_SECONDS > now:
+            return entry[0]
+        if self._shared is not None:
+            shared = self._shared.get("context_cache", key)
+            if shared and shared["expires_at"] - REFRESH_MARGIN_SECONDS > now:
+                self._entries[key] = (shared["name"], shared["expires_at"], model)
+                return shared["name"]
+        if self._failures.get(key, 0) > now:
+            return None
+
+        try:
+            cached = await self.client.aio.caches.create(
+                model=model,
+                config=types.CreateCachedContentConfig(
+                    display_name="digital-declutter-instruction",
+                    system_instruction=config.system_instruction,
+                    tools=config.tools,
+                    tool_config=config.tool_config,
+                    ttl=f"{self.ttl_seconds}s",
+                ),
+            )
+        except Exception as e:
+            print(f"Context cache unavailable, sending instruction inline: {e}")
+            self._failures[key] = now + FAILURE_BACKOFF_SECONDS
+            return None
+
+        # Drop this model's entries for outdated prefixes (e.g. before a rule change);
+        # shared ones may still be in use by a worker that hasn't seen the change yet
+        for stale_key, (stale_name, _, stale_model) in list(self._entries.items()):
+            if stale_model == model:
+                if self._shared is None:
+                    await self._delete(stale_name)
+                del self._entries[stale_key]
+
+        self._entries[key] = (cached.name, now + self.ttl_seconds, model)
+        if self._shared is not None:
+            self._shared.set("context_cache", key, {"name": cached.name, "expires_at": now + self.ttl_seconds},
+                             expires_at=now + self.ttl_seconds)
+        print(f"Created context cache {cached.name} (ttl {self.ttl_seconds}s)")
+        return cached.name
+
+    async def apply(self, llm_request) -> bool:
+        """Points the request at the cached prefix. Returns False if it was left inline."""
+        config = llm_request.config
+        if config is None or not config.system_instruction or config.cached_content:
+            return False
+
+        model = llm_request.model or ""
+        name = await self.get_or_create(model, config)
+        if not name:
+            return False
+
+        # Gemini rejects requests that repeat cached fields alongside cached_content
+        config.cached_content = name
+        config.system_instruction = None
+        config.tools = None
+        config.tool_config = None
+        return True
+
+    async def _delete(self, name: str):
+        try:
+            await self.client.aio.caches.delete(name=name)
+        except Exception as e:
+            print(f"Failed to delete context cache {name}: {e}")
+
+    async def close(self):
+        """Deletes all live cache entries (shared ones expire on their own)."""
+        if self._shared is None:
+            for name, _, _ in list(self._entries.values()):
+                await self._delete(name)
+        self._entries.clear()
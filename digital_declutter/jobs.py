@@ -0,0 +1,426 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from . import metrics
+from .cancellation import CancelToken, RequestCancelled, bind_token, reset_token
+from .shared_state import connect
+from .tools.gmail_pool import bind_account, reset_account, validate_account
+
+# Background jobs for approved action plans.
+#
+# Executing a plan (dozens of archives, trashes and Notion tasks) inside a
+# /chat request ties the request up for minutes. Instead the plan is submitted
+# as a job: its steps are stored in SQLite, a few worker tasks run them in the
+# background with separate concurrency limits for Gmail and Notion, and every
+# finished step is written back, so a restarted backend picks up where it left
+# off. Steps that were in flight during a crash run again; archive and trash
+# are idempotent, a Notion task may be created twice.
+#
+# Several backend workers can share one jobs database. A worker claims a job
+# with a conditional UPDATE before running it and keeps a heartbeat on it;
+# queued jobs, and running jobs whose owner's heartbeat went stale (the
+# worker died), are claimed by whichever worker polls first. A stopping
+# worker hands its running jobs back to the queue.
+
+# action -> the backend it uses, which bounds how many such steps run at once
+ACTIONS = {"archive": "gmail", "trash": "gmail", "create_task": "notion"}
+RESOURCE_CONCURRENCY = {"gmail": 4, "notion": 2}
+# Jobs executed at the same time; the rest wait in the queue
+MAX_RUNNING_JOBS = 2
+MAX_STEPS_PER_JOB = 1000
+# How often a worker renews its jobs' heartbeats and looks for claimable jobs (seconds)
+HEARTBEAT_SECONDS = 5
+# A running job whose heartbeat is older than this is considered abandoned (seconds)
+STALE_AFTER_SECONDS = 30
+# How often watch() re-reads a job another worker may be updating (seconds)
+WATCH_POLL_SECONDS = 1.0
+
+# Job statuses; a job "failed" when at least one of its steps did
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = "queued", "running", "succeeded", "failed", "cancelled"
+TERMINAL_STATUSES = {SUCCEEDED, FAILED, CANCELLED}
+# Step statuses
+PENDING, DONE, STEP_FAILED, SKIPPED = "pending", "done", "failed", "skipped"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    account TEXT,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    error TEXT,
+    owner TEXT,
+    heartbeat REAL
+);
+CREATE TABLE IF NOT EXISTS job_steps (
+    job_id TEXT NOT NULL REFERENCES jobs(id),
+    idx INTEGER NOT NULL,
+    action TEXT NOT NULL,
+    email_id TEXT NOT NULL,
+    payload TEXT,
+    status TEXT NOT NULL,
+    result TEXT,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs(status);
+"""
+
+
+def jobs_db_path() -> str:
+    return os.getenv("DECLUTTER_JOBS_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "jobs.db"))
+
+
+def validate_plan(actions: List[dict]) -> List[dict]:
+    """Checks a submitted plan; raises ValueError describing the first bad step."""
+    if not actions:
+        raise ValueError("The plan has no actions")
+    if len(actions) > MAX_STEPS_PER_JOB:
+        raise ValueError(f"A job can have at most {MAX_STEPS_PER_JOB} actions, got {len(actions)}")
+    for i, step in enumerate(actions):
+        if not isinstance(step, dict) or step.get("action") not in ACTIONS:
+            raise ValueError(f"Action {i}: expected one of {sorted(ACTIONS)}")
+        if not isinstance(step.get("email_id"), str) or not step["email_id"]:
+            raise ValueError(f"Action {i}: missing email_id")
+        if "task" in step and not isinstance(step["task"], dict):
+            raise ValueError(f"Action {i}: task must be an object")
+    return actions
+
+
+class JobStore:
+    """SQLite persistence for jobs and their steps. Safe to share across threads."""
+
+    def __init__(self, path: str = None):
+        self.path = path or jobs_db_path()
+        # WAL keeps progress reads from blocking step updates
+        self._conn = connect(self.path)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.executescript(_SCHEMA)
+            # Databases created before jobs could be claimed by one of several workers
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            for column, kind in (("owner", "TEXT"), ("heartbeat", "REAL")):
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+
+    def create(self, job_id: str, account: Optional[str], actions: List[dict]):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute("INSERT INTO jobs (id, account, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                               (job_id, account, QUEUED, now, now))
+            self._conn.executemany(
+                "INSERT INTO job_steps (job_id, idx, action, email_id, payload, status) VALUES (?, ?, ?, ?, ?, ?)",
+                [(job_id, i, step["action"], step["email_id"], json.dumps(step.get("task")) if step.get("task") else None,
+                  PENDING) for i, step in enumerate(actions)])
+
+    def finish(self, job_id: str, owner: str, status: str, error: Optional[str] = None) -> bool:
+        """Records the outcome of a job `owner` ran. False if it was cancelled (or taken over) meanwhile."""
+        with self._lock:
+            cursor = self._conn.execute("UPDATE jobs SET status = ?, error = ?, updated_at = ? "
+                                        "WHERE id = ? AND owner = ? AND status = ?",
+                                        (status, error, time.time(), job_id, owner, RUNNING))
+        return cursor.rowcount == 1
+
+    def status(self, job_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row["status"] if row else None
+
+    def claim(self, job_id: str, owner: str, stale_after: float = STALE_AFTER_SECONDS) -> bool:
+        """Marks the job running under `owner` if it's queued or abandoned. False if another worker has it."""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, owner = ?, heartbeat = ?, updated_at = ? WHERE id = ? AND "
+                "(status = ? OR (status = ? AND (heartbeat IS NULL OR heartbeat < ?)))",
+                (RUNNING, owner, now, now, job_id, QUEUED, RUNNING, now - stale_after))
+        return cursor.rowcount == 1
+
+    def beat(self, owner: str):
+        """Renews the heartbeat of the owner's running jobs."""
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET heartbeat = ? WHERE owner = ? AND status = ?",
+                               (time.time(), owner, RUNNING))
+
+    def release(self, owner: str) -> int:
+        """Puts the owner's running jobs back in the queue, e.g. when its worker stops."""
+        with self._lock:
+            cursor = self._conn.execute("UPDATE jobs SET status = ?, owner = NULL, heartbeat = NULL, updated_at = ? "
+                                        "WHERE owner = ? AND status = ?", (QUEUED, time.time(), owner, RUNNING))
+        return cursor.rowcount
+
+    def cancel_unless_finished(self, job_id: str) -> bool:
+        """Marks a queued or running job cancelled and skips its pending steps. False if it already finished."""
+        with self._lock:
+            cursor = self._conn.execute("UPDATE jobs SET status = ?, updated_at = ? WHERE id = ? AND status IN (?, ?)",
+                                        (CANCELLED, time.time(), job_id, QUEUED, RUNNING))
+        if cursor.rowcount == 1:
+            self.skip_pending(job_id, "cancelled")
+        return cursor.rowcount == 1
+
+    def statuses(self, job_ids: List[str]) -> Dict[str, str]:
+        if not job_ids:
+            return {}
+        with self._lock:
+            rows = self._conn.execute(f"SELECT id, status FROM jobs WHERE id IN ({', '.join('?' * len(job_ids))})",
+                                      job_ids).fetchall()
+        return {row["id"]: row["status"] for row in rows}
+
+    def finish_step(self, job_id: str, idx: int, status: str, result: str):
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            # A step skipped by a cancel through another worker stays skipped
+            self._conn.execute("UPDATE job_steps SET status = ?, result = ? WHERE job_id = ? AND idx = ? "
+                               "AND status = ?", (status, result, job_id, idx, PENDING))
+            self._conn.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (time.time(), job_id))
+
+    def skip_pending(self, job_id: str, reason: str):
+        with self._lock:
+            self._conn.execute("UPDATE job_steps SET status = ?, result = ? WHERE job_id = ? AND status = ?",
+                               (SKIPPED, reason, job_id, PENDING))
+
+    def pending_steps(self, job_id: str) -> List[dict]:
+        with self._lock:
+            rows = self._conn.execute("SELECT idx, action, email_id, payload FROM job_steps "
+                                      "WHERE job_id = ? AND status = ? ORDER BY idx", (job_id, PENDING)).fetchall()
+        return [{"idx": row["idx"], "action": row["action"], "email_id": row["email_id"],
+                 "task": json.loads(row["payload"]) if row["payload"] else None} for row in rows]
+
+    def unfinished(self, stale_after: float = STALE_AFTER_SECONDS) -> List[str]:
+        """Queued jobs and running jobs nobody is heartbeating (their worker stopped), oldest first."""
+        with self._lock:
+            rows = self._conn.execute("SELECT id FROM jobs WHERE status = ? OR (status = ? AND "
+                                      "(heartbeat IS NULL OR heartbeat < ?)) ORDER BY created_at",
+                                      (QUEUED, RUNNING, time.time() - stale_after)).fetchall()
+        return [row["id"] for row in rows]
+
+    def get(self, job_id: str, steps: bool = True) -> Optional[dict]:
+        """The job's status and progress counts (and each step's outcome), or None if unknown."""
+        with self._lock:
+            job = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if job is None:
+                return None
+            counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM job_steps WHERE job_id = ? GROUP BY status",
+                                             (job_id,)).fetchall())
+            rows = self._conn.execute("SELECT idx, action, email_id, status, result FROM job_steps WHERE job_id = ? "
+                                      "ORDER BY idx", (job_id,)).fetchall() if steps else []
+        data = dict(job)
+        data["progress"] = {status: counts.get(status, 0) for status in (PENDING, DONE, STEP_FAILED, SKIPPED)}
+        data["progress"]["total"] = sum(counts.values())
+        if steps:
+            data["steps"] = [dict(row) for row in rows]
+        return data
+
+    def recent(self, limit: int = 20, account: Optional[str] = None) -> List[dict]:
+        with self._lock:
+            rows = self._conn.execute("SELECT id FROM jobs WHERE (? IS NULL OR account = ?) "
+                                      "ORDER BY created_at DESC LIMIT ?", (account, account, limit)).fetchall()
+        return [self.get(row["id"], steps=False) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# A step executor receives {"idx", "action", "email_id", "task"} and returns a short result
+# text, or raises if the step failed
+StepExecutor = Callable[[dict], Awaitable[str]]
+
+
+class JobQueue:
+    """Runs stored jobs in the background on the event loop it was started on."""
+
+    def __init__(self, store: JobStore, executors: Dict[str, StepExecutor], max_running: int = MAX_RUNNING_JOBS,
+                 concurrency: Optional[Dict[str, int]] = None):
+        self.store = store
+        self.executors = executors
+        self.max_running = max_running
+        limits = dict(RESOURCE_CONCURRENCY, **(concurrency or {}))
+        self._semaphores = {resource: asyncio.Semaphore(limit) for resource, limit in limits.items()}
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._changed = asyncio.Condition()
+        self._workers: List[asyncio.Task] = []
+        # job id -> cancel token of the running job
+        self._tokens: Dict[str, CancelToken] = {}
+        # Jobs in self._queue, so polling doesn't queue them twice
+        self._queued = set()
+        # Identifies this process's claims in the shared database
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+    async def start(self):
+        """Starts the workers and re-queues jobs a previous process didn't finish. Idempotent."""
+        if self._workers:
+            return
+        resumed = self._enqueue_claimable()
+        if resumed:
+            print(f"Resuming {resumed} unfinished job(s)")
+        self._workers = [asyncio.create_task(self._worker(), name=f"job-worker-{i}") for i in range(self.max_running)]
+        self._workers.append(asyncio.create_task(self._heartbeat(), name="job-heartbeat"))
+
+    async def stop(self):
+        """Stops the workers. Interrupted steps stay pending and run again in this or another worker."""
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        released = self.store.release(self.owner)
+        if released:
+            print(f"Returned {released} interrupted job(s) to the queue")
+
+    def _enqueue(self, job_id: str):
+        if job_id not in self._queued and job_id not in self._tokens:
+            self._queued.add(job_id)
+            self._queue.put_nowait(job_id)
+
+    def _enqueue_claimable(self) -> int:
+        job_ids = [job_id for job_id in self.store.unfinished()
+                   if job_id not in self._queued and job_id not in self._tokens]
+        for job_id in job_ids:
+            self._enqueue(job_id)
+        return len(job_ids)
+
+    async def _heartbeat(self):
+        """Keeps this worker's claims alive, picks up jobs other workers queued or abandoned, and
+        stops running jobs that were cancelled through another worker."""
+        while True:
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+            try:
+                self.store.beat(self.owner)
+                self._enqueue_claimable()
+                for job_id, status in self.store.statuses(list(self._tokens)).items():
+                    if status == CANCELLED:
+                        self._tokens[job_id].cancel("job cancelled")
+            except Exception as e:
+                print(f"Job heartbeat failed: {e}")
+
+    async def submit(self, actions: List[dict], account: Optional[str] = None) -> str:
+        validate_plan(actions)
+        if account:
+            validate_account(account)
+        job_id = uuid.uuid4().hex[:12]
+        self.store.create(job_id, account, actions)
+        metrics.JOBS.labels(QUEUED).inc()
+        await self.start()
+        self._enqueue(job_id)
+        print(f"Job {job_id} queued with {len(actions)} actions")
+        return job_id
+
+    def get(self, job_id: str, steps: bool = True) -> Optional[dict]:
+        return self.store.get(job_id, steps=steps)
+
+    async def cancel(self, job_id: str) -> Optional[dict]:
+        """Cancels a queued or running job; steps already done stay done."""
+        job = self.store.get(job_id, steps=False)
+        if job is None or job["status"] in TERMINAL_STATUSES:
+            return job
+        token = self._tokens.get(job_id)
+        if token is not None:
+            # The running job notices between steps and finishes itself as cancelled
+            token.cancel("job cancelled")
+        elif self.store.cancel_unless_finished(job_id):
+            # Queued, or running in another worker, which checks before starting each step
+            metrics.JOBS.labels(CANCELLED).inc()
+            await self._notify()
+        return self.store.get(job_id, steps=False)
+
+    async def watch(self, job_id: str, heartbeat: float = 15.0):
+        """Yields the job's progress each time it changes, until the job finishes."""
+        last = None
+        while True:
+            job = self.store.get(job_id, steps=False)
+            if job is None:
+                return
+            state = (job["status"], tuple(job["progress"].values()))
+            if state != last:
+                last = state
+                yield job
+            if job["status"] in TERMINAL_STATUSES:
+                return
+            # Only this worker's own jobs notify us; others are polled
+            timeout = heartbeat if job_id in self._tokens else min(heartbeat, WATCH_POLL_SECONDS)
+            async with self._changed:
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _notify(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            self._queued.discard(job_id)
+            try:
+                await self._run(job_id)
+            except Exception as e:
+                print(f"Job {job_id} crashed: {e}")
+                if self.store.finish(job_id, self.owner, FAILED, error=str(e)):
+                    metrics.JOBS.labels(FAILED).inc()
+                await self._notify()
+
+    async def _run(self, job_id: str):
+        job = self.store.get(job_id, steps=False)
+        if job is None or job["status"] in TERMINAL_STATUSES:
+            return
+        if not self.store.claim(job_id, self.owner):
+            return  # Another worker is running it
+        token = self._tokens[job_id] = CancelToken()
+        await self._notify()
+        started = time.perf_counter()
+
+        # Steps (and their worker threads) act on the job's mailbox and stop when the job is cancelled
+        token_handle = bind_token(token)
+        account_handle = bind_account(job["account"])
+        metrics.JOBS_RUNNING.inc()
+        try:
+            await asyncio.gather(*(self._run_step(job_id, step, token) for step in self.store.pending_steps(job_id)))
+        finally:
+            metrics.JOBS_RUNNING.dec()
+            reset_account(account_handle)
+            reset_token(token_handle)
+            del self._tokens[job_id]
+
+        if token.cancelled:
+            self.store.skip_pending(job_id, "cancelled")
+        progress = self.store.get(job_id, steps=False)["progress"]
+        if token.cancelled:
+            status, error = CANCELLED, None
+        elif progress[STEP_FAILED]:
+            status, error = FAILED, f"{progress[STEP_FAILED]} of {progress['total']} actions failed"
+        else:
+            status, error = SUCCEEDED, None
+        if not self.store.finish(job_id, self.owner, status, error=error):
+            # Cancelled through another worker, which already counted it
+            status = self.store.status(job_id)
+        else:
+            metrics.JOBS.labels(status).inc()
+        metrics.JOB_SECONDS.observe(time.perf_counter() - started)
+        print(f"Job {job_id} {status} in {time.perf_counter() - started:.1f}s ({progress})")
+        await self._notify()
+
+    async def _run_step(self, job_id: str, step: dict, token: CancelToken):
+        action = step["action"]
+        async with self._semaphores[ACTIONS[action]]:
+            # A cancel through another worker only shows in the database
+            if not token.cancelled and self.store.status(job_id) == CANCELLED:
+                token.cancel("job cancelled")
+            if token.cancelled:
+                return
+            started = time.perf_counter()
+            try:
+                result, status = await self.executors[action](step), DONE
+            except RequestCancelled:
+                return
+            except Exception as e:
+                result, status = f"{type(e).__name__}: {e}", STEP_FAILED
+            metrics.JOB_STEP_SECONDS.labels(action).observe(time.perf_counter() - started)
+        metrics.JOB_STEPS.labels(action, status).inc()
+        self.store.finish_step(job_id, step["idx"], status, result)
+        await self._notify()
@@ -0,0 +1,374 @@
+import abc
+import json
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Prometheus-style metrics.
+#
+# A small in-process registry of counters, gauges and histograms rendered in
+# the Prometheus text exposition format, so the backend can be scraped at
+# /metrics without extra dependencies. Instruments are module-level
+# constants below; code records into them with `.labels(...).inc()` etc.
+#
+# With several backend workers each process has its own registry. Workers
+# then publish snapshots of it to the shared state database (SharedMetrics),
+# and /metrics renders all of them merged: counters and histograms are summed
+# over every worker that ever published, so they never go backwards, and
+# gauges are reported per live worker with a "worker" label.
+
+# Seconds; wide enough for both single Gmail calls and whole agent turns
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# How often a worker publishes its snapshot, and when a silent worker's gauges are dropped (seconds)
+PUBLISH_INTERVAL_SECONDS = 1
+STALE_AFTER_SECONDS = 3 * PUBLISH_INTERVAL_SECONDS
+COUNT_BUCKETS = (1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 30, 50)
+TOKEN_BUCKETS = (100, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000, 500000)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class _Metric(abc.ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+        key = tuple(str(v) for v in values)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = self._new_child()
+            return child
+
+    @abc.abstractmethod
+    def _new_child(self):
+        """A fresh value for one set of label values."""
+
+    def remove(self, *values):
+        """Drops the child with these label values, e.g. for an account that is gone."""
+        with self._lock:
+            self._children.pop(tuple(str(v) for v in values), None)
+
+    def _unlabelled(self):
+        return self.labels()
+
+    def collect(self):
+        with self._lock:
+            return sorted(self._children.items())
+
+    def snapshot(self) -> List[list]:
+        """[label values, data] per child, JSON-serializable."""
+        return [[list(values), self._child_data(child)] for values, child in self.collect()]
+
+    def _child_data(self, child):
+        return child.get()
+
+    @staticmethod
+    def merge_data(a, b):
+        return b if a is None else a + b
+
+    def render(self, samples=None, labelnames=None) -> str:
+        """This process's values, or the given (label values, data) samples."""
+        if samples is None:
+            samples = [(tuple(values), data) for values, data in self.snapshot()]
+        labelnames = self.labelnames if labelnames is None else labelnames
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, data in samples:
+            lines.extend(self._render_sample(labelnames, values, data))
+        return "\n".join(lines)
+
+    def _render_sample(self, labelnames, values, data):
+        return [f"{self.name}{_label_text(labelnames, values)} {_format_value(data)}"]
+
+
+class _Value:
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1):
+        with self._lock:
+            self._value -= amount
+
+    def set(self, value: float):
+        with self._lock:
+            self._value = value
+
+    def get(self) -> float:
+        return self._value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self._unlabelled().inc(amount)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value: float):
+        self._unlabelled().set(value)
+
+    def inc(self, amount: float = 1):
+        self._unlabelled().inc(amount)
+
+    def dec(self, amount: float = 1):
+        self._unlabelled().dec(amount)
+
+
+class _HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.sum += value
+            self.count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self._unlabelled().observe(value)
+
+    def _child_data(self, child):
+        return list(child.snapshot())
+
+    @staticmethod
+    def merge_data(a, b):
+        if a is None:
+            return b
+        return [[x + y for x, y in zip(a[0], b[0])], a[1] + b[1], a[2] + b[2]]
+
+    def _render_sample(self, labelnames, values, data):
+        counts, total, count = data
+        names = labelnames + ("le",)
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            lines.append(f"{self.name}_bucket{_label_text(names, values + (_format_value(bound),))} {cumulative}")
+        lines.append(f"{self.name}_bucket{_label_text(names, values + ('+Inf',))} {count}")
+        labels = _label_text(labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        return "\n".join(m.render() for m in metrics) + "\n"
+
+    def snapshot(self, gauges: bool = True) -> Dict[str, List[list]]:
+        with self._lock:
+            metrics = list(self._metrics)
+        return {m.name: m.snapshot() for m in metrics if gauges or not isinstance(m, Gauge)}
+
+    def render_merged(self, snapshots) -> str:
+        """Renders (worker, snapshot, live) triples as one registry."""
+        with self._lock:
+            metrics = list(self._metrics)
+        parts = []
+        for metric in metrics:
+            if isinstance(metric, Gauge):
+                samples = sorted((tuple(values) + (worker,), data) for worker, snapshot, live in snapshots if live
+                                 for values, data in snapshot.get(metric.name, []))
+                parts.append(metric.render(samples, metric.labelnames + ("worker",)))
+                continue
+            merged = {}
+            for _, snapshot, _ in snapshots:
+                for values, data in snapshot.get(metric.name, []):
+                    merged[tuple(values)] = metric.merge_data(merged.get(tuple(values)), data)
+            parts.append(metric.render(sorted(merged.items())))
+        return "\n".join(parts) + "\n"
+
+
+class SharedMetrics:
+    """Each worker's latest registry snapshot, in the shared state database."""
+
+    def __init__(self, path: str):
+        from .shared_state import connect
+        self._conn = connect(path)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS metrics_snapshots (worker TEXT PRIMARY KEY, "
+                               "snapshot TEXT NOT NULL, updated_at REAL NOT NULL)")
+
+    def publish(self, worker: str, snapshot: dict):
+        with self._lock:
+            self._conn.execute("INSERT INTO metrics_snapshots VALUES (?, ?, ?) ON CONFLICT(worker) DO UPDATE SET "
+                               "snapshot = excluded.snapshot, updated_at = excluded.updated_at",
+                               (worker, json.dumps(snapshot), time.time()))
+
+    def load(self, stale_after: float = STALE_AFTER_SECONDS) -> List[tuple]:
+        """(worker, snapshot, live) for every worker that published."""
+        with self._lock:
+            rows = self._conn.execute("SELECT worker, snapshot, updated_at FROM metrics_snapshots").fetchall()
+        now = time.time()
+        return [(row["worker"], json.loads(row["snapshot"]), row["updated_at"] > now - stale_after) for row in rows]
+
+    def clear(self):
+        """Forgets every worker, e.g. when the whole server starts (counters restart from zero)."""
+        with self._lock:
+            self._conn.execute("DELETE FROM metrics_snapshots")
+
+
+REGISTRY = Registry()
+
+def render() -> str:
+    """The whole registry in Prometheus text format."""
+    return REGISTRY.render()
+
+
+_shared_metrics: Optional[SharedMetrics] = None
+
+def get_shared_metrics() -> Optional[SharedMetrics]:
+    """The snapshot store when workers share DECLUTTER_STATE_DB, else None."""
+    global _shared_metrics
+    from .shared_state import state_db_path
+    if _shared_metrics is None and state_db_path():
+        _shared_metrics = SharedMetrics(state_db_path())
+    return _shared_metrics
+
+# --- HTTP ---
+HTTP_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "declutter_http_request_duration_seconds", "HTTP request latency.", ("method", "path", "status")))
+HTTP_IN_FLIGHT = REGISTRY.register(Gauge(
+    "declutter_http_requests_in_flight", "HTTP requests currently being served."))
+
+# --- Agent loop ---
+AGENT_MODEL_CALLS_PER_REQUEST = REGISTRY.register(Histogram(
+    "declutter_agent_loop_iterations", "Model calls (agent-loop iterations) per /chat request.",
+    buckets=COUNT_BUCKETS))
+AGENT_EVENTS = REGISTRY.register(Counter(
+    "declutter_agent_events_total", "Runner events by kind.", ("kind",)))
+
+# --- Tools ---
+TOOL_SECONDS = REGISTRY.register(Histogram(
+    "declutter_tool_duration_seconds", "Tool call latency.", ("tool",)))
+TOOL_CALLS = REGISTRY.register(Counter(
+    "declutter_tool_calls_total", "Tool calls by outcome.", ("tool", "status")))
+
+# --- Gmail ---
+GMAIL_CALLS = REGISTRY.register(Counter(
+    "declutter_gmail_api_calls_total", "Gmail API requests sent, including retries.", ("method",)))
+GMAIL_QUOTA_UNITS = REGISTRY.register(Counter(
+    "declutter_gmail_quota_units_total", "Gmail quota units consumed.", ("method",)))
+GMAIL_RETRIES = REGISTRY.register(Counter(
+    "declutter_gmail_retries_total", "Gmail API requests retried after a transient error.", ("method",)))
+GMAIL_THROTTLED = REGISTRY.register(Counter(
+    "declutter_gmail_throttled_total", "Gmail rate-limit responses."))
+GMAIL_RATE = REGISTRY.register(Gauge(
+    "declutter_gmail_scheduler_units_per_second", "Current Gmail scheduler pacing rate, per account.", ("account",)))
+GMAIL_ACCOUNTS = REGISTRY.register(Gauge(
+    "declutter_gmail_accounts_active", "Gmail accounts with a pooled client."))
+GMAIL_ACCOUNT_EVICTIONS = REGISTRY.register(Counter(
+    "declutter_gmail_account_evictions_total", "Pooled Gmail accounts evicted as idle or least recently used."))
+
+# --- Model ---
+MODEL_CALLS = REGISTRY.register(Counter(
+    "declutter_model_calls_total", "Model calls by route and outcome.", ("route", "status")))
+MODEL_SECONDS = REGISTRY.register(Histogram(
+    "declutter_model_call_duration_seconds", "Model call latency.", ("route",)))
+MODEL_TOKENS = REGISTRY.register(Counter(
+    "declutter_model_tokens_total", "Model tokens by route and direction (cached tokens are part of input).",
+    ("route", "direction")))
+MODEL_COST = REGISTRY.register(Counter(
+    "declutter_model_cost_usd_total", "Estimated model spend in USD.", ("route",)))
+REQUEST_TOKENS = REGISTRY.register(Histogram(
+    "declutter_request_tokens", "Model tokens per /chat request, across all routes.", ("direction",),
+    buckets=TOKEN_BUCKETS))
+REQUEST_COST = REGISTRY.register(Histogram(
+    "declutter_request_cost_usd", "Estimated model spend per /chat request.",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1)))
+SESSION_BUDGET_EXCEEDED = REGISTRY.register(Counter(
+    "declutter_session_budget_exceeded_total", "Requests stopped or refused by the session token budget."))
+
+# --- MCP ---
+MCP_LAST_CALL_OK = REGISTRY.register(Gauge(
+    "declutter_mcp_last_call_ok", "Last MCP tool outcome: 1 if the server's last tool call (or, before any, "
+    "its startup tool listing) succeeded. Not a liveness check.", ("server",)))
+MCP_SERVER_TOOLS = REGISTRY.register(Gauge(
+    "declutter_mcp_server_tools", "Tools loaded from each MCP server.", ("server",)))
+
+# --- Background jobs ---
+JOBS = REGISTRY.register(Counter(
+    "declutter_jobs_total", "Background jobs by status transition (queued, then succeeded/failed/cancelled).",
+    ("status",)))
+JOBS_RUNNING = REGISTRY.register(Gauge(
+    "declutter_jobs_running", "Background jobs currently executing."))
+JOB_SECONDS = REGISTRY.register(Histogram(
+    "declutter_job_duration_seconds", "Time a background job spends executing.",
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)))
+JOB_STEPS = REGISTRY.register(Counter(
+    "declutter_job_steps_total", "Background job actions by outcome.", ("action", "status")))
+JOB_STEP_SECONDS = REGISTRY.register(Histogram(
+    "declutter_job_step_duration_seconds", "Background job action latency.", ("action",)))
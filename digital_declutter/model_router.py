@@ -0,0 +1,163 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from . import metrics, tracing
+from .usage import current_usage, estimate_cost, token_counts
+from .cassette import MODEL, get_cassette, make_key
+
+# Tiered model routing.
+#
+# Each step of the workflow asks for a *route* instead of a model name, so bulk
+# work (triage batches) runs on the cheapest model while careful work (drafting
+# a Notion task, re-checking ambiguous emails) goes to a stronger one. Every
+# route keeps latency and token counters so the cost/latency tradeoff can be
+# tuned from real traffic. Override a route with DECLUTTER_MODEL_<ROUTE>, e.g.
+# DECLUTTER_MODEL_COMPOSE=gemini-2.5-pro.
+
+DEFAULT_ROUTES = {
+    "agent": "gemini-2.5-flash-lite",     # conversational loop and tool orchestration
+    "classify": "gemini-2.5-flash-lite",  # bulk triage batches
+    "escalate": "gemini-2.5-flash",       # triage items the classifier was unsure about
+    "compose": "gemini-2.5-flash",        # drafting Notion tasks from emails
+}
+
+
+class RouteStats:
+    """Call, latency and token counters for one route."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.input_tokens = 0
+        self.cached_tokens = 0
+        self.output_tokens = 0
+        self.cost_usd = 0.0
+
+    def record(self, latency: float, usage=None, error: bool = False, model: str = ""):
+        self.calls += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        if error:
+            self.errors += 1
+        input_tokens, cached_tokens, output_tokens = token_counts(usage)
+        self.input_tokens += input_tokens
+        self.cached_tokens += cached_tokens
+        self.output_tokens += output_tokens
+        self.cost_usd += estimate_cost(model, input_tokens, cached_tokens, output_tokens)
+
+    def snapshot(self) -> dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "avg_latency": round(self.total_latency / self.calls, 4) if self.calls else 0.0,
+            "max_latency": round(self.max_latency, 4),
+            "input_tokens": self.input_tokens,
+            "cached_tokens": self.cached_tokens,
+            "output_tokens": self.output_tokens,
+            "cost_usd": round(self.cost_usd, 6),
+        }
+
+
+class ModelRouter:
+    """Resolves routes to model names and records per-route usage."""
+
+    def __init__(self, routes: Optional[Dict[str, str]] = None, client=None):
+        self.routes = dict(DEFAULT_ROUTES)
+        for route in self.routes:
+            override = os.getenv(f"DECLUTTER_MODEL_{route.upper()}")
+            if override:
+                self.routes[route] = override
+        if routes:
+            self.routes.update(routes)
+        self._client = client
+        self._stats: Dict[str, RouteStats] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            from google import genai
+            self._client = genai.Client()
+        return self._client
+
+    def model_for(self, route: str) -> str:
+        if route not in self.routes:
+            raise KeyError(f"Unknown model route '{route}'. Known routes: {sorted(self.routes)}")
+        return self.routes[route]
+
+    def record(self, route: str, latency: float, usage=None, error: bool = False):
+        model = self.routes.get(route, "")
+        with self._lock:
+            self._stats.setdefault(route, RouteStats()).record(latency, usage=usage, error=error, model=model)
+        metrics.MODEL_CALLS.labels(route, "error" if error else "ok").inc()
+        metrics.MODEL_SECONDS.labels(route).observe(latency)
+        if usage is not None:
+            input_tokens, cached_tokens, output_tokens = token_counts(usage)
+            metrics.MODEL_TOKENS.labels(route, "input").inc(input_tokens)
+            metrics.MODEL_TOKENS.labels(route, "cached").inc(cached_tokens)
+            metrics.MODEL_TOKENS.labels(route, "output").inc(output_tokens)
+            metrics.MODEL_COST.labels(route).inc(estimate_cost(model, input_tokens, cached_tokens, output_tokens))
+            # Attribute the call to the /chat request it was made for, if any
+            request_usage = current_usage()
+            if request_usage is not None:
+                request_usage.add(model, usage)
+
+    async def generate(self, route: str, contents, config=None):
+        """Runs one generate_content call on the route's model and records it."""
+        with tracing.span(f"model {route}", "model", model=self.model_for(route)) as span:
+            response = await self._generate(route, contents, config)
+            usage = getattr(response, "usage_metadata", None)
+            if span and usage is not None:
+                span.set(input_tokens=usage.prompt_token_count, output_tokens=usage.candidates_token_count)
+            return response
+
+    async def _generate(self, route: str, contents, config=None):
+        cassette = get_cassette()
+        model = self.model_for(route)
+        if cassette:
+            key = make_key(MODEL, route, model, contents, config.model_dump(mode="json", exclude_none=True) if config else None)
+            if cassette.replaying:
+                return await self._replay(route, cassette, key)
+
+        started = time.perf_counter()
+        try:
+            response = await self.client.aio.models.generate_content(
+                model=model,
+                contents=contents,
+                config=config,
+            )
+        except Exception as e:
+            self.record(route, time.perf_counter() - started, error=True)
+            if cassette:
+                cassette.record(MODEL, key, error={"type": type(e).__name__, "message": str(e)},
+                                duration=time.perf_counter() - started)
+            raise
+        latency = time.perf_counter() - started
+        self.record(route, latency, usage=getattr(response, "usage_metadata", None))
+        if cassette:
+            cassette.record(MODEL, key, response=response.model_dump(mode="json", exclude_none=True), duration=latency)
+        return response
+
+    async def _replay(self, route: str, cassette, key: str):
+        from google.genai import types
+
+        interaction = cassette.replay(MODEL, key)
+        await asyncio.sleep(cassette.delay(interaction))
+        if interaction.get("error"):
+            self.record(route, interaction["duration"], error=True)
+            raise RuntimeError(f"Replayed model error: {interaction['error']['message']}")
+        response = types.GenerateContentResponse.model_validate(interaction["response"])
+        self.record(route, interaction["duration"], usage=response.usage_metadata)
+        return response
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                route: {"model": model, **self._stats.get(route, RouteStats()).snapshot()}
+                for route, model in self.routes.items()
+            }
@@ -1,11 +1,43 @@
 import json
 import os
-from typing import Dict, Optional
+import tempfile
+import threading
+from contextlib import contextmanager
+from email.utils import parseaddr
+from typing import Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: rules are only serialized within one process
+    fcntl = None
+
+
+def sender_keys(from_header: str) -> List[str]:
+    """
+    The keys a rule's sender may be saved under for this From header, most
+    specific first: the full header, the address, the display name and "@domain".
+    Lowercased, since rules are matched without case.
+    """
+    name, address = parseaddr(from_header)
+    address = address.lower()
+    keys = [from_header.strip().lower(), address, name.strip().lower()]
+    domain = address.partition("@")[2]
+    if domain:
+        keys.append("@" + domain)
+    return [key for key in keys if key]
+
 
 class PreferenceStore:
     def __init__(self, filepath: str = "preferences.json"):
         self.filepath = filepath
         self.preferences: Dict[str, str] = {}
+        # Bumped on every change so callers can cache anything derived from the rules
+        self.version = 0
+        # (version, lowercased sender -> rule) for match_rule
+        self._index = (None, {})
+        # mtime of the file as last loaded or saved, to notice writes by other processes
+        self._mtime = None
+        self._lock = threading.Lock()
         self.load()
 
     def load(self):
@@ -18,20 +50,72 @@ class PreferenceStore:
                 self.preferences = {}
         else:
             self.preferences = {}
+        self._mtime = self._file_mtime()
+        self.version += 1
+
+    def _file_mtime(self) -> Optional[float]:
+        try:
+            return os.path.getmtime(self.filepath)
+        except OSError:
+            return None
+
+    def reload_if_changed(self) -> bool:
+        """Reloads the rules if another process (e.g. another backend worker) saved them since."""
+        if self._file_mtime() == self._mtime:
+            return False
+        self.load()
+        return True
 
     def save(self):
-        """Saves preferences to the JSON file."""
-        with open(self.filepath, 'w') as f:
-            json.dump(self.preferences, f, indent=4)
+        """Saves preferences to the JSON file, atomically so other processes never read half a file."""
+        directory = os.path.dirname(os.path.abspath(self.filepath))
+        fd, tmp_path = tempfile.mkstemp(prefix=".preferences-", suffix=".json", dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.preferences, f, indent=4)
+            os.replace(tmp_path, self.filepath)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._mtime = self._file_mtime()
 
     def get_rule(self, sender: str) -> Optional[str]:
         """Returns the rule for a specific sender, if any."""
         return self.preferences.get(sender)
 
+    def match_rule(self, from_header: str) -> Optional[str]:
+        """The rule for a From header, whichever way its sender was saved (see sender_keys)."""
+        if self._index[0] != self.version:
+            self._index = (self.version, {sender.strip().lower(): rule for sender, rule in self.preferences.items()})
+        index = self._index[1]
+        for key in sender_keys(from_header or ""):
+            rule = index.get(key)
+            if rule:
+                return rule
+        return None
+
     def set_rule(self, sender: str, action: str):
         """Sets a rule for a specific sender (e.g., 'delete', 'important')."""
-        self.preferences[sender] = action
-        self.save()
+        with self._lock, self._file_lock():
+            # Start from the latest file so rules saved by other workers aren't overwritten
+            self.load()
+            self.preferences[sender] = action
+            self.version += 1
+            self.save()
+
+    @contextmanager
+    def _file_lock(self):
+        """Serializes read-modify-write cycles across processes sharing the file."""
+        if fcntl is None:
+            yield
+            return
+        with open(self.filepath + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
 
     def get_all_rules(self) -> Dict[str, str]:
         """Returns all stored rules."""
@@ -0,0 +1,80 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+# State shared between backend worker processes.
+#
+# With several uvicorn workers, anything kept in module globals exists once
+# per worker. State that workers must agree on lives in SQLite instead:
+# DECLUTTER_STATE_DB holds session token usage and shared cache entries;
+# sessions, jobs and analytics have their own database files. Without
+# DECLUTTER_STATE_DB (a single dev process) the same code runs on an
+# in-memory database.
+
+# How long a write waits for another process's transaction (milliseconds)
+BUSY_TIMEOUT_MS = 5000
+
+
+def state_db_path() -> Optional[str]:
+    return os.getenv("DECLUTTER_STATE_DB") or None
+
+
+def connect(path: Optional[str]) -> sqlite3.Connection:
+    """
+    An autocommit connection usable from any thread (callers serialize access
+    with their own lock). File databases use WAL so readers in one process
+    don't block writers in another.
+    """
+    conn = sqlite3.connect(path or ":memory:", check_same_thread=False, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    if path:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class SharedCache:
+    """Expiring JSON values under (namespace, key), visible to every worker using the same file."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._conn = connect(path)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS shared_cache (namespace TEXT NOT NULL, key TEXT NOT NULL, "
+                               "value TEXT NOT NULL, expires_at REAL NOT NULL, PRIMARY KEY (namespace, key))")
+
+    @property
+    def shared(self) -> bool:
+        """Whether other processes can see these entries."""
+        return self.path is not None
+
+    def get(self, namespace: str, key: str):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM shared_cache WHERE namespace = ? AND key = ? AND expires_at > ?",
+                                     (namespace, key, time.time())).fetchone()
+        return json.loads(row["value"]) if row else None
+
+    def set(self, namespace: str, key: str, value, expires_at: float):
+        with self._lock:
+            self._conn.execute("INSERT INTO shared_cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?) "
+                               "ON CONFLICT(namespace, key) DO UPDATE SET value = excluded.value, "
+                               "expires_at = excluded.expires_at", (namespace, key, json.dumps(value), expires_at))
+            self._conn.execute("DELETE FROM shared_cache WHERE expires_at <= ?", (time.time(),))
+
+    def delete(self, namespace: str, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM shared_cache WHERE namespace = ? AND key = ?", (namespace, key))
+
+
+_shared_cache = None
+
+def get_shared_cache() -> SharedCache:
+    global _shared_cache
+    if _shared_cache is None:
+        _shared_cache = SharedCache(state_db_path())
+    return _shared_cache
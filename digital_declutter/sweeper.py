@@ -0,0 +1,241 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from googleapiclient.errors import HttpError
+
+from .preferences import PreferenceStore, sender_keys
+from .tools.gmail_tool import LIST_PAGE_SIZE
+
+# Rule-driven mailbox sweeper.
+#
+# Saved sender rules only reach the emails the agent happens to look at. The
+# sweeper applies them to the whole mailbox: it lists messages a page at a
+# time, fetches only each message's From header, matches it against the rules
+# locally and applies the page's actions with one batchModify per action.
+# The default listing is all mail including trash, which the sweep's own
+# archives and trashes don't change, so page tokens stay valid; messages that
+# are already archived or trashed are skipped. After every page it
+# checkpoints the next page token and its counters, so an interrupted sweep
+# resumes where it stopped. Memory stays bounded by one page, and all calls
+# go through the Gmail quota scheduler.
+#
+#   python -m digital_declutter.sweeper [--account ACCOUNT] [--dry-run] [--reset]
+
+# rule -> sweep action; other rules (e.g. always_important) don't move mail
+SWEEP_RULES = {"always_archive": "archive", "always_trash": "trash", "always_delete": "trash"}
+# action -> (labels to add, labels to remove)
+ACTION_LABELS = {"archive": ((), ("INBOX",)), "trash": (("TRASH",), ())}
+# Header fetches in flight at once; the scheduler still paces them to the quota
+FETCH_CONCURRENCY = 8
+
+
+def already_applied(action: str, label_ids) -> bool:
+    """Whether a message's labels already reflect the action (trashed mail counts as archived)."""
+    if action == "archive":
+        return "INBOX" not in label_ids or "TRASH" in label_ids
+    return "TRASH" in label_ids
+
+
+class RuleMatcher:
+    """
+    Matches From headers against sender rules with dict lookups.
+
+    A rule's sender can be the full header ("Name <a@b.com>"), the address,
+    the display name, or "@domain" for a whole domain; case is ignored.
+    Only the rules that move mail are kept.
+    """
+
+    def __init__(self, rules: Dict[str, str]):
+        self.actions = {sender.strip().lower(): SWEEP_RULES[rule]
+                        for sender, rule in rules.items() if rule in SWEEP_RULES}
+
+    def __len__(self):
+        return len(self.actions)
+
+    def match(self, from_header: Optional[str]) -> Optional[str]:
+        """The sweep action for a sender, or None."""
+        if not from_header or not self.actions:
+            return None
+        for key in sender_keys(from_header):
+            action = self.actions.get(key)
+            if action:
+                return action
+        return None
+
+
+def rules_fingerprint(rules: Dict[str, str]) -> str:
+    return hashlib.sha256(json.dumps(rules, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def load_checkpoint(path: str) -> Optional[dict]:
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_checkpoint(path: str, checkpoint: dict):
+    """Replaces the checkpoint atomically, so an interrupted write never loses progress."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".sweep-", suffix=".json", dir=directory)
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(checkpoint, f, indent=2)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class Sweeper:
+    def __init__(self, gmail, rules: Dict[str, str], checkpoint_path: str, query: str = "",
+                 dry_run: bool = False, concurrency: int = FETCH_CONCURRENCY, page_size: int = LIST_PAGE_SIZE):
+        self.gmail = gmail
+        self.rules = rules
+        self.matcher = RuleMatcher(rules)
+        self.checkpoint_path = checkpoint_path
+        self.query = query
+        self.dry_run = dry_run
+        self.concurrency = concurrency
+        self.page_size = page_size
+
+    def _new_checkpoint(self) -> dict:
+        return {
+            "query": self.query,
+            "dry_run": self.dry_run,
+            "rules": rules_fingerprint(self.rules),
+            "page_token": None,
+            "done": False,
+            "started_at": time.time(),
+            "updated_at": time.time(),
+            "counts": {"pages": 0, "scanned": 0, "matched": 0, "archive": 0, "trash": 0, "already_applied": 0,
+                       "unreadable": 0},
+        }
+
+    def _checkpoint(self) -> dict:
+        checkpoint = load_checkpoint(self.checkpoint_path)
+        if checkpoint is None:
+            return self._new_checkpoint()
+        if checkpoint["query"] != self.query or checkpoint.get("dry_run") != self.dry_run:
+            raise ValueError(f"{self.checkpoint_path} belongs to a sweep with different options "
+                             f"(query {checkpoint['query']!r}, dry run {checkpoint.get('dry_run')}); "
+                             f"rerun with --reset to start over")
+        if checkpoint["rules"] != rules_fingerprint(self.rules):
+            print("Rules changed since the last run; the new rules apply from here on")
+            checkpoint["rules"] = rules_fingerprint(self.rules)
+        return checkpoint
+
+    def _metadata(self, msg_id: str):
+        """(From header, labels) of a message; (None, []) if it was deleted since the page was listed."""
+        try:
+            record = self.gmail.get_metadata(msg_id, ("From",))
+            return record.header("from") or None, record.label_ids
+        except HttpError as error:
+            if getattr(error.resp, "status", None) == 404:
+                return None, []
+            raise
+
+    def run(self, max_pages: Optional[int] = None) -> dict:
+        """Sweeps until the mailbox (or `max_pages` pages) is done. Returns the checkpoint."""
+        checkpoint = self._checkpoint()
+        if checkpoint["done"]:
+            print(f"Sweep already finished: {checkpoint['counts']} (use --reset to sweep again)")
+            return checkpoint
+        if not len(self.matcher):
+            print("No always_archive/always_trash rules saved; nothing to sweep")
+            return checkpoint
+
+        counts = checkpoint["counts"]
+        started, scanned_before = time.perf_counter(), counts["scanned"]
+        pages = 0
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="sweep") as pool:
+            while max_pages is None or pages < max_pages:
+                ids, next_token = self.gmail.list_message_ids(self.query, checkpoint["page_token"], self.page_size,
+                                                              include_spam_trash=True)
+                matched = {}
+                for msg_id, (sender, label_ids) in zip(ids, pool.map(self._metadata, ids)):
+                    if sender is None:
+                        counts["unreadable"] += 1
+                        continue
+                    action = self.matcher.match(sender)
+                    if action is None:
+                        continue
+                    if already_applied(action, label_ids):
+                        counts["already_applied"] += 1
+                    else:
+                        matched.setdefault(action, []).append(msg_id)
+
+                for action, msg_ids in matched.items():
+                    if not self.dry_run:
+                        self.gmail.batch_modify(msg_ids, *ACTION_LABELS[action])
+                    counts[action] += len(msg_ids)
+                    counts["matched"] += len(msg_ids)
+                counts["scanned"] += len(ids)
+                counts["pages"] += 1
+                pages += 1
+
+                # Only after the page's actions are applied, so a resumed sweep never skips any
+                checkpoint.update(page_token=next_token, done=next_token is None, updated_at=time.time())
+                save_checkpoint(self.checkpoint_path, checkpoint)
+
+                rate = (counts["scanned"] - scanned_before) / max(time.perf_counter() - started, 1e-9)
+                print(f"Page {counts['pages']}: scanned {counts['scanned']}, archived {counts['archive']}, "
+                      f"trashed {counts['trash']} ({rate:.0f} messages/s)")
+                if checkpoint["done"]:
+                    print(f"Sweep finished{' (dry run)' if self.dry_run else ''}: {counts}")
+                    break
+        return checkpoint
+
+
+def default_checkpoint_path(account: Optional[str]) -> str:
+    if account:
+        from .tools.gmail_pool import token_path_for
+        return os.path.join(os.path.dirname(token_path_for(account)), "sweep_checkpoint.json")
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "sweep_checkpoint.json")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply saved always_archive/always_trash rules to the whole mailbox.")
+    parser.add_argument("--account", help="Pooled account to sweep (default: the default account)")
+    parser.add_argument("--query", default="", help="Gmail search query limiting the sweep (default: all mail). "
+                        "Avoid queries the sweep itself changes, like in:inbox, or pages may shift")
+    parser.add_argument("--preferences", default="preferences.json", help="Rules file (default: preferences.json)")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: next to the account's token)")
+    parser.add_argument("--dry-run", action="store_true", help="Count matches without changing anything")
+    parser.add_argument("--reset", action="store_true", help="Discard the checkpoint and start from the beginning")
+    parser.add_argument("--max-pages", type=int, help="Stop after this many pages (resume later)")
+    args = parser.parse_args(argv)
+
+    from .tools.gmail_tool import GmailService
+    checkpoint_path = args.checkpoint or default_checkpoint_path(args.account)
+    if args.reset and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    if args.account:
+        from .tools.gmail_pool import token_path_for
+        gmail = GmailService(token_path=token_path_for(args.account))
+    else:
+        gmail = GmailService()
+
+    sweeper = Sweeper(gmail, PreferenceStore(args.preferences).get_all_rules(), checkpoint_path,
+                      query=args.query, dry_run=args.dry_run)
+    try:
+        sweeper.run(max_pages=args.max_pages)
+    except KeyboardInterrupt:
+        print(f"\nInterrupted; progress is saved in {checkpoint_path}. Run the same command again to resume.")
+        return 130
+    except ValueError as e:
+        print(e)
+        return 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
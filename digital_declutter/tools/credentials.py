@@ -0,0 +1,227 @@
+import datetime
+import os
+import random
+import tempfile
+import threading
+from typing import Dict, Optional
+
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+
+# OAuth credential management for long-running processes.
+#
+# A CredentialManager owns one token.json. It refreshes the access token in a
+# background thread a few minutes before it expires, so requests never pay
+# for a synchronous refresh; refreshes are serialized across threads and the
+# token file is replaced atomically. The manager hands out one Credentials
+# object for its whole life and updates it in place, so API clients built
+# with it always see the current token. The interactive browser login is only
+# ever started from a CLI: the backend sets DECLUTTER_INTERACTIVE_AUTH=0 and
+# gets a CredentialsUnavailable error instead.
+
+# If modifying these scopes, delete the file token.json.
+SCOPES = ['https://www.googleapis.com/auth/gmail.modify']
+
+# Refresh this long before the access token expires (seconds)
+REFRESH_MARGIN_SECONDS = 300
+# Retry a failed background refresh after this long, doubling up to the max (seconds)
+RETRY_BASE_SECONDS = 5
+RETRY_MAX_SECONDS = 300
+
+
+class CredentialsUnavailable(RuntimeError):
+    """No valid credentials, and logging in interactively isn't allowed here."""
+
+
+def _utcnow() -> datetime.datetime:
+    # google-auth keeps expiry as naive UTC
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def interactive_auth_allowed() -> bool:
+    return os.getenv("DECLUTTER_INTERACTIVE_AUTH", "1") != "0"
+
+
+class CredentialManager:
+    def __init__(self, token_path: str, credentials_path: str, scopes=SCOPES,
+                 interactive: Optional[bool] = None, refresh_margin: float = REFRESH_MARGIN_SECONDS):
+        self.token_path = token_path
+        self.credentials_path = credentials_path
+        self.scopes = scopes
+        self.interactive = interactive_auth_allowed() if interactive is None else interactive
+        self.refresh_margin = refresh_margin
+        self.creds: Optional[Credentials] = None
+        self.refreshes = 0
+        self._token_mtime = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def get(self) -> Credentials:
+        """Returns valid credentials, loading, refreshing or (in a CLI) logging in as needed."""
+        with self._lock:
+            if self.creds is None:
+                self._load()
+            if not self._fresh(self.creds):
+                self._refresh()
+            return self.creds
+
+    def _fresh(self, creds: Optional[Credentials], margin: float = 0) -> bool:
+        if creds is None or not creds.valid:
+            return False
+        if creds.expiry is None or margin <= 0:
+            return True
+        remaining = (creds.expiry - _utcnow()).total_seconds()
+        return remaining > margin
+
+    def _load(self):
+        if not os.path.exists(self.token_path):
+            print(f"DEBUG: Token file NOT found at {self.token_path}")
+            return
+        try:
+            loaded = Credentials.from_authorized_user_file(self.token_path, self.scopes)
+            self._token_mtime = os.path.getmtime(self.token_path)
+        except Exception as e:
+            print(f"DEBUG: Error loading token: {e}")
+            return
+        self._adopt(loaded)
+
+    def _adopt(self, new: Credentials):
+        """
+        Takes over `new`'s token. After the first load this updates self.creds in
+        place: Gmail clients hold on to that object, and a replaced one would keep
+        the old token and refresh it on its own, outside the lock.
+        """
+        if self.creds is None:
+            self.creds = new
+            return
+        self.creds.token = new.token
+        self.creds.expiry = new.expiry
+        if new.refresh_token:
+            self.creds._refresh_token = new.refresh_token
+
+    def _reload_if_changed(self) -> bool:
+        """Adopts token.json if another process refreshed it since we read it."""
+        try:
+            mtime = os.path.getmtime(self.token_path)
+        except OSError:
+            return False
+        if mtime == self._token_mtime:
+            return False
+        self._load()
+        return self._fresh(self.creds, self.refresh_margin)
+
+    def _refresh(self, margin: float = 0):
+        """Brings self.creds up to date. Caller holds the lock."""
+        if self._reload_if_changed() or self._fresh(self.creds, margin):
+            return
+
+        if self.creds and self.creds.refresh_token:
+            print("DEBUG: Refreshing access token...")
+            try:
+                self.creds.refresh(Request())
+                self.refreshes += 1
+                self._save()
+                return
+            except Exception as e:
+                print(f"DEBUG: Refresh failed: {e}")
+                if not self.interactive:
+                    raise CredentialsUnavailable(
+                        f"Couldn't refresh the Gmail token at {self.token_path}: {e}") from e
+
+        if not self.interactive:
+            raise CredentialsUnavailable(
+                f"No usable Gmail token at {self.token_path}, and interactive login is disabled in server "
+                f"mode. Log in from the command line first: python -m digital_declutter.tools.gmail_tool "
+                f"(default account) or python -m digital_declutter.tools.gmail_pool login <account>.")
+
+        if not os.path.exists(self.credentials_path):
+            raise FileNotFoundError(f"Credentials file not found at {self.credentials_path}. Please download it from Google Cloud Console.")
+
+        from google_auth_oauthlib.flow import InstalledAppFlow
+        print("DEBUG: Launching local server for OAuth...")
+        flow = InstalledAppFlow.from_client_secrets_file(self.credentials_path, self.scopes)
+        self._adopt(flow.run_local_server(port=0))
+        self._save()
+
+    def _save(self):
+        """Writes token.json atomically, so a crash or a concurrent reader never sees half a file."""
+        directory = os.path.dirname(os.path.abspath(self.token_path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".token-", suffix=".json", dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.creds.to_json())
+            os.chmod(tmp_path, 0o600)
+            os.replace(tmp_path, self.token_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._token_mtime = os.path.getmtime(self.token_path)
+        print(f"DEBUG: Saved token to {self.token_path}")
+
+    # --- Background refresh ---
+
+    def seconds_until_refresh(self) -> float:
+        with self._lock:
+            if self.creds is None or self.creds.expiry is None:
+                return RETRY_MAX_SECONDS
+            remaining = (self.creds.expiry - _utcnow()).total_seconds()
+        return max(0.0, remaining - self.refresh_margin)
+
+    def refresh_ahead(self):
+        """Refreshes now if the token expires within the refresh margin."""
+        with self._lock:
+            if self.creds is None:
+                self._load()
+            self._refresh(margin=self.refresh_margin)
+
+    def start_background_refresh(self):
+        """Keeps the token fresh from a daemon thread until stop() is called."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="gmail-token-refresh", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        failures = 0
+        while not self._stop.is_set():
+            # Jitter keeps many accounts (or workers) from refreshing in lockstep
+            wait = self.seconds_until_refresh() if failures == 0 else \
+                min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (failures - 1))
+            if self._stop.wait(wait + random.uniform(0, 5)):
+                return
+            try:
+                self.refresh_ahead()
+                failures = 0
+            except Exception as e:
+                failures += 1
+                print(f"Background token refresh for {self.token_path} failed ({e}); attempt {failures}")
+
+    def stop(self):
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout=5)
+
+
+_managers: Dict[str, CredentialManager] = {}
+_managers_lock = threading.Lock()
+
+def get_credential_manager(token_path: str, credentials_path: str) -> CredentialManager:
+    """Returns the process-wide manager for a token file, so every client shares one refresh."""
+    key = os.path.abspath(token_path)
+    with _managers_lock:
+        manager = _managers.get(key)
+        if manager is None:
+            manager = _managers[key] = CredentialManager(token_path, credentials_path)
+        return manager
+
+def stop_all():
+    """Stops every background refresh thread, e.g. on shutdown."""
+    with _managers_lock:
+        managers = list(_managers.values())
+    for manager in managers:
+        manager.stop()
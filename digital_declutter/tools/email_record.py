@@ -0,0 +1,105 @@
+import base64
+from typing import Dict, Optional
+
+# Maximum body length kept per email, to avoid token limits
+MAX_BODY_CHARS = 2000
+
+
+class EmailRecord:
+    """
+    A single Gmail message.
+
+    Headers are parsed once into a dict. The raw payload is kept and the
+    plain-text body is only decoded the first time `body` is read, so code
+    that only needs sender/subject/date never pays for base64 decoding.
+    """
+
+    __slots__ = ('id', 'thread_id', 'snippet', 'label_ids', 'headers', 'internal_date', '_payload', '_body')
+
+    def __init__(self, id: str, snippet: str = '', headers: Optional[Dict[str, str]] = None,
+                 payload: Optional[dict] = None, thread_id: Optional[str] = None, label_ids=None,
+                 internal_date: Optional[int] = None):
+        self.id = id
+        self.thread_id = thread_id
+        self.snippet = snippet
+        self.label_ids = label_ids or []
+        self.headers = headers or {}
+        # Milliseconds since the epoch at which Gmail received the message
+        self.internal_date = internal_date
+        self._payload = payload
+        self._body = None
+
+    @classmethod
+    def from_api(cls, msg_detail: dict) -> 'EmailRecord':
+        """Builds a record from a `users.messages.get` response."""
+        payload = msg_detail.get('payload', {})
+        headers = {}
+        for h in payload.get('headers', []):
+            # Keep the first occurrence, matching the previous next(...) lookups
+            headers.setdefault(h['name'].lower(), h['value'])
+        return cls(
+            id=msg_detail['id'],
+            snippet=msg_detail.get('snippet', ''),
+            headers=headers,
+            payload=payload,
+            thread_id=msg_detail.get('threadId'),
+            label_ids=msg_detail.get('labelIds'),
+            internal_date=int(msg_detail['internalDate']) if msg_detail.get('internalDate') else None,
+        )
+
+    def header(self, name: str, default: str = '') -> str:
+        return self.headers.get(name.lower(), default)
+
+    @property
+    def subject(self) -> str:
+        return self.headers.get('subject', 'No Subject')
+
+    @property
+    def sender(self) -> str:
+        return self.headers.get('from', 'Unknown Sender')
+
+    @property
+    def date(self) -> str:
+        return self.headers.get('date', 'Unknown Date')
+
+    @property
+    def body(self) -> str:
+        """Plain-text body (falls back to the snippet), decoded on first access."""
+        # Read the payload before checking _body: records can be shared across
+        # threads, and the payload is cleared only after _body is set
+        payload = self._payload
+        if self._body is None:
+            self._body = (_find_plain_text(payload or {}) or self.snippet)[:MAX_BODY_CHARS]
+            # The payload is only needed for the body; let it be freed
+            self._payload = None
+        return self._body
+
+    def to_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'subject': self.subject,
+            'sender': self.sender,
+            'date': self.date,
+            'snippet': self.snippet,
+            'body': self.body,
+        }
+
+    def __repr__(self):
+        return f"EmailRecord(id={self.id!r}, sender={self.sender!r}, subject={self.subject!r})"
+
+
+def _find_plain_text(part: dict, top_level: bool = True) -> Optional[str]:
+    """
+    Depth-first search of a MIME tree for the first non-empty text/plain part.
+    A single-part message is decoded whatever its type.
+    """
+    if 'parts' not in part:
+        data = part.get('body', {}).get('data')
+        if data and (top_level or part.get('mimeType') == 'text/plain'):
+            return base64.urlsafe_b64decode(data).decode('utf-8', errors='replace')
+        return None
+    for child in part['parts']:
+        text = _find_plain_text(child, top_level=False)
+        if text:
+            return text
+    return None
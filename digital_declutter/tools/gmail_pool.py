@@ -0,0 +1,191 @@
+import contextvars
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from .. import metrics
+from .request_coalescing import SingleFlight
+
+# Per-account Gmail clients.
+#
+# The backend can serve several mailboxes at once: each /chat request names an
+# account (its user id), which is bound to the request context like the
+# cancel token, and get_gmail() picks that account's GmailService from this
+# pool. Each account keeps its own API client, credentials (with background
+# refresh), quota scheduler and message cache, so accounts never share cached
+# mail or quota. Idle accounts are evicted by a background sweep (and excess
+# ones, least recently used first, when an account is added).
+#
+# Account tokens live in DECLUTTER_ACCOUNTS_DIR (default digital_declutter/accounts)
+# as <account>/token.json; log an account in with
+#   python -m digital_declutter.tools.gmail_pool login <account>
+
+DEFAULT_ACCOUNT = "default"
+MAX_ACCOUNTS = 32
+# Evict accounts nobody has used for this long (seconds)
+IDLE_TTL_SECONDS = 30 * 60
+# How often the background sweep looks for idle accounts (seconds)
+EVICTION_INTERVAL_SECONDS = 60
+
+_ACCOUNT_PATTERN = re.compile(r"^[A-Za-z0-9._@+-]{1,128}$")
+
+
+def validate_account(account: str) -> str:
+    """Account ids become directory names, so only allow a safe character set."""
+    if not _ACCOUNT_PATTERN.match(account) or account in (".", ".."):
+        raise ValueError(f"Invalid account id '{account}'")
+    return account
+
+
+def accounts_dir() -> str:
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.getenv("DECLUTTER_ACCOUNTS_DIR", os.path.join(project_root, "accounts"))
+
+
+def token_path_for(account: str) -> str:
+    return os.path.join(accounts_dir(), validate_account(account), "token.json")
+
+
+def _build_service(account: str):
+    from .gmail_scheduler import GmailRequestScheduler
+    from .gmail_tool import GmailService
+    # Gmail quota is metered per user, so each account gets its own scheduler
+    return GmailService(token_path=token_path_for(account), scheduler=GmailRequestScheduler(account=account))
+
+
+class GmailServicePool:
+    """LRU pool of GmailService instances keyed by account id."""
+
+    def __init__(self, factory: Callable[[str], object] = _build_service, max_accounts: int = MAX_ACCOUNTS,
+                 idle_ttl: float = IDLE_TTL_SECONDS, background_refresh: bool = False):
+        self.factory = factory
+        self.max_accounts = max_accounts
+        self.idle_ttl = idle_ttl
+        self.background_refresh = background_refresh
+        # account -> (service, last used)
+        self._services = OrderedDict()
+        self._lock = threading.Lock()
+        # Concurrent first requests for an account authenticate it once
+        self._creating = SingleFlight()
+        self.created = 0
+        self.evicted = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def get(self, account: str):
+        validate_account(account)
+        with self._lock:
+            entry = self._services.get(account)
+            if entry is not None:
+                self._services[account] = (entry[0], time.monotonic())
+                self._services.move_to_end(account)
+                return entry[0]
+        return self._creating.do(account, lambda: self._create(account))
+
+    def _create(self, account: str):
+        service = self.factory(account)
+        manager = getattr(service, "credential_manager", None)
+        if self.background_refresh and manager is not None:
+            manager.start_background_refresh()
+        with self._lock:
+            self._services[account] = (service, time.monotonic())
+            self._services.move_to_end(account)
+            self.created += 1
+            evicted = self._evict()
+        self._close(evicted)
+        print(f"Gmail account '{account}' ready ({len(self)} active)")
+        return service
+
+    def _evict(self):
+        """Drops idle and excess accounts. Caller holds the lock; returns the evicted services."""
+        now = time.monotonic()
+        evicted = []
+        for account, (service, last_used) in list(self._services.items()):
+            if len(self._services) > self.max_accounts or now - last_used > self.idle_ttl:
+                del self._services[account]
+                evicted.append((account, service))
+        self.evicted += len(evicted)
+        metrics.GMAIL_ACCOUNTS.set(len(self._services))
+        return evicted
+
+    def _close(self, evicted):
+        for account, service in evicted:
+            # Requests still holding the service keep working; it just stops being kept fresh
+            manager = getattr(service, "credential_manager", None)
+            if manager is not None:
+                manager.stop()
+            metrics.GMAIL_ACCOUNT_EVICTIONS.inc()
+            metrics.GMAIL_RATE.remove(account)
+            print(f"Gmail account '{account}' evicted")
+
+    def evict_idle(self):
+        with self._lock:
+            evicted = self._evict()
+        self._close(evicted)
+
+    def start_idle_eviction(self, interval: float = EVICTION_INTERVAL_SECONDS):
+        """Evicts idle accounts from a daemon thread until close() is called. Idempotent."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run_eviction, args=(interval,),
+                                            name="gmail-pool-eviction", daemon=True)
+            self._thread.start()
+
+    def _run_eviction(self, interval: float):
+        while not self._stop.wait(interval):
+            try:
+                self.evict_idle()
+            except Exception as e:
+                print(f"Gmail account eviction failed: {e}")
+
+    def close(self):
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout=5)
+        with self._lock:
+            evicted = list(self._services.items())
+            self._services.clear()
+            metrics.GMAIL_ACCOUNTS.set(0)
+        self._close([(account, service) for account, (service, _) in evicted])
+
+    def __len__(self):
+        return len(self._services)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"active": len(self._services), "created": self.created, "evicted": self.evicted}
+
+
+_current_account: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "declutter_gmail_account", default=None)
+
+
+def bind_account(account: Optional[str]):
+    """Makes `account` the current request's mailbox. Returns a handle for `reset_account`."""
+    return _current_account.set(validate_account(account) if account else None)
+
+
+def reset_account(handle):
+    _current_account.reset(handle)
+
+
+def current_account() -> Optional[str]:
+    return _current_account.get()
+
+
+if __name__ == "__main__":
+    # python -m digital_declutter.tools.gmail_pool login <account>
+    if len(sys.argv) != 3 or sys.argv[1] != "login":
+        sys.exit("Usage: python -m digital_declutter.tools.gmail_pool login <account>")
+    from .gmail_tool import GmailService
+    path = token_path_for(sys.argv[2])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    GmailService(token_path=path)
+    print(f"Logged in; token saved to {path}")
@@ -0,0 +1,197 @@
+import json
+import random
+import threading
+import time
+from typing import Optional
+
+from .. import metrics
+from ..cancellation import interruptible_sleep, raise_if_cancelled
+
+# Shared request scheduler for Gmail API calls.
+#
+# Gmail meters each user in quota units (250 units/second moving average),
+# and methods cost different amounts. Every call goes through one scheduler
+# that paces requests with a token bucket sized in quota units, retries
+# rate-limit and server errors with jittered exponential backoff, and adapts
+# its rate: it halves on a rate-limit response and creeps back up on success.
+
+# https://developers.google.com/gmail/api/reference/quota
+QUOTA_UNITS = {
+    "messages.list": 5,
+    "messages.get": 5,
+    "messages.trash": 5,
+    "messages.untrash": 5,
+    "messages.modify": 5,
+    "messages.delete": 10,
+    "messages.batchModify": 50,
+    "messages.batchDelete": 50,
+    "threads.get": 10,
+    "history.list": 2,
+    "labels.list": 1,
+    "getProfile": 1,
+}
+DEFAULT_QUOTA_UNITS = 5
+
+USER_QUOTA_PER_SECOND = 250
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+
+
+class TokenBucket:
+    """Thread-safe token bucket whose refill rate can be changed on the fly."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, units: float):
+        """Blocks until `units` tokens are available, then takes them."""
+        units = min(units, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= units:
+                    self.tokens -= units
+                    return
+                wait = (units - self.tokens) / self.rate
+            interruptible_sleep(wait)
+
+    def drain(self):
+        """Empties the bucket, e.g. after the server told us to slow down."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = 0
+
+
+def _status_and_reason(error):
+    """Returns (HTTP status, Google error reason) for an API error, if it has them."""
+    status = getattr(getattr(error, "resp", None), "status", None)
+    reason = None
+    content = getattr(error, "content", None)
+    if content:
+        try:
+            details = json.loads(content.decode() if isinstance(content, bytes) else content)
+            errors = details.get("error", {}).get("errors", [])
+            if errors:
+                reason = errors[0].get("reason")
+        except (ValueError, AttributeError):
+            pass
+    return status, reason
+
+
+class GmailRequestScheduler:
+    """Paces, retries and accounts for Gmail API requests."""
+
+    def __init__(self, max_units_per_second: float = USER_QUOTA_PER_SECOND * 0.8,
+                 min_units_per_second: float = 10, max_retries: int = 5,
+                 base_delay: float = 0.5, max_delay: float = 32.0, account: str = "default"):
+        self.max_rate = max_units_per_second
+        self.min_rate = min_units_per_second
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # One second of burst at the configured rate
+        self.bucket = TokenBucket(rate=max_units_per_second, capacity=max_units_per_second)
+        # Quota is per account, and so is the pacing rate each scheduler reports
+        self._rate_gauge = metrics.GMAIL_RATE.labels(account)
+        self._rate_gauge.set(max_units_per_second)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.throttled = 0
+        self.units_consumed = 0
+
+    def execute(self, request, method: str):
+        """Executes a googleapiclient request, retrying transient failures."""
+        units = QUOTA_UNITS.get(method, DEFAULT_QUOTA_UNITS)
+        attempt = 0
+        while True:
+            # Stop before spending quota on a request nobody is waiting for
+            raise_if_cancelled()
+            self.bucket.acquire(units)
+            with self._lock:
+                self.calls += 1
+                self.units_consumed += units
+            metrics.GMAIL_CALLS.labels(method).inc()
+            metrics.GMAIL_QUOTA_UNITS.labels(method).inc(units)
+            try:
+                response = request.execute()
+            except Exception as error:
+                delay = self._retry_delay(error, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                with self._lock:
+                    self.retries += 1
+                metrics.GMAIL_RETRIES.labels(method).inc()
+                print(f"Gmail {method} failed ({error}); retry {attempt}/{self.max_retries} in {delay:.2f}s")
+                interruptible_sleep(delay)
+                continue
+            self._on_success()
+            return response
+
+    def _retry_delay(self, error, attempt: int) -> Optional[float]:
+        """Returns how long to wait before retrying, or None if the error is final."""
+        if attempt >= self.max_retries:
+            return None
+
+        status, reason = _status_and_reason(error)
+        rate_limited = status == 429 or (status == 403 and reason in RATE_LIMIT_REASONS)
+        if rate_limited:
+            self._on_rate_limited()
+        elif status not in RETRYABLE_STATUSES and not isinstance(error, (ConnectionError, TimeoutError)):
+            return None
+
+        retry_after = getattr(getattr(error, "resp", None), "get", lambda *_: None)("retry-after")
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_delay)
+            except ValueError:
+                pass
+        # Full jitter keeps concurrent retries from synchronizing
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def _on_rate_limited(self):
+        with self._lock:
+            self.throttled += 1
+            self.bucket.rate = max(self.min_rate, self.bucket.rate / 2)
+        metrics.GMAIL_THROTTLED.inc()
+        self._rate_gauge.set(self.bucket.rate)
+        self.bucket.drain()
+
+    def _on_success(self):
+        # Additive increase back towards the configured ceiling
+        if self.bucket.rate < self.max_rate:
+            with self._lock:
+                self.bucket.rate = min(self.max_rate, self.bucket.rate + self.max_rate * 0.02)
+            self._rate_gauge.set(self.bucket.rate)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "retries": self.retries,
+                "throttled": self.throttled,
+                "units_consumed": self.units_consumed,
+                "current_units_per_second": round(self.bucket.rate, 2),
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler() -> GmailRequestScheduler:
+    """Returns the process-wide scheduler shared by every GmailService."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = GmailRequestScheduler()
+        return _scheduler
@@ -1,17 +1,43 @@
 import os
 import datetime
-import base64
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+import functools
+import json
+import time
+import httplib2
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build, build_from_document
 from googleapiclient.errors import HttpError
+from .credentials import SCOPES, get_credential_manager
+from .gmail_scheduler import get_scheduler
+from .email_record import EmailRecord
+from .request_coalescing import SingleFlight, TTLCache
+from ..cancellation import interruptible_sleep
+from .. import tracing
+from ..cassette import GMAIL, get_cassette, make_key
 
-# If modifying these scopes, delete the file token.json.
-SCOPES = ['https://www.googleapis.com/auth/gmail.modify']
+# Largest page messages.list will return
+LIST_PAGE_SIZE = 500
+# Most ids messages.batchModify accepts per call
+BATCH_MODIFY_SIZE = 1000
+
+# How long a hydrated message is reused before it is fetched again (seconds)
+MESSAGE_CACHE_TTL = 120
+
+@functools.lru_cache(maxsize=1)
+def _discovery_document():
+    """The Gmail v1 discovery document bundled with googleapiclient, parsed once per process."""
+    document = discovery_cache.get_static_doc('gmail', 'v1')
+    return json.loads(document) if document else None
+
+def build_gmail_service(creds):
+    """Builds a Gmail API client without fetching or re-parsing the discovery document."""
+    document = _discovery_document()
+    if document is None:
+        return build('gmail', 'v1', credentials=creds, static_discovery=True)
+    return build_from_document(document, credentials=creds)
 
 class GmailService:
-    def __init__(self, credentials_path=None, token_path=None):
+    def __init__(self, credentials_path=None, token_path=None, scheduler=None, service=None):
         print(f"DEBUG: Loading GmailService from {__file__}")
         base_dir = os.path.dirname(os.path.abspath(__file__))
         # Go up one level to digital_declutter root if needed, or assume they are in the same dir as the package
@@ -31,102 +57,113 @@ class GmailService:
             self.token_path = token_path
             
         self.creds = None
-        self.service = None
-        self.authenticate()
+        self.credential_manager = None
+        # A prebuilt API client (e.g. an offline fake) skips authentication entirely
+        self.service = service
+        self.scheduler = scheduler or get_scheduler()
+        # Identical concurrent fetches share one execution; hydrated messages are reused briefly
+        self._inflight = SingleFlight()
+        self._message_cache = TTLCache(ttl=MESSAGE_CACHE_TTL)
+        self.cassette = get_cassette()
+        # Replayed sessions never touch the network, so there is nothing to authenticate
+        if self.service is None and not (self.cassette and self.cassette.replaying):
+            self.authenticate()
 
     def authenticate(self):
-        """Shows basic usage of the Gmail API.
-        Lists the user's Gmail labels.
+        """Loads OAuth credentials, refreshing them if needed, and builds the Gmail API client.
+
+        Credentials come from the process-wide manager for this token file,
+        which keeps them fresh in the background once the backend starts it.
         """
-        print(f"DEBUG: Checking for token at {self.token_path}")
-        if os.path.exists(self.token_path):
-            print("DEBUG: Token file found.")
-            try:
-                self.creds = Credentials.from_authorized_user_file(self.token_path, SCOPES)
-            except Exception as e:
-                print(f"DEBUG: Error loading token: {e}")
-                self.creds = None
-        else:
-            print("DEBUG: Token file NOT found.")
-        
-        # If there are no (valid) credentials available, let the user log in.
-        if not self.creds or not self.creds.valid:
-            print("DEBUG: Credentials invalid or missing. Starting auth flow...")
-            if self.creds and self.creds.expired and self.creds.refresh_token:
-                print("DEBUG: Refreshing expired token...")
-                try:
-                    self.creds.refresh(Request())
-                except Exception as e:
-                    print(f"DEBUG: Refresh failed: {e}. forcing new login.")
-                    self.creds = None
-            
-            if not self.creds:
-                if not os.path.exists(self.credentials_path):
-                    raise FileNotFoundError(f"Credentials file not found at {self.credentials_path}. Please download it from Google Cloud Console.")
-                
-                print("DEBUG: Launching local server for OAuth...")
-                flow = InstalledAppFlow.from_client_secrets_file(
-                    self.credentials_path, SCOPES)
-                self.creds = flow.run_local_server(port=0)
-            
-            # Save the credentials for the next run
-            print(f"DEBUG: Saving new token to {self.token_path}")
-            with open(self.token_path, 'w') as token:
-                token.write(self.creds.to_json())
+        self.credential_manager = get_credential_manager(self.token_path, self.credentials_path)
+        self.creds = self.credential_manager.get()
 
         try:
-            self.service = build('gmail', 'v1', credentials=self.creds)
+            self.service = build_gmail_service(self.creds)
             print("DEBUG: Gmail service built successfully.")
         except HttpError as error:
             print(f'An error occurred: {error}')
 
+    def _call(self, method, key_params=None, **params):
+        """
+        Calls a `users.*` API method (e.g. 'messages.get') for the current user.
+
+        Requests go through the shared quota-aware scheduler, and are recorded
+        to or replayed from the cassette when one is configured. `key_params`
+        override params in the cassette key, for values such as today's date
+        that differ between recording and replay.
+        """
+        with tracing.span(f"gmail {method}", "gmail", method=method) as span:
+            response = self._execute(method, params, key_params)
+            if span:
+                span.set(response_bytes=tracing.payload_size(response))
+            return response
+
+    def _execute(self, method, params, key_params=None):
+        key = make_key(method, {**params, **(key_params or {})}) if self.cassette else None
+        if self.cassette and self.cassette.replaying:
+            return self._replay(key)
+
+        resource = self.service.users()
+        *path, name = method.split('.')
+        for part in path:
+            resource = getattr(resource, part)()
+        request = getattr(resource, name)(userId='me', **params)
+
+        started = time.perf_counter()
+        try:
+            response = self.scheduler.execute(request, method)
+        except HttpError as error:
+            if self.cassette:
+                content = error.content.decode('utf-8', errors='replace') if isinstance(error.content, bytes) else error.content
+                self.cassette.record(GMAIL, key, error={'status': error.resp.status, 'content': content},
+                                     duration=time.perf_counter() - started)
+            raise
+        if self.cassette:
+            self.cassette.record(GMAIL, key, response=response, duration=time.perf_counter() - started)
+        return response
+
+    def _replay(self, key):
+        interaction = self.cassette.replay(GMAIL, key)
+        interruptible_sleep(self.cassette.delay(interaction))
+        error = interaction.get('error')
+        if error:
+            raise HttpError(httplib2.Response({'status': error['status']}), error['content'].encode())
+        return interaction['response']
+
     def fetch_recent_emails(self, days=3, max_results=50):
         """Fetches emails from the last N days."""
-        if not self.service:
+        if not self.service and not (self.cassette and self.cassette.replaying):
             self.authenticate()
 
         # Calculate date query
         date_after = (datetime.datetime.now() - datetime.timedelta(days=days)).strftime('%Y/%m/%d')
-        query = f'after:{date_after} -category:promotions -category:social' # Basic filtering to reduce noise, can be adjusted
+        filters = '-category:promotions -category:social' # Basic filtering to reduce noise, can be adjusted
+        query = f'after:{date_after} {filters}'
+        # Cassettes key the listing on the window, not the date, so a recording replays on any later day
+        key_query = f'days:{days} {filters}'
+
+        return self._inflight.do(('list', query, max_results),
+                                 lambda: self._fetch_query(query, max_results, key_query))
 
+    def _fetch_query(self, query, max_results, key_query=None):
         try:
-            results = self.service.users().messages().list(userId='me', q=query, maxResults=max_results).execute()
-            messages = results.get('messages', [])
+            messages = []
+            page_token = None
+            # Page through the listing; a single call returns at most LIST_PAGE_SIZE ids
+            while len(messages) < max_results:
+                results = self._call(
+                    'messages.list', q=query, pageToken=page_token,
+                    maxResults=min(LIST_PAGE_SIZE, max_results - len(messages)),
+                    key_params={'q': key_query} if key_query else None)
+                messages.extend(results.get('messages', []))
+                page_token = results.get('nextPageToken')
+                if not page_token:
+                    break
             
             email_data = []
             for msg in messages:
-                msg_detail = self.service.users().messages().get(userId='me', id=msg['id'], format='full').execute()
-                payload = msg_detail.get('payload', {})
-                headers = payload.get('headers', [])
-                
-                subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
-                sender = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown Sender')
-                date = next((h['value'] for h in headers if h['name'] == 'Date'), 'Unknown Date')
-                
-                snippet = msg_detail.get('snippet', '')
-                
-                # Simple body extraction (prefer plain text)
-                body = snippet # Default to snippet
-                if 'parts' in payload:
-                    for part in payload['parts']:
-                        if part['mimeType'] == 'text/plain':
-                            data = part['body'].get('data')
-                            if data:
-                                body = base64.urlsafe_b64decode(data).decode()
-                                break
-                elif 'body' in payload:
-                    data = payload['body'].get('data')
-                    if data:
-                        body = base64.urlsafe_b64decode(data).decode()
-
-                email_data.append({
-                    'id': msg['id'],
-                    'subject': subject,
-                    'sender': sender,
-                    'date': date,
-                    'snippet': snippet,
-                    'body': body[:2000] # Truncate body to avoid token limits
-                })
+                email_data.append(self._hydrate(msg['id']))
                 
             return email_data
 
@@ -134,10 +171,64 @@ class GmailService:
             print(f'An error occurred: {error}')
             return []
 
+    def _hydrate(self, msg_id):
+        """Returns the full message, from the short-lived cache when possible."""
+        record = self._message_cache.get(msg_id)
+        if record is not None:
+            return record
+
+        def fetch():
+            msg_detail = self._call('messages.get', id=msg_id, format='full')
+            record = EmailRecord.from_api(msg_detail)
+            self._message_cache.set(msg_id, record)
+            return record
+
+        return self._inflight.do(('get', msg_id), fetch)
+
+    def get_email(self, msg_id):
+        """Fetches a single email by ID, or None if it can't be read."""
+        if not self.service and not (self.cassette and self.cassette.replaying):
+            self.authenticate()
+
+        try:
+            return self._hydrate(msg_id)
+        except HttpError as error:
+            print(f'An error occurred: {error}')
+            return None
+
+    def list_message_ids(self, query='', page_token=None, page_size=LIST_PAGE_SIZE, include_spam_trash=False):
+        """One page of message ids matching `query`. Returns (ids, next page token or None)."""
+        results = self._call('messages.list', q=query, pageToken=page_token, maxResults=page_size,
+                             includeSpamTrash=include_spam_trash)
+        return [m['id'] for m in results.get('messages', [])], results.get('nextPageToken')
+
+    def get_metadata(self, msg_id, names=('From',)):
+        """A record with just the message's labels, date and named headers; its body is never downloaded."""
+        return EmailRecord.from_api(self._call('messages.get', id=msg_id, format='metadata', metadataHeaders=list(names)))
+
+    def get_profile(self):
+        """The mailbox profile: address, message count and current historyId."""
+        return self._call('getProfile')
+
+    def list_history(self, start_history_id, page_token=None):
+        """One page of mailbox changes since `start_history_id` (raises HttpError 404 once it has expired)."""
+        return self._call('history.list', startHistoryId=start_history_id, pageToken=page_token,
+                          historyTypes=['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved'])
+
+    def batch_modify(self, msg_ids, add_label_ids=(), remove_label_ids=()):
+        """Changes labels on many messages, BATCH_MODIFY_SIZE per request."""
+        for start in range(0, len(msg_ids), BATCH_MODIFY_SIZE):
+            chunk = list(msg_ids[start:start + BATCH_MODIFY_SIZE])
+            self._call('messages.batchModify', body={
+                'ids': chunk, 'addLabelIds': list(add_label_ids), 'removeLabelIds': list(remove_label_ids)})
+            for msg_id in chunk:
+                self._message_cache.invalidate(msg_id)
+
     def trash_email(self, msg_id):
         """Moves an email to Trash."""
         try:
-            self.service.users().messages().trash(userId='me', id=msg_id).execute()
+            self._call('messages.trash', id=msg_id)
+            self._message_cache.invalidate(msg_id)
             print(f"Message {msg_id} moved to Trash.")
             return True
         except HttpError as error:
@@ -147,7 +238,8 @@ class GmailService:
     def archive_email(self, msg_id):
         """Archives an email by removing the INBOX label."""
         try:
-            self.service.users().messages().modify(userId='me', id=msg_id, body={'removeLabelIds': ['INBOX']}).execute()
+            self._call('messages.modify', id=msg_id, body={'removeLabelIds': ['INBOX']})
+            self._message_cache.invalidate(msg_id)
             print(f"Message {msg_id} archived.")
             return True
         except HttpError as error:
@@ -159,4 +251,4 @@ if __name__ == '__main__':
     gmail = GmailService()
     emails = gmail.fetch_recent_emails(days=1, max_results=5)
     for email in emails:
-        print(f"Subject: {email['subject']}")
+        print(f"Subject: {email.subject}")
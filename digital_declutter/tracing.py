@@ -0,0 +1,245 @@
+import contextvars
+import json
+import os
+import secrets
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from typing import Optional
+
+# Opt-in request tracing.
+#
+# Each /chat request opens a root span; runner events, tool calls, model calls
+# and outbound Gmail/MCP calls open child spans under whatever span is current
+# (a contextvar, so asyncio tasks and `asyncio.to_thread` workers inherit it).
+# When the root span ends, the whole trace is written as a Chrome-trace JSON
+# file (open it in chrome://tracing or https://ui.perfetto.dev) and/or sent
+# to an OTLP/HTTP collector.
+#
+# Configure with:
+#   DECLUTTER_TRACE_DIR=traces            write one <trace id>.json per request
+#   DECLUTTER_TRACE_MIN_SECONDS=5         only keep requests slower than this (default: 0)
+#   DECLUTTER_TRACE_OTLP=http://localhost:4318   also export to an OTLP collector
+# Tracing is off (and free) unless one of DECLUTTER_TRACE_DIR / DECLUTTER_TRACE_OTLP is set.
+
+_current_span = contextvars.ContextVar("declutter_current_span", default=None)
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent", "name", "category", "attributes", "start_ns", "end_ns", "_token")
+
+    def __init__(self, trace: "Trace", name: str, category: str, parent: Optional["Span"], attributes: dict):
+        self.trace = trace
+        self.span_id = secrets.token_hex(8)
+        self.parent = parent
+        self.name = name
+        self.category = category
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self._token = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    @property
+    def duration(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+
+class Trace:
+    """The spans of one request."""
+
+    def __init__(self):
+        self.trace_id = secrets.token_hex(16)
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def finished_spans(self):
+        with self._lock:
+            return [s for s in self.spans if s.end_ns is not None]
+
+
+def enabled() -> bool:
+    return bool(os.getenv("DECLUTTER_TRACE_DIR") or os.getenv("DECLUTTER_TRACE_OTLP"))
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def current_trace_id() -> Optional[str]:
+    span = _current_span.get()
+    return span.trace.trace_id if span else None
+
+
+def start_span(name: str, category: str = "internal", root: bool = False, **attributes) -> Optional[Span]:
+    """
+    Opens a span under the current one and makes it current.
+
+    Returns None (and records nothing) when tracing is off, or when there is
+    no enclosing request trace and `root` is False.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        if not (root and enabled()):
+            return None
+        trace = Trace()
+    else:
+        trace = parent.trace
+    span = Span(trace, name, category, parent, attributes)
+    trace.add(span)
+    span._token = _current_span.set(span)
+    return span
+
+
+def end_span(span: Optional[Span], **attributes):
+    """Closes a span opened by start_span; exports the trace when it is the root."""
+    if span is None or span.end_ns is not None:
+        return
+    span.attributes.update(attributes)
+    span.end_ns = time.time_ns()
+    try:
+        _current_span.reset(span._token)
+    except ValueError:
+        # Ended from a different context than it was started in (e.g. an ADK callback pair)
+        _current_span.set(span.parent)
+    if span.parent is None:
+        export(span.trace, span)
+
+
+@contextmanager
+def span(name: str, category: str = "internal", root: bool = False, **attributes):
+    s = start_span(name, category, root=root, **attributes)
+    try:
+        yield s
+    except BaseException as e:
+        if s is not None:
+            s.set(error=type(e).__name__)
+        raise
+    finally:
+        end_span(s)
+
+
+def record_span(name: str, category: str, start_ns: int, end_ns: int, **attributes):
+    """Adds an already finished span (e.g. time spent waiting for a runner event) under the current one."""
+    parent = _current_span.get()
+    if parent is None:
+        return
+    s = Span(parent.trace, name, category, parent, attributes)
+    s.start_ns, s.end_ns = start_ns, end_ns
+    parent.trace.add(s)
+
+
+def payload_size(value) -> int:
+    """Approximate serialized size of a request/response, in bytes."""
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    try:
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return 0
+
+# --- Export ---
+
+def _assign_lanes(spans):
+    """
+    Chrome's "complete" events must nest properly within a thread lane, but
+    concurrent tool calls and Gmail fetches overlap. Greedily puts each span on
+    the first lane where it either nests inside the innermost open span or
+    starts after it ended.
+    """
+    lanes = []  # per lane: stack of end times of open spans
+    assignment = {}
+    for s in sorted(spans, key=lambda s: (s.start_ns, -s.end_ns)):
+        for i, stack in enumerate(lanes):
+            while stack and stack[-1] <= s.start_ns:
+                stack.pop()
+            if not stack or stack[-1] >= s.end_ns:
+                stack.append(s.end_ns)
+                assignment[s.span_id] = i
+                break
+        else:
+            lanes.append([s.end_ns])
+            assignment[s.span_id] = len(lanes) - 1
+    return assignment
+
+
+def to_chrome_trace(trace: Trace, root: Span) -> dict:
+    spans = trace.finished_spans()
+    lanes = _assign_lanes(spans)
+    events = [{
+        "name": s.name,
+        "cat": s.category,
+        "ph": "X",
+        "ts": (s.start_ns - root.start_ns) / 1000,
+        "dur": (s.end_ns - s.start_ns) / 1000,
+        "pid": 1,
+        "tid": lanes[s.span_id],
+        "args": {**s.attributes, "span_id": s.span_id, "parent_id": s.parent.span_id if s.parent else None},
+    } for s in spans]
+    return {
+        "traceEvents": events,
+        "displayTimeUnit": "ms",
+        "otherData": {"trace_id": trace.trace_id, "root": root.name, "started": root.start_ns // 1000},
+    }
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(trace: Trace) -> dict:
+    spans = [{
+        "traceId": trace.trace_id,
+        "spanId": s.span_id,
+        "parentSpanId": s.parent.span_id if s.parent else "",
+        "name": s.name,
+        "kind": 3 if s.category in ("gmail", "model", "mcp") else 1,  # CLIENT / INTERNAL
+        "startTimeUnixNano": str(s.start_ns),
+        "endTimeUnixNano": str(s.end_ns),
+        "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in
+                       {**s.attributes, "declutter.category": s.category}.items() if v is not None],
+        **({"status": {"code": 2, "message": str(s.attributes["error"])}} if s.attributes.get("error") else {}),
+    } for s in trace.finished_spans()]
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "digital-declutter"}}]},
+        "scopeSpans": [{"scope": {"name": "digital_declutter.tracing"}, "spans": spans}],
+    }]}
+
+
+def _post_otlp(endpoint: str, body: dict):
+    try:
+        request = urllib.request.Request(
+            endpoint.rstrip("/") + "/v1/traces", data=json.dumps(body, default=str).encode(),
+            headers={"Content-Type": "application/json"}, method="POST")
+        urllib.request.urlopen(request, timeout=5).close()
+    except Exception as e:
+        print(f"Tracing: OTLP export to {endpoint} failed: {e}")
+
+
+def export(trace: Trace, root: Span):
+    if root.duration < float(os.getenv("DECLUTTER_TRACE_MIN_SECONDS", "0")):
+        return
+    trace_dir = os.getenv("DECLUTTER_TRACE_DIR")
+    if trace_dir:
+        os.makedirs(trace_dir, exist_ok=True)
+        path = os.path.join(trace_dir, f"{trace.trace_id}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(to_chrome_trace(trace, root), f, default=str)
+        print(f"Trace written: {path} ({root.name}, {root.duration:.2f}s)")
+    endpoint = os.getenv("DECLUTTER_TRACE_OTLP")
+    if endpoint:
+        # Don't hold up the response on the collector
+        threading.Thread(target=_post_otlp, args=(endpoint, to_otlp(trace)), daemon=True).start()
@@ -0,0 +1,262 @@
+import asyncio
+import json
+import re
+from typing import List, Optional
+
+from .preferences import PreferenceStore
+from .tools.email_record import EmailRecord
+
+# Map-reduce triage for large inboxes.
+#
+# Instead of handing every fetched email to the agent's model in one turn, the
+# emails are sharded into fixed-size batches, each batch is classified by a
+# small model call (with bounded parallelism), and the per-email results are
+# merged back into the categorized Markdown the agent presents.
+
+DEFAULT_BATCH_SIZE = 25
+DEFAULT_MAX_CONCURRENCY = 4
+# Classifications below this confidence are re-checked on the escalation route
+ESCALATION_THRESHOLD = 0.6
+
+CATEGORIES = ["Important", "Promotional", "Spam", "FYI"]
+
+CATEGORY_HEADERS = {
+    "Important": "### 🚨 Important",
+    "Promotional": "### 📢 Promotional",
+    "Spam": "### 🗑️ Spam",
+    "FYI": "### 📋 FYI / Neutral",
+}
+
+# Saved sender rules that decide the category without asking the model
+RULE_CATEGORIES = {
+    "always_important": "Important",
+    "always_archive": "Promotional",
+    "promotional": "Promotional",
+    "always_trash": "Spam",
+    "always_delete": "Spam",
+}
+
+BATCH_PROMPT = """You are triaging emails. Classify each email into exactly one category:
+- Important: personal emails, work updates, security alerts, bills.
+- Promotional: newsletters, marketing, sales, job alerts.
+- Spam: obvious junk.
+- FYI: notifications, social updates, receipts.
+
+Return ONLY a JSON list with one object per email, in the same order:
+[{{"id": "<email id>", "category": "<category>", "summary": "<one short sentence>", "confidence": <0.0-1.0>}}]
+
+Emails:
+{emails}
+"""
+
+
+def shard_emails(emails: List[EmailRecord], batch_size: int = DEFAULT_BATCH_SIZE) -> List[List[EmailRecord]]:
+    """Splits emails into consecutive batches of at most `batch_size`."""
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+    return [emails[i:i + batch_size] for i in range(0, len(emails), batch_size)]
+
+
+def build_batch_prompt(emails: List[EmailRecord]) -> str:
+    """Renders a batch of emails into the classification prompt."""
+    lines = []
+    for email in emails:
+        lines.append(json.dumps({
+            "id": email.id,
+            "from": email.sender,
+            "subject": email.subject,
+            "snippet": email.snippet[:200],
+        }, ensure_ascii=False))
+    return BATCH_PROMPT.format(emails="\n".join(lines))
+
+
+def parse_batch_response(text: str, emails: List[EmailRecord]) -> List[dict]:
+    """Parses the model's JSON answer, tolerating code fences and missing entries."""
+    cleaned = re.sub(r"^```(?:json)?|```$", "", (text or "").strip(), flags=re.MULTILINE).strip()
+    try:
+        items = json.loads(cleaned)
+    except json.JSONDecodeError:
+        items = []
+    if isinstance(items, dict):
+        items = items.get("emails", [])
+
+    by_id = {}
+    for item in items:
+        if isinstance(item, dict) and "id" in item:
+            by_id[str(item["id"])] = item
+
+    results = []
+    for email in emails:
+        item = by_id.get(email.id, {})
+        category = item.get("category", "FYI")
+        if category not in CATEGORIES:
+            category = "FYI"
+        try:
+            confidence = float(item.get("confidence", 1.0 if item else 0.0))
+        except (TypeError, ValueError):
+            confidence = 0.0
+        results.append({
+            "id": email.id,
+            "category": category,
+            "summary": item.get("summary") or email.snippet[:100],
+            "confidence": confidence,
+        })
+    return results
+
+
+class GeminiTriageModel:
+    """
+    Classifies a batch of emails with one call on the router's `classify` route.
+
+    Emails classified with low confidence are re-checked together in a single
+    call on the `escalate` route.
+    """
+
+    def __init__(self, router=None, escalation_threshold: float = ESCALATION_THRESHOLD):
+        self._router = router
+        self.escalation_threshold = escalation_threshold
+
+    @property
+    def router(self):
+        if self._router is None:
+            from .model_router import ModelRouter
+            self._router = ModelRouter()
+        return self._router
+
+    async def _classify(self, route: str, emails: List[EmailRecord]) -> List[dict]:
+        from google.genai import types
+
+        response = await self.router.generate(
+            route,
+            build_batch_prompt(emails),
+            config=types.GenerateContentConfig(
+                response_mime_type="application/json",
+                temperature=0,
+            ),
+        )
+        return parse_batch_response(response.text, emails)
+
+    async def classify_batch(self, emails: List[EmailRecord]) -> List[dict]:
+        results = await self._classify("classify", emails)
+
+        unsure_ids = {item['id'] for item in results if item['confidence'] < self.escalation_threshold}
+        if unsure_ids:
+            unsure = [email for email in emails if email.id in unsure_ids]
+            try:
+                rechecked = {item['id']: item for item in await self._classify("escalate", unsure)}
+            except Exception as e:
+                print(f"Triage escalation failed, keeping first-pass results: {e}")
+                rechecked = {}
+            results = [rechecked.get(item['id'], item) for item in results]
+        return results
+
+
+class FakeTriageModel:
+    """Local stand-in for the triage model, for tests and offline runs.
+
+    Classifies by keyword and can simulate per-call latency. It also records
+    how many batches it saw and the peak number of concurrent calls.
+    """
+
+    KEYWORDS = {
+        "Spam": ["winner", "lottery", "claim your prize", "viagra"],
+        "Promotional": ["newsletter", "sale", "% off", "unsubscribe", "deal", "offer"],
+        "Important": ["urgent", "invoice", "security", "meeting", "deadline", "action required"],
+    }
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def classify_batch(self, emails: List[EmailRecord]) -> List[dict]:
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            return [self._classify(email) for email in emails]
+        finally:
+            self.in_flight -= 1
+
+    def _classify(self, email: EmailRecord) -> dict:
+        text = f"{email.subject} {email.snippet}".lower()
+        category = "FYI"
+        for name, words in self.KEYWORDS.items():
+            if any(word in text for word in words):
+                category = name
+                break
+        return {"id": email.id, "category": category, "summary": email.snippet[:100]}
+
+
+async def triage_emails(
+    emails: List[EmailRecord],
+    model=None,
+    prefs: Optional[PreferenceStore] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+) -> List[dict]:
+    """
+    Classifies emails in parallel batches and returns one result per email.
+
+    Emails from senders with a saved rule are categorized locally and never
+    sent to the model; rules match however the sender was saved (see
+    PreferenceStore.match_rule), as in the sweeper and sender reports. Each result is a dict with the `email` record, its
+    `category` and `summary`, in the original order.
+    """
+    model = model or GeminiTriageModel()
+
+    decided = {}
+    pending = []
+    for email in emails:
+        category = RULE_CATEGORIES.get(prefs.match_rule(email.sender)) if prefs else None
+        if category:
+            decided[email.id] = {"category": category, "summary": email.snippet[:100]}
+        else:
+            pending.append(email)
+
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def run_batch(batch):
+        async with semaphore:
+            try:
+                return await model.classify_batch(batch)
+            except Exception as e:
+                print(f"Triage batch of {len(batch)} failed: {e}")
+                # Keep the emails visible rather than dropping the whole batch
+                return [{"id": email.id, "category": "FYI", "summary": email.snippet[:100]}
+                        for email in batch]
+
+    batch_results = await asyncio.gather(*(run_batch(batch) for batch in shard_emails(pending, batch_size)))
+    for results in batch_results:
+        for item in results:
+            decided[item['id']] = item
+
+    merged = []
+    for email in emails:
+        item = decided.get(email.id, {"category": "FYI", "summary": email.snippet[:100]})
+        merged.append({"email": email, "category": item['category'], "summary": item['summary']})
+    return merged
+
+
+def render_triage_markdown(results: List[dict]) -> str:
+    """Groups triage results by category in the agent's presentation format."""
+    if not results:
+        return "No emails found."
+
+    grouped = {category: [] for category in CATEGORIES}
+    for item in results:
+        grouped.setdefault(item['category'], []).append(item)
+
+    sections = [f"Triaged {len(results)} emails:"]
+    for category, items in grouped.items():
+        if not items:
+            continue
+        lines = [f"{CATEGORY_HEADERS.get(category, '### ' + category)} ({len(items)})"]
+        for item in items:
+            email = item['email']
+            lines.append(f"*   **{email.sender}**: **{email.subject}** ({email.date}) - _{item['summary']}_ [ID: {email.id}]")
+        sections.append("\n".join(lines))
+    return "\n\n".join(sections)
@@ -0,0 +1,221 @@
+import contextvars
+import json
+import os
+import threading
+from typing import Dict, Optional
+
+# Token and cost accounting.
+#
+# Every model call (the agent loop and the triage/compose routes) reports its
+# usage metadata through ModelRouter.record, which adds it to the Usage bound
+# to the current /chat request. The backend rolls request usage up into
+# per-session totals, returns both with each response and can refuse
+# sessions that go over DECLUTTER_SESSION_TOKEN_BUDGET. Session totals live
+# in SessionUsageStore, so every backend worker enforces the same budget.
+
+# USD per 1M tokens: (input, cached input, output). Output includes thinking tokens.
+# https://ai.google.dev/gemini-api/docs/pricing
+PRICING = {
+    "gemini-2.5-flash-lite": (0.10, 0.025, 0.40),
+    "gemini-2.5-flash": (0.30, 0.075, 2.50),
+    "gemini-2.5-pro": (1.25, 0.31, 10.00),
+    "gemini-2.0-flash": (0.10, 0.025, 0.40),
+}
+
+BUDGET_EXCEEDED_MESSAGE = "_(Stopped early: this conversation has used up its token budget.)_"
+
+# Rough characters-per-token ratio for estimating prompt composition locally
+CHARS_PER_TOKEN = 4
+
+
+def token_counts(usage_metadata) -> tuple:
+    """(input, cached, output) tokens of a response's usage metadata. Cached tokens are part of input."""
+    if usage_metadata is None:
+        return 0, 0, 0
+    input_tokens = getattr(usage_metadata, "prompt_token_count", None) or 0
+    cached_tokens = getattr(usage_metadata, "cached_content_token_count", None) or 0
+    output_tokens = (getattr(usage_metadata, "candidates_token_count", None) or 0) + \
+                    (getattr(usage_metadata, "thoughts_token_count", None) or 0)
+    return input_tokens, cached_tokens, output_tokens
+
+
+def estimate_cost(model: str, input_tokens: int, cached_tokens: int, output_tokens: int) -> float:
+    """Estimated USD cost of a call; 0 for models without a known price."""
+    # Match versioned names like gemini-2.5-flash-preview-09-2025 on the longest known prefix
+    prices = next((PRICING[name] for name in sorted(PRICING, key=len, reverse=True)
+                   if model and model.startswith(name)), None)
+    if prices is None:
+        return 0.0
+    input_price, cached_price, output_price = prices
+    return ((input_tokens - cached_tokens) * input_price + cached_tokens * cached_price
+            + output_tokens * output_price) / 1_000_000
+
+
+class Usage:
+    """Accumulated model usage of a request or a session."""
+
+    def __init__(self, token_limit: Optional[int] = None):
+        # Max input+output tokens this accumulator may reach (None: unlimited)
+        self.token_limit = token_limit
+        self.model_calls = 0
+        self.input_tokens = 0
+        self.cached_tokens = 0
+        self.output_tokens = 0
+        self.cost_usd = 0.0
+        # Estimated composition of the largest agent prompt seen
+        self.prompt_breakdown: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def total_tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+    @property
+    def exhausted(self) -> bool:
+        return self.token_limit is not None and self.total_tokens >= self.token_limit
+
+    def add(self, model: str, usage_metadata):
+        input_tokens, cached_tokens, output_tokens = token_counts(usage_metadata)
+        with self._lock:
+            self.model_calls += 1
+            self.input_tokens += input_tokens
+            self.cached_tokens += cached_tokens
+            self.output_tokens += output_tokens
+            self.cost_usd += estimate_cost(model, input_tokens, cached_tokens, output_tokens)
+
+    def merge(self, other: "Usage"):
+        with self._lock:
+            self.model_calls += other.model_calls
+            self.input_tokens += other.input_tokens
+            self.cached_tokens += other.cached_tokens
+            self.output_tokens += other.output_tokens
+            self.cost_usd += other.cost_usd
+
+    def record_prompt(self, breakdown: Dict[str, int]):
+        with self._lock:
+            if sum(breakdown.values()) > sum(self.prompt_breakdown.values()):
+                self.prompt_breakdown = breakdown
+
+    def to_dict(self) -> dict:
+        data = {
+            "model_calls": self.model_calls,
+            "input_tokens": self.input_tokens,
+            "cached_tokens": self.cached_tokens,
+            "output_tokens": self.output_tokens,
+            "total_tokens": self.total_tokens,
+            "cost_usd": round(self.cost_usd, 6),
+        }
+        if self.prompt_breakdown:
+            data["prompt_breakdown"] = self.prompt_breakdown
+        return data
+
+
+_current_usage: contextvars.ContextVar[Optional[Usage]] = contextvars.ContextVar(
+    "declutter_request_usage", default=None)
+
+
+def bind_usage(usage: Usage):
+    """Makes `usage` the current request's accumulator. Returns a handle for `reset_usage`."""
+    return _current_usage.set(usage)
+
+
+def reset_usage(handle):
+    _current_usage.reset(handle)
+
+
+def current_usage() -> Optional[Usage]:
+    return _current_usage.get()
+
+
+class SessionUsageStore:
+    """
+    Per-session usage totals in SQLite. Adds are single UPSERTs, so workers
+    sharing the database file never lose each other's updates.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        from .shared_state import connect
+        self._conn = connect(path)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS session_usage (user_id TEXT NOT NULL, session_id TEXT NOT NULL, "
+                               "model_calls INTEGER NOT NULL, input_tokens INTEGER NOT NULL, "
+                               "cached_tokens INTEGER NOT NULL, output_tokens INTEGER NOT NULL, "
+                               "cost_usd REAL NOT NULL, PRIMARY KEY (user_id, session_id))")
+
+    def get(self, user_id: str, session_id: str) -> Usage:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM session_usage WHERE user_id = ? AND session_id = ?",
+                                     (user_id, session_id)).fetchone()
+        usage = Usage()
+        if row is not None:
+            usage.model_calls, usage.input_tokens = row["model_calls"], row["input_tokens"]
+            usage.cached_tokens, usage.output_tokens = row["cached_tokens"], row["output_tokens"]
+            usage.cost_usd = row["cost_usd"]
+        return usage
+
+    def add(self, user_id: str, session_id: str, usage: Usage) -> Usage:
+        """Adds a request's usage to its session and returns the new session total."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO session_usage VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(user_id, session_id) DO UPDATE SET "
+                "model_calls = model_calls + excluded.model_calls, input_tokens = input_tokens + excluded.input_tokens, "
+                "cached_tokens = cached_tokens + excluded.cached_tokens, "
+                "output_tokens = output_tokens + excluded.output_tokens, cost_usd = cost_usd + excluded.cost_usd",
+                (user_id, session_id, usage.model_calls, usage.input_tokens, usage.cached_tokens,
+                 usage.output_tokens, usage.cost_usd))
+        return self.get(user_id, session_id)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM session_usage").fetchone()[0]
+
+
+def session_token_budget() -> Optional[int]:
+    """Max input+output tokens per session, from DECLUTTER_SESSION_TOKEN_BUDGET (unset: unlimited)."""
+    budget = os.getenv("DECLUTTER_SESSION_TOKEN_BUDGET")
+    return int(budget) if budget else None
+
+# --- Prompt composition ---
+
+def _chars(value) -> int:
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return len(value)
+    if hasattr(value, "model_dump_json"):
+        return len(value.model_dump_json(exclude_none=True))
+    return len(json.dumps(value, default=str))
+
+
+def prompt_breakdown(llm_request) -> Dict[str, int]:
+    """
+    Estimates how many tokens each part of an agent prompt contributes:
+    the system instruction, tool declarations, conversation history, and
+    each tool's outputs. Largest first.
+    """
+    parts = {"instruction": 0, "tool declarations": 0, "history": 0}
+    config = llm_request.config
+    if config is not None:
+        instruction = config.system_instruction
+        if instruction is not None and not isinstance(instruction, str):
+            instruction = " ".join(p.text or "" for p in getattr(instruction, "parts", None) or [])
+        parts["instruction"] = _chars(instruction)
+        parts["tool declarations"] = sum(_chars(tool) for tool in config.tools or [])
+
+    for content in llm_request.contents or []:
+        for part in content.parts or []:
+            if part.function_response is not None:
+                key = f"tool output: {part.function_response.name}"
+                parts[key] = parts.get(key, 0) + _chars(part.function_response.response)
+            elif part.function_call is not None:
+                parts["history"] += _chars(part.function_call.args) + len(part.function_call.name or "")
+            else:
+                parts["history"] += len(part.text or "")
+
+    tokens = {name: chars // CHARS_PER_TOKEN for name, chars in parts.items() if chars}
+    return dict(sorted(tokens.items(), key=lambda item: item[1], reverse=True))
+
+
+def format_breakdown(breakdown: Dict[str, int], top: int = 5) -> str:
+    return ", ".join(f"{name} ~{tokens}" for name, tokens in list(breakdown.items())[:top])
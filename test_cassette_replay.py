@@ -0,0 +1,59 @@
+import contextlib
+import datetime
+import io
+import os
+import sys
+import tempfile
+
+# Offline check: a Gmail session recorded to a cassette on one day replays by
+# exact key on a later day, rather than falling back to recording order.
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+sys.path.append(os.path.join(os.path.abspath(os.path.dirname(__file__)), "benchmarks"))
+
+from synthetic_mailbox import FakeGmailApi, SyntheticMailbox
+from digital_declutter.cassette import Cassette
+from digital_declutter.tools import gmail_tool
+from digital_declutter.tools.gmail_scheduler import GmailRequestScheduler
+from digital_declutter.tools.gmail_tool import GmailService
+
+
+@contextlib.contextmanager
+def today(year, month, day):
+    class FixedDatetime(datetime.datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return cls(year, month, day, 9, 0, tzinfo=tz)
+
+    module = gmail_tool.datetime
+    gmail_tool.datetime = type("datetime", (), {"datetime": FixedDatetime, "timedelta": datetime.timedelta})
+    try:
+        yield
+    finally:
+        gmail_tool.datetime = module
+
+
+def session(cassette, mailbox):
+    gmail = GmailService(service=FakeGmailApi(mailbox), scheduler=GmailRequestScheduler(max_units_per_second=1e12))
+    gmail.cassette = cassette
+    return [email.id for email in gmail.fetch_recent_emails(days=3, max_results=5)]
+
+
+def test_replay_on_a_later_day():
+    mailbox = SyntheticMailbox(20)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "session.jsonl")
+        with today(2026, 3, 1):
+            recorded = session(Cassette(path, "record"), mailbox)
+
+        output = io.StringIO()
+        with today(2026, 3, 15), contextlib.redirect_stdout(output):
+            replayed = session(Cassette(path, "replay", latency="zero"), mailbox)
+
+        assert replayed == recorded
+        assert "no exact" not in output.getvalue()
+
+
+if __name__ == "__main__":
+    test_replay_on_a_later_day()
+    print("OK")
@@ -0,0 +1,47 @@
+import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+
+# Offline check: when another process rewrites token.json, the Gmail client this
+# process already built must see the new token, not keep the one it was built with.
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+from digital_declutter.tools import credentials
+from digital_declutter.tools.gmail_tool import GmailService
+
+
+def write_token(path, token):
+    expiry = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)
+    with open(path, "w") as f:
+        json.dump({"token": token, "refresh_token": "refresh", "client_id": "id", "client_secret": "secret",
+                   "token_uri": "https://oauth2.googleapis.com/token", "scopes": credentials.SCOPES,
+                   "expiry": expiry.strftime("%Y-%m-%dT%H:%M:%S.%fZ")}, f)
+
+
+def test_client_follows_reloaded_token():
+    with tempfile.TemporaryDirectory() as tmp:
+        token_path = os.path.join(tmp, "token.json")
+        write_token(token_path, "first")
+        gmail = GmailService(credentials_path=os.path.join(tmp, "credentials.json"), token_path=token_path)
+        manager = gmail.credential_manager
+        assert gmail.service._http.credentials is manager.creds
+
+        # Another worker refreshed the token
+        time.sleep(0.01)
+        write_token(token_path, "second")
+        os.utime(token_path, (time.time() + 1, time.time() + 1))
+        manager.refresh_ahead()
+
+        assert manager.creds.token == "second"
+        assert gmail.service._http.credentials is manager.creds
+        assert gmail.service._http.credentials.token == "second"
+        credentials.stop_all()
+
+
+if __name__ == "__main__":
+    test_client_follows_reloaded_token()
+    print("OK")
@@ -0,0 +1,161 @@
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+# Offline checks of background jobs against a temporary SQLite file: claiming
+# by one of two workers, resuming after a restart, cancelling (locally and
+# through another worker) and a cancel racing a finishing job. Two JobStore
+# instances on one file stand in for two backend processes.
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+from digital_declutter.jobs import (CANCELLED, DONE, PENDING, RUNNING, SKIPPED, SUCCEEDED, TERMINAL_STATUSES,
+                                    JobQueue, JobStore)
+from digital_declutter.shared_state import connect
+
+
+def plan(*email_ids):
+    return [{"action": "archive", "email_id": email_id} for email_id in email_ids]
+
+
+def make_queue(store, calls, delay=0.0):
+    """A queue whose archive steps record the email id and take `delay` seconds, one at a time."""
+    async def archive(step):
+        calls.append(step["email_id"])
+        await asyncio.sleep(delay)
+        return "archived"
+    return JobQueue(store, {"archive": archive}, concurrency={"gmail": 1})
+
+
+async def wait_finished(store, job_id, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while store.get(job_id, steps=False)["status"] not in TERMINAL_STATUSES:
+        assert time.monotonic() < deadline, f"job {job_id} didn't finish"
+        await asyncio.sleep(0.01)
+    return store.get(job_id)
+
+
+def test_two_workers_run_each_job_once():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "jobs.db")
+        store_a, store_b = JobStore(path), JobStore(path)
+        for i in range(4):
+            store_a.create(f"job{i}", None, plan(*(f"m{i}-{n}" for n in range(3))))
+
+        async def run():
+            calls = []
+            queue_a, queue_b = make_queue(store_a, calls, 0.01), make_queue(store_b, calls, 0.01)
+            await asyncio.gather(queue_a.start(), queue_b.start())
+            jobs = [await wait_finished(store_a, f"job{i}") for i in range(4)]
+            await asyncio.gather(queue_a.stop(), queue_b.stop())
+            return calls, jobs, {queue_a.owner, queue_b.owner}
+
+        calls, jobs, owners = asyncio.run(run())
+        assert sorted(calls) == sorted(f"m{i}-{n}" for i in range(4) for n in range(3))
+        assert all(job["status"] == SUCCEEDED and job["progress"][DONE] == 3 for job in jobs)
+        assert all(job["owner"] in owners for job in jobs)
+
+
+def test_resume_after_restart():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "jobs.db")
+        store = JobStore(path)
+        store.create("job", None, plan("a", "b", "c"))
+        # A worker claimed the job, finished one step and died
+        assert store.claim("job", "dead-worker")
+        store.finish_step("job", 0, DONE, "archived")
+        connect(path).execute("UPDATE jobs SET heartbeat = ? WHERE id = ?", (time.time() - 3600, "job"))
+
+        async def run():
+            calls = []
+            queue = make_queue(JobStore(path), calls)
+            await queue.start()
+            job = await wait_finished(store, "job")
+            await queue.stop()
+            return calls, job
+
+        calls, job = asyncio.run(run())
+        assert calls == ["b", "c"]
+        assert job["status"] == SUCCEEDED and job["owner"] != "dead-worker"
+
+
+def test_cancel_running_job():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = JobStore(os.path.join(tmp, "jobs.db"))
+
+        async def run():
+            calls = []
+            queue = make_queue(store, calls, delay=0.05)
+            job_id = await queue.submit(plan(*(f"m{n}" for n in range(10))))
+            await asyncio.sleep(0.12)
+            await queue.cancel(job_id)
+            job = await wait_finished(store, job_id)
+            await queue.stop()
+            return calls, job
+
+        calls, job = asyncio.run(run())
+        assert job["status"] == CANCELLED
+        assert 0 < job["progress"][DONE] < 10 and job["progress"][PENDING] == 0
+        assert job["progress"][DONE] + job["progress"][SKIPPED] == 10
+        assert len(calls) < 10
+
+
+def test_cancel_through_another_worker():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "jobs.db")
+        store_a, store_b = JobStore(path), JobStore(path)
+
+        async def run():
+            calls = []
+            runner, other = make_queue(store_a, calls, delay=0.05), make_queue(store_b, [])
+            job_id = await runner.submit(plan(*(f"m{n}" for n in range(10))))
+            await asyncio.sleep(0.12)
+            # The other worker isn't running the job, so the cancel goes through the database
+            assert (await other.cancel(job_id))["status"] == CANCELLED
+            # Wait for the runner itself to wind the job down
+            while job_id in runner._tokens:
+                await asyncio.sleep(0.01)
+            await runner.stop()
+            return calls, job_id
+
+        calls, job_id = asyncio.run(run())
+        job = store_a.get(job_id)
+        # The runner stops before its next step and doesn't overwrite the cancel
+        assert job["status"] == CANCELLED and len(calls) < 10
+        assert job["progress"][PENDING] == 0 and job["progress"][DONE] + job["progress"][SKIPPED] == 10
+
+
+def test_cancel_racing_a_finishing_job():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = JobStore(os.path.join(tmp, "jobs.db"))
+
+        # Cancelled while its last step ran: the owner's finish doesn't overwrite it
+        store.create("cancelled", None, plan("a"))
+        assert store.claim("cancelled", "worker")
+        assert store.cancel_unless_finished("cancelled")
+        assert not store.finish("cancelled", "worker", SUCCEEDED)
+        assert store.status("cancelled") == CANCELLED
+
+        # Finished first: the cancel comes too late
+        store.create("finished", None, plan("a"))
+        assert store.claim("finished", "worker")
+        assert store.finish("finished", "worker", SUCCEEDED)
+        assert not store.cancel_unless_finished("finished")
+        assert store.status("finished") == SUCCEEDED
+
+        # Only the owner of a running job can finish it
+        store.create("owned", None, plan("a"))
+        assert store.claim("owned", "worker") and not store.claim("owned", "other")
+        assert not store.finish("owned", "other", SUCCEEDED)
+        assert store.status("owned") == RUNNING
+
+
+if __name__ == "__main__":
+    test_two_workers_run_each_job_once()
+    test_resume_after_restart()
+    test_cancel_running_job()
+    test_cancel_through_another_worker()
+    test_cancel_racing_a_finishing_job()
+    print("OK")
@@ -0,0 +1,111 @@
+import os
+import sys
+import tempfile
+
+# Offline check of the sender analytics: the initial sync and later history
+# syncs against a fake Gmail API, and the aggregates they produce, in
+# particular domains made of many low-volume senders (each sender alone is
+# under the report threshold).
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+sys.path.append(os.path.join(os.path.abspath(os.path.dirname(__file__)), "benchmarks"))
+
+from synthetic_mailbox import FakeGmailApi, SyntheticMailbox
+from digital_declutter.analytics import SenderAnalytics
+from digital_declutter.tools.gmail_scheduler import GmailRequestScheduler
+from digital_declutter.tools.gmail_tool import GmailService
+
+
+def message(msg_id, sender, unread=False, unsubscribe=False):
+    headers = [{"name": "From", "value": sender}]
+    if unsubscribe:
+        headers.append({"name": "List-Unsubscribe", "value": "<mailto:unsubscribe@example.com>"})
+    return {"id": msg_id, "threadId": msg_id, "labelIds": ["INBOX"] + (["UNREAD"] if unread else []),
+            "snippet": "", "internalDate": "1700000000000", "payload": {"mimeType": "text/plain", "headers": headers}}
+
+
+def make_gmail(messages):
+    mailbox = SyntheticMailbox(0)
+    mailbox.messages.extend(messages)
+    mailbox.by_id.update({msg["id"]: msg for msg in messages})
+    gmail = GmailService(service=FakeGmailApi(mailbox), scheduler=GmailRequestScheduler(max_units_per_second=1e12))
+    return gmail, mailbox
+
+
+def deliver(mailbox, msg):
+    """Adds a message to the mailbox the way Gmail's history reports it."""
+    mailbox.messages.append(msg)
+    mailbox.by_id[msg["id"]] = msg
+    mailbox.history_id += 1
+    mailbox.history.append({"id": str(mailbox.history_id), "messagesAdded": [{"message": {"id": msg["id"]}}]})
+
+
+def test_domain_of_many_small_senders():
+    gmail, _ = make_gmail([
+        message("n1", "A <a@news.com>", unread=True, unsubscribe=True),
+        message("n2", "B <b@news.com>", unread=True, unsubscribe=True),
+        message("n3", "C <c@news.com>"),
+        message("n4", "D <d@news.com>"),
+        message("s1", "Shop <shop@store.com>"),
+        message("s2", "Shop <shop@store.com>"),
+        message("s3", "Shop <shop@store.com>"),
+    ])
+    with tempfile.TemporaryDirectory() as tmp:
+        analytics = SenderAnalytics(os.path.join(tmp, "analytics.db"))
+        status = analytics.sync(gmail)
+        assert status["initial_sync_done"] and status["messages"] == 7
+
+        volume = {row["name"]: row for row in analytics.top("volume", "domain")}
+        assert volume["news.com"]["messages"] == 4 and volume["news.com"]["senders"] == 4
+        assert volume["store.com"]["messages"] == 3
+
+        noise = {row["name"]: row for row in analytics.top("noise", "domain")}
+        assert list(noise) == ["news.com"]
+        assert noise["news.com"]["unread"] == 2 and noise["news.com"]["unsubscribe"] == 2
+
+        # No single news.com sender reaches the threshold on its own
+        assert [row["name"] for row in analytics.top("volume", "sender")] == ["shop@store.com"]
+
+
+def test_history_sync_applies_new_read_and_trashed_mail():
+    gmail, mailbox = make_gmail([message(f"s{i}", "Shop <shop@store.com>", unread=True) for i in range(4)])
+    with tempfile.TemporaryDirectory() as tmp:
+        analytics = SenderAnalytics(os.path.join(tmp, "analytics.db"))
+        analytics.sync(gmail)
+        listed = gmail.service.calls["messages.list"]
+
+        deliver(mailbox, message("s4", "Shop <shop@store.com>", unread=True))
+        gmail.batch_modify(["s0"], remove_label_ids=["UNREAD"])
+        gmail.batch_modify(["s1", "s2"], add_label_ids=["TRASH"])
+        analytics.sync(gmail)
+
+        # Only the history was read; the mailbox wasn't listed again
+        assert gmail.service.calls["messages.list"] == listed
+        [row] = analytics.top("volume", "sender")
+        assert (row["messages"], row["unread"]) == (3, 2)
+
+        # Restored from Trash: counted again
+        gmail.batch_modify(["s1"], remove_label_ids=["TRASH"])
+        assert analytics.sync(gmail)["messages"] == 4
+
+
+def test_initial_sync_runs_once_in_the_background():
+    gmail, _ = make_gmail([message(f"m{i}", f"Sender <s{i}@example.com>") for i in range(5)])
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "analytics.db")
+        analytics, other_worker = SenderAnalytics(path), SenderAnalytics(path)
+
+        assert analytics.start_initial_sync(gmail)
+        # Another process sees the claim and leaves the sync to it
+        assert not other_worker.start_initial_sync(gmail)
+        analytics._sync_thread.join(timeout=10)
+
+        assert analytics.status()["initial_sync_done"] and analytics.status()["messages"] == 5
+        assert not analytics.start_initial_sync(gmail)
+
+
+if __name__ == "__main__":
+    test_domain_of_many_small_senders()
+    test_history_sync_applies_new_read_and_trashed_mail()
+    test_initial_sync_runs_once_in_the_background()
+    print("OK")
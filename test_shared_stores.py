@@ -0,0 +1,91 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# Offline checks of the state backend workers share through SQLite. Two store
+# instances on one temp file, each with its own connection, stand in for two
+# worker processes.
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+from digital_declutter.jobs import QUEUED, RUNNING, SUCCEEDED, JobStore
+from digital_declutter.usage import SessionUsageStore, Usage
+
+
+def request_usage(input_tokens, output_tokens):
+    usage = Usage()
+    usage.model_calls, usage.input_tokens, usage.output_tokens, usage.cost_usd = 1, input_tokens, output_tokens, 0.001
+    return usage
+
+
+def test_concurrent_usage_adds_are_all_counted():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "state.db")
+        stores = [SessionUsageStore(path), SessionUsageStore(path)]
+
+        def add_many(store):
+            for _ in range(100):
+                store.add("user", "session", request_usage(10, 2))
+
+        threads = [threading.Thread(target=add_many, args=(store,)) for store in stores for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for store in stores:
+            total = store.get("user", "session")
+            assert (total.model_calls, total.input_tokens, total.output_tokens) == (400, 4000, 800)
+            assert round(total.cost_usd, 6) == 0.4
+
+
+def test_stale_job_is_taken_over():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "jobs.db")
+        worker_a, worker_b = JobStore(path), JobStore(path)
+        worker_a.create("job", None, [{"action": "archive", "email_id": "m1"}])
+
+        assert worker_a.claim("job", "a")
+        assert not worker_b.claim("job", "b")
+        assert "job" not in worker_b.unfinished()
+
+        # A keeps beating, so B still can't take the job
+        time.sleep(0.05)
+        worker_a.beat("a")
+        assert not worker_b.claim("job", "b", stale_after=0.05)
+
+        # A stopped beating: its heartbeat goes stale and B takes the job over
+        time.sleep(0.1)
+        assert "job" in worker_b.unfinished(stale_after=0.05)
+        assert worker_b.claim("job", "b", stale_after=0.05)
+        assert worker_b.get("job", steps=False)["owner"] == "b"
+        # A's late result doesn't overwrite B's run
+        assert not worker_a.finish("job", "a", SUCCEEDED)
+        assert worker_a.status("job") == RUNNING
+
+
+def test_release_requeues_running_jobs():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "jobs.db")
+        worker_a, worker_b = JobStore(path), JobStore(path)
+        for job_id in ("job1", "job2"):
+            worker_a.create(job_id, None, [{"action": "archive", "email_id": job_id}])
+            assert worker_a.claim(job_id, "a")
+        assert worker_a.finish("job2", "a", SUCCEEDED)
+
+        # Only the still-running job goes back to the queue
+        assert worker_a.release("a") == 1
+        job = worker_b.get("job1", steps=False)
+        assert (job["status"], job["owner"], job["heartbeat"]) == (QUEUED, None, None)
+        assert worker_b.unfinished() == ["job1"]
+        assert worker_b.claim("job1", "b")
+        assert worker_b.status("job2") == SUCCEEDED
+
+
+if __name__ == "__main__":
+    test_concurrent_usage_adds_are_all_counted()
+    test_stale_job_is_taken_over()
+    test_release_requeues_running_jobs()
+    print("OK")
@@ -0,0 +1,102 @@
+import asyncio
+import os
+import sys
+import tempfile
+
+# Offline checks of the map-reduce triage pipeline, using FakeTriageModel in
+# place of Gemini.
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+from digital_declutter.preferences import PreferenceStore
+from digital_declutter.tools.email_record import EmailRecord
+from digital_declutter.triage import FakeTriageModel, parse_batch_response, shard_emails, triage_emails
+
+
+def email(msg_id, sender="Someone <someone@example.com>", subject="Hello", snippet=""):
+    return EmailRecord(msg_id, snippet=snippet, headers={"from": sender, "subject": subject})
+
+
+class FailingModel(FakeTriageModel):
+    """Fails every batch that contains the email with id `fail_id`."""
+
+    def __init__(self, fail_id):
+        super().__init__()
+        self.fail_id = fail_id
+
+    async def classify_batch(self, emails):
+        if any(e.id == self.fail_id for e in emails):
+            raise RuntimeError("model unavailable")
+        return await super().classify_batch(emails)
+
+
+def test_shard_emails():
+    emails = [email(str(i)) for i in range(7)]
+    batches = shard_emails(emails, 3)
+    assert [[e.id for e in batch] for batch in batches] == [["0", "1", "2"], ["3", "4", "5"], ["6"]]
+    assert shard_emails([], 3) == []
+    try:
+        shard_emails(emails, 0)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("batch_size 0 should be rejected")
+
+
+def test_parse_batch_response():
+    emails = [email("a", snippet="first"), email("b", snippet="second")]
+
+    # Code fences, an id the batch doesn't contain, and an unknown category
+    text = ('```json\n[{"id": "b", "category": "Spam", "summary": "junk", "confidence": 0.9},'
+            ' {"id": "zzz", "category": "Important"}, {"id": "a", "category": "Urgent"}]\n```')
+    results = parse_batch_response(text, emails)
+    assert [r["id"] for r in results] == ["a", "b"]
+    assert results[0]["category"] == "FYI"
+    assert results[1] == {"id": "b", "category": "Spam", "summary": "junk", "confidence": 0.9}
+
+    # Malformed JSON: every email falls back to FYI with zero confidence
+    results = parse_batch_response("not json", emails)
+    assert [(r["category"], r["summary"], r["confidence"]) for r in results] == [("FYI", "first", 0.0),
+                                                                                 ("FYI", "second", 0.0)]
+
+    # A missing entry keeps its email, with zero confidence so it gets escalated
+    results = parse_batch_response('{"emails": [{"id": "a", "category": "Promotional"}]}', emails)
+    assert [(r["category"], r["confidence"]) for r in results] == [("Promotional", 1.0), ("FYI", 0.0)]
+
+
+def test_order_rules_and_concurrency():
+    emails = [email(f"m{i}", subject="Big sale" if i % 3 == 0 else "Meeting notes") for i in range(40)]
+    emails.append(email("ruled", sender="News <news@store.com>", subject="Meeting notes"))
+    emails.append(email("domain", sender="Deals <deals@shop.com>", subject="Meeting notes"))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        prefs = PreferenceStore(os.path.join(tmp, "preferences.json"))
+        prefs.set_rule("news@store.com", "always_trash")
+        prefs.set_rule("@shop.com", "promotional")
+
+        model = FakeTriageModel(delay=0.01)
+        results = asyncio.run(triage_emails(emails, model=model, prefs=prefs, batch_size=5, max_concurrency=2))
+
+    assert [r["email"].id for r in results] == [e.id for e in emails]
+    by_id = {r["email"].id: r["category"] for r in results}
+    assert by_id["m0"] == "Promotional" and by_id["m1"] == "Important"
+    # Rules decide locally, whether saved by address or by domain
+    assert by_id["ruled"] == "Spam" and by_id["domain"] == "Promotional"
+    assert model.calls == 8
+    assert model.max_in_flight == 2
+
+
+def test_failed_batch_falls_back_to_fyi():
+    emails = [email(f"m{i}", subject="Meeting notes", snippet=f"snippet {i}") for i in range(6)]
+    results = asyncio.run(triage_emails(emails, model=FailingModel("m4"), batch_size=3))
+
+    assert [r["category"] for r in results] == ["Important"] * 3 + ["FYI"] * 3
+    assert results[4]["summary"] == "snippet 4"
+
+
+if __name__ == "__main__":
+    test_shard_emails()
+    test_parse_batch_response()
+    test_order_rules_and_concurrency()
+    test_failed_batch_falls_back_to_fyi()
+    print("OK")